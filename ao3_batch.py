@@ -0,0 +1,272 @@
+"""
+Export many accounts' reading histories in one run under a shared request budget
+
+    python -m ao3_batch accounts.json -o exports/ [--rpm 20] [--max-active 4] [--resume]
+
+accounts.json is a list of {"username", "password" or "passwordEnv",
+"priority" (a positive number, default 1), "year" (optional)}. Each
+account's items are written to exports/<username>.ndjson. Finished pages
+are recorded in exports/checkpoint.json. A run exports every account from
+scratch; with --resume it skips finished accounts and continues unfinished
+ones where they stopped. The throughput report goes to
+exports/batch_report.json.
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+from ao3_scraper import scrape_ao3_history
+from exporters import NDJSONExporter
+from rate_limiter import RequestBudget
+
+logger = logging.getLogger('ao3_batch')
+
+# Requests per minute shared by every account in a batch
+BATCH_RPM = float(os.environ.get('AO3_BATCH_RPM', 20))
+
+
+@dataclass
+class BatchAccount:
+    """One set of credentials in a batch; higher priority starts first and gets more of the budget"""
+    username: str
+    password: str = field(repr=False)
+    priority: float = 1.0
+    year: int = None
+
+
+def load_accounts(path):
+    """Read BatchAccounts from a JSON list, resolving passwordEnv entries from the environment"""
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    accounts = []
+    for entry in entries:
+        password = entry.get('password')
+        if password is None and entry.get('passwordEnv'):
+            password = os.environ.get(entry['passwordEnv'])
+        if not entry.get('username') or not password:
+            raise ValueError(f'Account entry needs a username and a password or passwordEnv: {entry.get("username")}')
+        try:
+            priority = float(entry.get('priority', 1))
+        except (TypeError, ValueError):
+            priority = None
+        # Also rejects NaN, which compares false to everything
+        if priority is None or not priority > 0:
+            raise ValueError(f'Account {entry["username"]} needs a positive priority, not {entry.get("priority")!r}')
+        accounts.append(BatchAccount(
+            username=entry['username'],
+            password=password,
+            priority=priority,
+            year=int(entry['year']) if entry.get('year') else None
+        ))
+    return accounts
+
+
+class BatchCheckpoint:
+    """Per-account progress (last exported page, item count, done) in a JSON file rewritten after every page"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._state = json.load(f)
+        except FileNotFoundError:
+            self._state = {}
+
+    def get(self, username):
+        with self._lock:
+            return dict(self._state.get(username, {}))
+
+    def record(self, username, **fields):
+        with self._lock:
+            self._state.setdefault(username, {}).update(fields)
+            self._save()
+
+    def reset(self):
+        """Forget every account's progress, so the next run exports them all from the start"""
+        with self._lock:
+            self._state = {}
+            if os.path.exists(self.path):
+                self._save()
+
+    def _save(self):
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=2)
+        os.replace(temporary_path, self.path)
+
+
+class BatchScheduler:
+    """
+    Scrape several accounts at once, interleaving their requests under one budget
+
+    Up to max_active accounts run at a time, started in priority order. Every
+    request they make (login, history pages, work pages) waits for a slot
+    from a shared RequestBudget weighted by priority. While one account
+    sleeps between pages, the others use the budget. With resume, accounts
+    the checkpoint records as finished are skipped and unfinished ones
+    continue after their last exported page; otherwise the checkpoint is
+    cleared and every account is exported again.
+    """
+
+    def __init__(self, accounts, output_dir, requests_per_minute=BATCH_RPM, max_active=4, retries=3,
+                 pace=True, transport=None, resume=False):
+        self.accounts = list(accounts)
+        self.output_dir = output_dir
+        self.resume = resume
+        self.max_active = max_active
+        self.retries = retries
+        self.pace = pace
+        self.transport = transport
+        self.budget = RequestBudget(requests_per_minute)
+        self.checkpoint = BatchCheckpoint(os.path.join(output_dir, 'checkpoint.json'))
+
+    def output_path(self, username):
+        return os.path.join(self.output_dir, re.sub(r'[^\w.-]', '_', username) + '.ndjson')
+
+    def run(self):
+        """Run every account to completion and return the batch report"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        if not self.resume:
+            self.checkpoint.reset()
+        started = time.monotonic()
+        # The pool's queue is first in, first out, so this is also the start order
+        ordered = sorted(self.accounts, key=lambda account: -account.priority)
+        with ThreadPoolExecutor(max_workers=self.max_active, thread_name_prefix='batch') as pool:
+            results = list(pool.map(lambda account: self._run_account(account, started), ordered))
+
+        elapsed = time.monotonic() - started
+        minutes = elapsed / 60 or 1
+        pages = sum(result['pages'] for result in results)
+        requests_sent = sum(result['requests'] for result in results)
+        items = sum(result['items'] for result in results)
+        return {
+            'accounts': results,
+            'total': {
+                'accounts': len(results),
+                'failed': sum(result['status'] == 'error' for result in results),
+                'items': items,
+                'pages': pages,
+                'requests': requests_sent,
+                'elapsedSeconds': round(elapsed, 1),
+                'pagesPerMinute': round(pages / minutes, 2),
+                'requestsPerMinute': round(requests_sent / minutes, 2),
+                'itemsPerMinute': round(items / minutes, 1)
+            }
+        }
+
+    def _run_account(self, account, started):
+        username = account.username
+        saved = self.checkpoint.get(username)
+        result = {
+            'username': username,
+            'priority': account.priority,
+            'status': 'ok',
+            'items': saved.get('items', 0),
+            'pages': 0,
+            'requests': 0,
+            'waitSeconds': 0.0,
+            'startedSeconds': round(time.monotonic() - started, 1),
+            'finishedSeconds': None,
+            'error': None
+        }
+        if saved.get('done'):
+            logger.info('%s already finished in an earlier run; skipping', username)
+            result['status'] = 'skipped'
+            result['finishedSeconds'] = result['startedSeconds']
+            return result
+
+        start_page = saved.get('lastPage', 0) + 1
+        # A retried attempt starts again from start_page; those pages are already on disk
+        written_pages = set()
+        exporter = NDJSONExporter(self.output_path(username), append=start_page > 1)
+        if start_page > 1:
+            logger.info('Resuming %s from page %d', username, start_page)
+
+        throttle = self.budget.job(username, account.priority)
+
+        def on_items(page_number, page_items):
+            if page_number in written_pages:
+                return
+            written_pages.add(page_number)
+            if account.year:
+                page_items = [item for item in page_items if item.visited_year == account.year]
+            exporter.write_items(page_items)
+            result['items'] += len(page_items)
+            result['pages'] += 1
+            self.checkpoint.record(username, lastPage=page_number, items=result['items'])
+
+        try:
+            scrape_ao3_history(
+                username, account.password, account.year,
+                retries=self.retries,
+                on_items=on_items,
+                transport=self.transport,
+                pace=self.pace,
+                throttle=throttle,
+                start_page=start_page
+            )
+            self.checkpoint.record(username, done=True)
+        except Exception as error:
+            logger.error('Batch scrape for %s failed after %d items: %s', username, result['items'], error)
+            result['status'] = 'error'
+            result['error'] = str(error)
+        finally:
+            exporter.close()
+            throttle.close()
+
+        result['requests'] = throttle.requests
+        result['waitSeconds'] = round(throttle.wait_seconds, 1)
+        result['finishedSeconds'] = round(time.monotonic() - started, 1)
+        logger.info('%s %s: %d items, %d pages in %.1fs', username, result['status'], result['items'],
+                    result['pages'], result['finishedSeconds'])
+        return result
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ao3_batch', description='Export several AO3 reading histories')
+    parser.add_argument('accounts', help='JSON file listing the accounts to export')
+    parser.add_argument('-o', '--output-dir', required=True, help='Directory for exports, checkpoint and report')
+    parser.add_argument('--rpm', type=float, default=BATCH_RPM, help='Requests per minute shared by all accounts (AO3_BATCH_RPM)')
+    parser.add_argument('--max-active', type=int, default=4, help='Accounts scraped at the same time')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip accounts finished by an earlier run and continue unfinished ones')
+    parser.add_argument('--log-level', default=os.environ.get('LOG_LEVEL', 'INFO'))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    try:
+        accounts = load_accounts(args.accounts)
+    except (OSError, ValueError) as error:
+        logger.error('Could not load accounts: %s', error)
+        return 2
+
+    scheduler = BatchScheduler(accounts, args.output_dir, args.rpm, args.max_active, args.retries,
+                               resume=args.resume)
+    report = scheduler.run()
+
+    report_path = os.path.join(args.output_dir, 'batch_report.json')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    total = report['total']
+    logger.info('Batch finished: %d accounts, %d items, %d pages in %.1fs (%.2f pages/min); report in %s',
+                total['accounts'], total['items'], total['pages'], total['elapsedSeconds'],
+                total['pagesPerMinute'], report_path)
+    return 1 if total['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
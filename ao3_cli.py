@@ -0,0 +1,142 @@
+"""
+Headless command line entry point for batch exports
+
+    AO3_PASSWORD=... python -m ao3_cli USERNAME -o history.ndjson [--year 2024]
+        [--format ndjson|csv|sqlite|parquet] [--stats stats.json] [--images DIR] [--by-year] [--enrich]
+
+Only the scraper is imported up front; Flask is never loaded and Pillow is
+only imported when --images is given. Items are written page by page as
+they are scraped, except with --enrich, where they are written once the
+scrape (and enrichment) has finished.
+"""
+import argparse
+import getpass
+import json
+import logging
+import os
+import sys
+
+from ao3_scraper import scrape_ao3_history
+from exporters import EXPORTERS, guess_export_format
+
+logger = logging.getLogger('ao3_cli')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ao3_cli', description='Export AO3 reading history')
+    parser.add_argument('username', help='AO3 username (password is read from AO3_PASSWORD or prompted for)')
+    parser.add_argument('-o', '--output', required=True, help='File to export items to')
+    parser.add_argument('--format', choices=sorted(EXPORTERS), help='Export format (default: from file extension)')
+    parser.add_argument('--year', type=int, help='Only export items last visited in this year')
+    parser.add_argument('--stats', help='Also write calculate_statistics output to this JSON file')
+    parser.add_argument('--images', help='Also render stat cards into this directory')
+    parser.add_argument('--by-year', action='store_true',
+                        help='Add per-year statistics (and cards in DIR/<year>/) to the all-time ones')
+    parser.add_argument('--image-format', default='png', choices=['png', 'webp', 'avif'])
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--enrich', action='store_true',
+                        help='Fetch kudos, chapters and completion for works whose blurb lacks them')
+    parser.add_argument('--transport', choices=['requests', 'httpx'],
+                        help='HTTP backend for AO3 requests (AO3_HTTP_TRANSPORT); httpx uses HTTP/2')
+    parser.add_argument('--page-concurrency', type=int,
+                        help='History pages in flight at once after page 1 (AO3_PAGE_CONCURRENCY, default 1)')
+    parser.add_argument('--parse-workers', type=int, help='Parse pages in this many worker processes (AO3_PARSE_WORKERS)')
+    parser.add_argument('--replay', help='Replay a capture file instead of contacting AO3')
+    parser.add_argument('--log-level', default=os.environ.get('LOG_LEVEL', 'INFO'))
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    if args.parse_workers is not None:
+        from parse_pool import configure_parse_pool
+        configure_parse_pool(args.parse_workers)
+
+    if args.transport:
+        from transport import configure_transport
+        configure_transport(args.transport)
+
+    export_format = args.format or guess_export_format(args.output)
+    try:
+        exporter = EXPORTERS[export_format](args.output)
+    except Exception as error:
+        logger.error('Could not open %s for %s export: %s', args.output, export_format, error)
+        return 2
+    written_pages = set()
+    exported = 0
+
+    aggregator = None
+    if (args.stats or args.images) and args.by_year:
+        from history_stats import YearlyStatisticsAggregator
+        aggregator = YearlyStatisticsAggregator()
+    elif args.stats or args.images:
+        from history_stats import StatisticsAggregator
+        aggregator = StatisticsAggregator(year=args.year)
+
+    def export(items):
+        nonlocal exported
+        exporter.write_items(items)
+        exported += len(items)
+        if aggregator:
+            aggregator.add_items(items)
+
+    def on_items(page_number, page_items):
+        # A retried attempt starts again from page 1; those pages are already on disk
+        if page_number in written_pages:
+            return
+        written_pages.add(page_number)
+        if args.year:
+            page_items = [item for item in page_items if item.visited_year == args.year]
+        export(page_items)
+
+    # Enrichment runs after the last page, so enriched rows can only be written once the scrape returns
+    stream_pages = None if args.enrich else on_items
+    try:
+        if args.replay:
+            from capture import replay_scrape
+            history_items = replay_scrape(args.replay, year=args.year, retries=args.retries, on_items=stream_pages,
+                                          enrich=args.enrich, page_concurrency=args.page_concurrency)
+        else:
+            password = os.environ.get('AO3_PASSWORD') or getpass.getpass('AO3 password: ')
+            history_items = scrape_ao3_history(args.username, password, args.year, retries=args.retries,
+                                               on_items=stream_pages, enrich=args.enrich,
+                                               page_concurrency=args.page_concurrency)
+        if args.enrich:
+            export(history_items)
+    except Exception as error:
+        logger.error('Scrape failed after exporting %d items: %s', exported, error)
+        return 1
+    finally:
+        exporter.close()
+        from parse_pool import shutdown_parse_pool
+        shutdown_parse_pool()
+
+    logger.info('Exported %d items to %s (%s)', exported, args.output, export_format)
+
+    if aggregator:
+        statistics = aggregator.result()
+        if args.stats:
+            with open(args.stats, 'w', encoding='utf-8') as f:
+                json.dump(statistics, f, ensure_ascii=False, indent=2)
+            logger.info('Statistics written to %s', args.stats)
+
+        if args.images:
+            from image_generator import generate_all_stat_images, get_stat_image, stat_image_types
+            cards = [(None, image_type) for image_type in generate_all_stat_images(statistics, args.year)]
+            for stat_year, year_statistics in statistics.get('years', {}).items():
+                cards += [(int(stat_year), image_type) for image_type in stat_image_types(year_statistics)]
+
+            for stat_year, image_type in cards:
+                directory = os.path.join(args.images, str(stat_year)) if stat_year else args.images
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, f'{image_type}.{args.image_format}'), 'wb') as f:
+                    f.write(get_stat_image(image_type, args.image_format, year=stat_year))
+            logger.info('Stat images written to %s', args.images)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,657 @@
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
 import random
+import re
+import logging
+import os
 from datetime import datetime
+from functools import lru_cache
+
+from history_item import HistoryItem, StringInterner
+from metrics import HTTP_RESPONSES, RETRIES, SLEEP_SECONDS, WORK_CACHE_LOOKUPS
+from profiling import follow_profiled_thread
+from rate_limiter import parse_retry_after
+from timing import PhaseTimer
+from transport import get_transport
+from work_cache import WORK_CACHE, work_id_from_url
+
+logger = logging.getLogger(__name__)
+
+
+# AO3 renders visit dates as e.g. "5 Mar 2024"
+AO3_DATE_PATTERN = re.compile(r'(\d{1,2}) (Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) (\d{4})')
+MONTHS = {
+    name: number for number, name in enumerate(
+        ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1
+    )
+}
+# Fallback formats tried in order when the fast path doesn't match
+DATE_FORMATS = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
+
+VIEWED_DATE_PATTERN = re.compile(r'(\d{1,2}\s+\w+\s+\d{4})')
+LAST_VISITED_PATTERN = re.compile(r'Last visited:\s*(\d{1,2}\s+\w+\s+\d{4})')
+
+# Most work pages fetched for enrichment in one scrape
+ENRICH_LIMIT = int(os.environ.get('AO3_ENRICH_LIMIT', 100))
+# History pages a scrape may have in flight at once after page 1 (1 = one after another)
+PAGE_CONCURRENCY = int(os.environ.get('AO3_PAGE_CONCURRENCY', 1))
+
+
+def delay(seconds, timings=None):
+    """Sleep for the specified number of seconds, recording it as 'sleep' time in timings"""
+    SLEEP_SECONDS.inc(seconds)
+    if timings is None:
+        time.sleep(seconds)
+        return
+    with timings.span('sleep'):
+        time.sleep(seconds)
+
+
+def page_delay_range(page_number):
+    """(low, high) seconds to wait after history page page_number before the next one"""
+    # Progressive delay that increases with page count
+    # Pages 1-10: 3-6 seconds
+    # Pages 11-20: 5-8 seconds
+    # Pages 21-30: 8-12 seconds
+    # Pages 31+: 12-18 seconds
+    if page_number <= 10:
+        return 3, 6
+    if page_number <= 20:
+        return 5, 8
+    if page_number <= 30:
+        return 8, 12
+    return 12, 18
+
+
+def page_cooldown(page_number):
+    """Extra seconds to wait after history page page_number, on top of its delay"""
+    # Extended cooldown every 10 pages, brief pause every 5
+    if page_number % 10 == 0:
+        return 90
+    if page_number % 5 == 0:
+        return 30
+    return 0
+
+
+class AO3ServerError(Exception):
+    """AO3 answered a login request with a 5xx; the whole attempt is retried"""
+
+
+class ProgressEstimate:
+    """
+    Running estimate of how far through its history pages a scrape is and how long is left
+
+    totalPages comes from the pagination on the fetched pages. Each page
+    still to come is expected to take the measured time per page so far
+    (a moving average of throttle wait, fetch, retries, parse and extract)
+    plus the average of the pacing delay and any 30 or 90 second cooldown
+    scheduled before it. With concurrency > 1 the round trips overlap the
+    pacing, so a page costs whichever of the two is longer. With a year
+    filter the scrape may stop before the last page, so the estimate is an
+    upper bound.
+    """
+
+    # Assumed time per page until the first page has been timed
+    DEFAULT_PAGE_SECONDS = 2.0
+    # Weight of the newest page in the moving average
+    SMOOTHING = 0.3
+
+    def __init__(self, pace=True, concurrency=1):
+        self.pace = pace
+        self.concurrency = concurrency
+        self.total_pages = None
+        self.page_seconds = None
+
+    def page_finished(self, seconds, last_page=None):
+        """Record how long a page took and the last page number its pagination showed"""
+        if self.page_seconds is None:
+            self.page_seconds = seconds
+        else:
+            self.page_seconds += self.SMOOTHING * (seconds - self.page_seconds)
+        if last_page:
+            self.total_pages = last_page
+
+    def pages_done(self, last_page):
+        """Mark the history pages finished at last_page (a year filter can stop before the end)"""
+        self.total_pages = last_page
+
+    def pacing_seconds(self, page_number):
+        """Average pacing wait after page page_number"""
+        if not self.pace:
+            return 0.0
+        low, high = page_delay_range(page_number)
+        return (low + high) / 2 + page_cooldown(page_number)
+
+    def remaining_seconds(self, current_page, extra_requests=0):
+        """Expected seconds until the last page (plus extra_requests more fetches) is done"""
+        if self.total_pages is None:
+            return None
+        page_seconds = self.page_seconds if self.page_seconds is not None else self.DEFAULT_PAGE_SECONDS
+        remaining = 0.0
+        for page_number in range(current_page, self.total_pages):
+            if self.concurrency > 1:
+                remaining += max(self.pacing_seconds(page_number), page_seconds / self.concurrency)
+            else:
+                remaining += self.pacing_seconds(page_number) + page_seconds
+        if self.concurrency > 1 and current_page < self.total_pages:
+            # The last page's own round trip isn't overlapped by anything
+            remaining += page_seconds
+        # Work detail fetches are paced 3-6 seconds apart, like the first ten pages
+        remaining += extra_requests * (page_seconds + (4.5 if self.pace else 0.0))
+        return remaining
+
+    def progress(self, current_page, extra_requests=0):
+        """The totalPages, percent and etaSeconds fields of a progress event"""
+        if self.total_pages is None:
+            return {'totalPages': None, 'percent': 0 if current_page == 0 else None, 'etaSeconds': None}
+        # Histories can grow during a scrape; never report more than 100%
+        total_pages = max(self.total_pages, current_page)
+        return {
+            'totalPages': total_pages,
+            'percent': round(100 * min(current_page / total_pages, 1.0), 1),
+            'etaSeconds': round(self.remaining_seconds(current_page, extra_requests))
+        }
+
+
+class OrderedPageFetcher:
+    """
+    Fetch history pages first_page..last_page up to concurrency at a time, handing them back in page order
+
+    A dispatcher thread starts the pages in order. Before each one it waits
+    for a free slot and then calls pause_after(previous page), so page
+    requests are never started closer together than a sequential scrape's
+    pacing allows (and each still waits its turn in the request budget);
+    only the round trips overlap. fetch(page_number) runs on a worker
+    thread. result(page_number) blocks until that page is done and raises
+    its error, and frees its slot.
+    """
+
+    def __init__(self, fetch, first_page, last_page, concurrency, pause_after):
+        self.first_page = first_page
+        self.last_page = last_page
+        self._fetch = fetch
+        self._pause_after = pause_after
+        self._slots = threading.Semaphore(concurrency)
+        self._futures = {}
+        self._condition = threading.Condition()
+        self._stopped = False
+        # Fetcher threads show up in the scrape's profile when it is profiled
+        self._follow_profile = follow_profiled_thread()
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='page-fetch',
+                                            initializer=self._follow_profile)
+        self._dispatcher = threading.Thread(target=self._dispatch, name='page-dispatch', daemon=True)
+        self._dispatcher.start()
+
+    def covers(self, page_number):
+        return self.first_page <= page_number <= self.last_page
+
+    def _dispatch(self):
+        if self._follow_profile:
+            self._follow_profile()
+        for page_number in range(self.first_page, self.last_page + 1):
+            self._slots.acquire()
+            if self._stopped:
+                return
+            self._pause_after(page_number - 1)
+            with self._condition:
+                if self._stopped:
+                    return
+                self._futures[page_number] = self._executor.submit(self._fetch, page_number)
+                self._condition.notify_all()
+
+    def result(self, page_number):
+        """The fetch result for page_number, waiting for it to be started and finished"""
+        with self._condition:
+            while page_number not in self._futures:
+                self._condition.wait()
+            future = self._futures.pop(page_number)
+        try:
+            return future.result()
+        finally:
+            self._slots.release()
+
+    def close(self):
+        """Stop starting pages and wait for the ones in flight; their results are dropped"""
+        with self._condition:
+            if self._stopped:
+                return
+            self._stopped = True
+            for future in self._futures.values():
+                future.cancel()
+        # Wake a dispatcher waiting for a slot; one in a pacing pause exits when it ends
+        self._slots.release()
+        self._executor.shutdown(wait=True)
+
+
+@lru_cache(maxsize=4096)
+def parse_visit_date(date_text):
+    """
+    Parse a "Last visited" date string, returning a datetime or None
+
+    Most items in a history share a handful of dates, so results are cached
+    by string. The common AO3 format is handled without strptime.
+    """
+    match = AO3_DATE_PATTERN.fullmatch(date_text)
+    if match:
+        try:
+            return datetime(int(match.group(3)), MONTHS[match.group(2)], int(match.group(1)))
+        except ValueError:
+            pass
+
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(date_text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def extract_work_metadata(item, title, link):
+    """
+    Extract the reader-independent fields of one history blurb
+
+    Returns a dict in the API schema without 'lastVisited'; this is what the
+    shared work cache stores.
+    """
+    # Find author
+    author_element = item.find('a', rel='author')
+    author = author_element.get_text(strip=True) if author_element else 'Unknown'
+
+    # Extract word count
+    word_count = 0
+    stats_element = item.find('dd', class_='words')
+    if stats_element:
+        words_text = stats_element.get_text(strip=True).replace(',', '')
+        try:
+            word_count = int(words_text)
+        except ValueError:
+            word_count = 0
+
+    # Extract tags (separated by type)
+    tags = []  # Only freeform tags
+    relationships = []  # Ship tags
+    characters = []  # Character tags
+
+    relationship_elements = item.find_all('li', class_='relationships')
+    for rel_li in relationship_elements:
+        rel_tag = rel_li.find('a', class_='tag')
+        if rel_tag:
+            relationship = rel_tag.get_text(strip=True)
+            relationships.append(relationship)
+
+    character_elements = item.find_all('li', class_='characters')
+    for char_li in character_elements:
+        char_tag = char_li.find('a', class_='tag')
+        if char_tag:
+            characters.append(char_tag.get_text(strip=True))
+
+    freeform_elements = item.find_all('li', class_='freeforms')
+    for free_li in freeform_elements:
+        free_tag = free_li.find('a', class_='tag')
+        if free_tag:
+            tag_text = free_tag.get_text(strip=True)
+            tags.append(tag_text)
+
+    # Extract warnings
+    warnings = []
+    warning_elements = item.find_all('li', class_='warnings')
+    for warn_li in warning_elements:
+        warn_tag = warn_li.find('a', class_='tag')
+        if warn_tag:
+            warnings.append(warn_tag.get_text(strip=True))
+
+    # Extract categories
+    categories = []
+    category_elements = item.find_all('li', class_='categories')
+    for cat_li in category_elements:
+        cat_tag = cat_li.find('a', class_='tag')
+        if cat_tag:
+            categories.append(cat_tag.get_text(strip=True))
+
+    # Extract rating
+    rating_element = item.find('span', class_='rating')
+    if rating_element:
+        rating_text = rating_element.find('span', class_='text')
+        rating = rating_text.get_text(strip=True) if rating_text else 'Not Rated'
+    else:
+        rating = 'Not Rated'
+
+    # Extract fandoms
+    fandoms = []
+    fandom_heading = item.find('h5', class_='fandoms')
+    if fandom_heading:
+        fandom_links = fandom_heading.find_all('a', class_='tag')
+        fandoms = [f.get_text(strip=True) for f in fandom_links]
+
+    return {
+        'title': title,
+        'author': author,
+        'url': f'https://archiveofourown.org{link}',
+        'wordCount': word_count,
+        'tags': tags,
+        'characters': characters,
+        'relationships': relationships,
+        'warnings': warnings,
+        'categories': categories,
+        'rating': rating,
+        'fandoms': fandoms,
+        **extract_work_stats(item)
+    }
+
+
+def extract_work_stats(element):
+    """
+    Read kudos, chapters and completion from a blurb or work page
 
+    Each is None when the markup doesn't show it.
+    """
+    kudos = None
+    kudos_element = element.find('dd', class_='kudos')
+    if kudos_element:
+        try:
+            kudos = int(kudos_element.get_text(strip=True).replace(',', ''))
+        except ValueError:
+            kudos = None
+
+    chapters = None
+    chapters_element = element.find('dd', class_='chapters')
+    if chapters_element:
+        chapters = chapters_element.get_text(strip=True) or None
+
+    # Blurbs mark completion with a required-tags symbol; work pages only show "n/n" chapters
+    complete = None
+    if element.find('span', class_='complete-yes'):
+        complete = True
+    elif element.find('span', class_='complete-no'):
+        complete = False
+    elif chapters and '/' in chapters:
+        written, _, planned = chapters.partition('/')
+        complete = planned != '?' and written == planned
+
+    return {'kudos': kudos, 'chapters': chapters, 'complete': complete}
+
+
+def extract_last_visited(item, title):
+    """Find and parse the "Last visited" date of one history blurb, or return None"""
+    date_text = None
+
+    # Try multiple approaches to find the date
+
+    # Approach 1: Look for h4.viewed with "Last visited:"
+    viewed_heading = item.find('h4', class_='viewed')
+    if viewed_heading:
+        full_heading_text = viewed_heading.get_text()
+        if 'Last visited:' in full_heading_text:
+            date_match = VIEWED_DATE_PATTERN.search(full_heading_text)
+            if date_match:
+                date_text = date_match.group(1)
+
+    # Approach 2: Look for span with datetime attribute
+    if not date_text:
+        datetime_span = item.find('span', {'datetime': True})
+        if datetime_span:
+            date_text = datetime_span.get_text(strip=True)
+
+    # Approach 3: Look in any element with "Last visited" text
+    if not date_text:
+        all_text = item.get_text()
+        if 'Last visited:' in all_text:
+            # Find text after "Last visited:"
+            match = LAST_VISITED_PATTERN.search(all_text)
+            if match:
+                date_text = match.group(1)
+
+    # Approach 4: Look for dd element with date class
+    if not date_text:
+        date_dd = item.find('dd', class_='date')
+        if date_dd:
+            date_text = date_dd.get_text(strip=True)
+
+    if not date_text:
+        logger.debug('No "Last visited" date found for "%s"', title)
+        return None
+
+    logger.debug('Found date text for "%s": "%s"', title, date_text)
+    last_visited = parse_visit_date(date_text)
+    if last_visited:
+        logger.debug('Parsed date for "%s": %s', title, last_visited)
+    else:
+        logger.debug('Could not parse date from text: "%s" for "%s"', date_text, title)
+    return last_visited
+
+
+def extract_history_page(page, page_number=1, encoding=None):
+    """
+    Parse one reading history page and extract its works
 
-def delay(seconds):
-    """Sleep for the specified number of seconds"""
-    time.sleep(seconds)
+    Runs without any scrape state so it can be called in a worker process.
+    Works already in that process's work cache skip blurb extraction and
+    only have their visit date read.
 
+    Args:
+        page: Page HTML, as text or as raw bytes in the given encoding
+        page_number: Page number, used for first-page debugging output
+        encoding: Encoding of page when it is bytes (default UTF-8)
 
-def scrape_ao3_history(username, password, year=None, retries=3, on_progress=None):
+    Returns:
+        (works, has_next, last_page, parse_seconds, extract_seconds, cache_hits),
+        where works are dicts in the API schema, has_next says whether a next
+        page exists, last_page is the highest page number in the pagination
+        (None without pagination) and cache_hits counts works whose metadata
+        came from the work cache instead of the blurb
+    """
+    parse_started = time.perf_counter()
+    if isinstance(page, bytes):
+        page = page.decode(encoding or 'utf-8', errors='replace')
+    soup = BeautifulSoup(page, 'html.parser')
+
+    # Debug: Log what we're seeing
+    page_title = soup.find('title')
+    if page_title:
+        logger.debug('Page title: %s', page_title.get_text(strip=True))
+
+    # Try multiple selector patterns
+    possible_selectors = [
+        'li.reading.work.blurb.group',
+        'ol.reading li.blurb',
+        'li.blurb.work',
+        'li.work.blurb'
+    ]
+
+    work_items = []
+    working_selector = None
+
+    for selector in possible_selectors:
+        if '.' in selector:
+            classes = selector.replace('li.', '').split('.')
+            if selector.startswith('ol.reading'):
+                ol = soup.find('ol', class_='reading')
+                if ol:
+                    items = ol.find_all('li', class_='blurb')
+                    work_items = items
+            else:
+                items = soup.find_all('li', class_=classes)
+                work_items = items
+        else:
+            work_items = soup.find_all(selector)
+
+        logger.debug('Trying selector "%s": found %d items', selector, len(work_items))
+        if len(work_items) > 0:
+            working_selector = selector
+            break
+
+    if not work_items:
+        logger.warning('No items found with any selector.')
+
+    parse_seconds = time.perf_counter() - parse_started
+
+    items_on_page = 0
+    works = []
+
+    # Debug: Save first item HTML on first page
+    if page_number == 1 and len(work_items) > 0 and logger.isEnabledFor(logging.DEBUG):
+        try:
+            debug_dir = '/tmp/cc-agent'
+            os.makedirs(debug_dir, exist_ok=True)
+            debug_path = os.path.join(debug_dir, 'ao3_first_item_debug.html')
+            with open(debug_path, 'w', encoding='utf-8') as f:
+                f.write(str(work_items[0].prettify()))
+            logger.debug('First item HTML saved to %s', debug_path)
+        except Exception as e:
+            logger.warning('Could not save first item debug: %s', e)
+
+    extract_started = time.perf_counter()
+    cache_hits = 0
+    for item in work_items:
+        # Find the title link
+        title_element = item.find('h4', class_='heading')
+        if not title_element:
+            continue
+        title_link = title_element.find('a', href=lambda x: x and '/works/' in x)
+        if not title_link:
+            continue
+
+        title = title_link.get_text(strip=True)
+        link = title_link.get('href')
+        if not title or not link:
+            continue
+
+        # Everything but the visit date is the same in every reader's history
+        work_id = work_id_from_url(link)
+        work = WORK_CACHE.get(work_id) if work_id else None
+        if work is not None:
+            cache_hits += 1
+        else:
+            work = extract_work_metadata(item, title, link)
+            if work_id:
+                WORK_CACHE.put(work_id, work)
+
+        if page_number == 1 and items_on_page == 0 and len(work['tags']) > 0:
+            logger.debug('First item freeform tags: %s', work['tags'])
+
+        last_visited = extract_last_visited(item, title)
+        works.append({**work, 'lastVisited': last_visited.isoformat() if last_visited else None})
+        items_on_page += 1
+
+    # Whether AO3 shows a "Next" link; the caller decides whether to follow it
+    pagination = soup.find('ol', class_='pagination')
+    has_next = pagination is not None and pagination.find('li', class_='next') is not None
+
+    return (works, has_next, last_page_number(pagination), parse_seconds, time.perf_counter() - extract_started,
+            cache_hits)
+
+
+def last_page_number(pagination):
+    """Highest page number listed in an AO3 ol.pagination, or None"""
+    if pagination is None:
+        return None
+    # Long histories are abbreviated as "1 2 ... 9 10 ... 47 48", so the largest number is the last page
+    numbers = [int(text) for text in (li.get_text(strip=True) for li in pagination.find_all('li')) if text.isdigit()]
+    return max(numbers) if numbers else None
+
+
+def enrich_items(session, items, pause, timings, on_progress=None, limit=None, throttle=None,
+                 on_rate_limited=None):
+    """
+    Fill in kudos, chapters and completion for items whose blurb didn't show them
+
+    Works already enriched in the shared work cache are filled in from it;
+    only the remaining works' pages are fetched, one at a time with the same
+    pacing as history pages and at most limit (AO3_ENRICH_LIMIT) per scrape.
+    on_progress is called with (fetched, to_fetch) after each work page.
+    throttle, when given, is called before each fetch, and on_rate_limited
+    with the Retry-After value of a 429. Returns the number of work pages
+    fetched.
+    """
+    if limit is None:
+        limit = ENRICH_LIMIT
+
+    pending = {}
+    for item in items:
+        if item.chapters is not None:
+            continue
+        work_id = work_id_from_url(item.url)
+        if not work_id:
+            continue
+        cached = WORK_CACHE.get(work_id)
+        if cached is not None and cached.get('chapters') is not None:
+            WORK_CACHE_LOOKUPS.inc(stage='enrich', result='hit')
+            _apply_work_stats(item, cached)
+        else:
+            WORK_CACHE_LOOKUPS.inc(stage='enrich', result='miss')
+            pending.setdefault(work_id, []).append(item)
+
+    if not pending:
+        return 0
+    if len(pending) > limit:
+        logger.info('%d works need details; only fetching the first %d', len(pending), limit)
+    logger.info('Fetching details for %s works...', min(len(pending), limit))
+
+    fetched = 0
+    for work_id, work_items in list(pending.items())[:limit]:
+        if fetched:
+            pause(random.uniform(3, 6))
+        fetched += 1
+        if throttle:
+            throttle()
+        try:
+            with timings.span('enrich'):
+                response = session.get(
+                    f'https://archiveofourown.org/works/{work_id}?view_adult=true',
+                    headers={'Referer': 'https://archiveofourown.org/'},
+                    timeout=60
+                )
+            HTTP_RESPONSES.inc(kind='work', status=response.status_code)
+        except requests.exceptions.RequestException as fetch_error:
+            HTTP_RESPONSES.inc(kind='work', status='error')
+            logger.warning('Could not fetch work %s: %s', work_id, fetch_error)
+            continue
+
+        if response.status_code == 429:
+            # Details are optional; don't spend the rate limit the history pages need
+            logger.warning('Rate limited while fetching work details; skipping the rest')
+            if on_rate_limited:
+                on_rate_limited(response.headers.get('retry-after'))
+            break
+        if response.status_code >= 400:
+            logger.debug('Work %s returned %s', work_id, response.status_code)
+            continue
+
+        with timings.span('extract'):
+            # Work pages carry the whole first chapter; only the stats block is parsed
+            stats_soup = BeautifulSoup(response.text, 'html.parser', parse_only=SoupStrainer('dl', class_='stats'))
+            stats = extract_work_stats(stats_soup)
+        WORK_CACHE.update(work_id, **stats)
+        for item in work_items:
+            _apply_work_stats(item, stats)
+
+        if on_progress:
+            on_progress(fetched, min(len(pending), limit))
+
+    return fetched
+
+
+def _apply_work_stats(item, stats):
+    item.kudos = stats.get('kudos')
+    item.chapters = stats.get('chapters')
+    item.complete = stats.get('complete')
+
+
+def parse_page(response, page_number):
+    """Extract a fetched history page, in the parse pool when one is configured"""
+    from parse_pool import parse_workers, parse_in_pool
+
+    if parse_workers():
+        return parse_in_pool(response.content, response.encoding, page_number)
+    return extract_history_page(response.text, page_number)
+
+
+def scrape_ao3_history(username, password, year=None, retries=3, on_progress=None, on_items=None,
+                       timings=None, transport=None, pace=True, enrich=False, throttle=None,
+                       start_page=1, page_concurrency=None):
     """
     Scrape AO3 reading history for a given user
 
@@ -20,30 +661,57 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
         year: Optional year to filter results (int or None)
         retries: Number of retry attempts
         on_progress: Optional callback function for progress updates
+        on_items: Optional callback receiving (page_number, items) for each fetched page
+        timings: Optional PhaseTimer to record per-phase timings into; when omitted
+            the scraper keeps its own and logs the summary itself
+        transport: Optional transport.Transport to send requests through (e.g.
+            capture.ReplayTransport); defaults to the process-wide get_transport()
+        pace: Set to False to skip all pacing and retry delays (offline replay)
+        enrich: Also fetch the work pages of works whose blurb lacked kudos,
+            chapter or completion data and that the work cache can't supply
+        throttle: Optional rate_limiter.BudgetJob. It is called before every
+            request to AO3 and blocks until the shared budget allows it, and
+            its rate_limited() is called on every 429 so all jobs back off
+        start_page: History page to start from, e.g. to resume from a checkpoint
+        page_concurrency: Once the first page has shown the page count, keep up
+            to this many pages in flight on the session (default
+            AO3_PAGE_CONCURRENCY). Pages are still started no faster than the
+            pacing allows, and on_items and on_progress still see them in order
 
     Returns:
-        List of history items
+        List of HistoryItem objects (see history_item.items_to_dicts for the API schema)
     """
+    owns_timings = timings is None
+    if owns_timings:
+        timings = PhaseTimer()
+    if transport is None:
+        transport = get_transport()
+    if page_concurrency is None:
+        page_concurrency = PAGE_CONCURRENCY
+    # Kept across attempts, so a retried attempt starts with the page timings measured so far
+    estimate = ProgressEstimate(pace, page_concurrency)
+
+    def pause(seconds):
+        if pace:
+            delay(seconds, timings)
+
+    def wait_turn():
+        if throttle:
+            with timings.span('throttle'):
+                throttle()
+
+    def report_rate_limited(retry_after):
+        if throttle:
+            throttle.rate_limited(retry_after)
+
     for attempt in range(1, retries + 1):
+        # Started once the page count is known, when page_concurrency > 1
+        page_fetcher = None
         try:
-            print(f"Starting AO3 scraper (attempt {attempt}/{retries})...")
-
-            # Create session for cookie management
-            session = requests.Session()
+            logger.info('Starting AO3 scraper (attempt %d/%d)...', attempt, retries)
 
-            # Configure adapter with retry strategy for SSL errors
-            from requests.adapters import HTTPAdapter
-            from urllib3.util.retry import Retry
-
-            # Create retry strategy
-            retry_strategy = Retry(
-                total=3,
-                backoff_factor=1,
-                status_forcelist=[429, 500, 502, 503, 504],
-            )
-            adapter = HTTPAdapter(max_retries=retry_strategy)
-            session.mount("https://", adapter)
-            session.mount("http://", adapter)
+            # Create session for cookie management; connections are pooled by the transport
+            session = transport.new_session()
 
             # More realistic browser headers to avoid detection
             session.headers.update({
@@ -66,53 +734,59 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
 
             # Small initial delay to appear more natural
             initial_delay = random.uniform(1, 2)
-            print(f'Waiting {initial_delay:.1f} seconds before starting...')
-            delay(initial_delay)
+            logger.debug('Waiting %.1f seconds before starting...', initial_delay)
+            pause(initial_delay)
 
             # Get login page to extract authenticity token
-            print('Fetching login page...')
-            print('Making request to: https://archiveofourown.org/users/login')
+            logger.info('Fetching login page...')
+            logger.debug('Making request to: https://archiveofourown.org/users/login')
 
             try:
-                login_page_response = session.get(
-                    'https://archiveofourown.org/users/login',
-                    timeout=60
-                )
-                print('Login page response status:', login_page_response.status_code)
+                wait_turn()
+                with timings.span('login'):
+                    login_page_response = session.get(
+                        'https://archiveofourown.org/users/login',
+                        timeout=60
+                    )
+                logger.debug('Login page response status: %s', login_page_response.status_code)
+                HTTP_RESPONSES.inc(kind='login_page', status=login_page_response.status_code)
 
                 if login_page_response.status_code == 429:
                     retry_after = login_page_response.headers.get('retry-after')
-                    print('Rate limit detected (429)!')
-                    print('Retry-After header:', retry_after)
+                    logger.warning('Rate limit detected (429)!')
+                    logger.warning('Retry-After header: %s', retry_after)
+                    report_rate_limited(retry_after)
                     raise Exception(f"AO3 returned 429 (Rate Limited). {f'Retry after {retry_after} seconds.' if retry_after else 'Please wait and try again later.'}")
 
                 if login_page_response.status_code == 403:
-                    print('403 Forbidden detected - possible bot detection')
+                    logger.warning('403 Forbidden detected - possible bot detection')
                     raise Exception('AO3 returned 403 Forbidden. This may indicate bot detection or IP blocking. Try again later with a different connection.')
 
                 if login_page_response.status_code == 503:
-                    print('503 Service Unavailable - AO3 may be down')
-                    raise Exception('AO3 is temporarily unavailable (503). Please try again later.')
+                    logger.warning('503 Service Unavailable - AO3 may be down')
+                    raise AO3ServerError('AO3 is temporarily unavailable (503). Please try again later.')
 
                 if login_page_response.status_code == 525:
-                    print('525 SSL Handshake Failed')
+                    logger.warning('525 SSL Handshake Failed')
                     raise Exception('SSL connection failed (525). This may be due to network issues or AO3\'s security settings. Try again in a few minutes or check your internet connection.')
 
                 if login_page_response.status_code >= 400:
-                    print(f'Unexpected status code: {login_page_response.status_code}')
-                    raise Exception(f'AO3 returned error status {login_page_response.status_code}')
+                    logger.warning('Unexpected status code: %s', login_page_response.status_code)
+                    error_class = AO3ServerError if login_page_response.status_code >= 500 else Exception
+                    raise error_class(f'AO3 returned error status {login_page_response.status_code}')
 
                 login_page_response.raise_for_status()
 
             except requests.exceptions.RequestException as fetch_error:
-                print('Failed to fetch login page:', str(fetch_error))
+                HTTP_RESPONSES.inc(kind='login_page', status='error')
+                logger.error('Failed to fetch login page: %s', str(fetch_error))
                 raise
 
             # Verify response is properly decoded (not compressed)
             response_text = login_page_response.text
             if response_text and ord(response_text[0]) > 127:
                 # Response appears to still be compressed
-                print('WARNING: Response appears to be compressed. Content-Encoding:', login_page_response.headers.get('Content-Encoding'))
+                logger.warning('Response appears to be compressed. Content-Encoding: %s', login_page_response.headers.get('Content-Encoding'))
                 raise Exception('Failed to decompress AO3 response. Try installing the brotli package.')
 
             # Parse login page to get authenticity token
@@ -121,7 +795,7 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
             # Debug: Check what page we actually got
             page_title = login_soup.find('title')
             if page_title:
-                print('Login page title:', page_title.get_text(strip=True))
+                logger.debug('Login page title: %s', page_title.get_text(strip=True))
 
             # Debug: Look for the login form
             login_form = login_soup.find('form', {'id': 'new_user'})
@@ -129,14 +803,14 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                 login_form = login_soup.find('form', {'action': '/users/login'})
 
             if login_form:
-                print('Login form found')
+                logger.debug('Login form found')
             else:
-                print('WARNING: Login form not found!')
+                logger.warning('Login form not found!')
                 # Try to find any forms
                 all_forms = login_soup.find_all('form')
-                print(f'Found {len(all_forms)} form(s) on page')
+                logger.debug('Found %d form(s) on page', len(all_forms))
                 for i, form in enumerate(all_forms):
-                    print(f'Form {i}: id={form.get("id")}, action={form.get("action")}')
+                    logger.debug('Form %d: id=%s, action=%s', i, form.get("id"), form.get("action"))
 
             # Look for authenticity token - try multiple methods
             token_input = None
@@ -146,14 +820,14 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
             token_input = login_soup.find('input', {'name': 'authenticity_token'})
             if token_input and token_input.get('value'):
                 token = token_input['value']
-                print('Found token via name attribute')
+                logger.debug('Found token via name attribute')
 
             # Method 2: Look by id attribute
             if not token:
                 token_input = login_soup.find('input', {'id': 'authenticity_token'})
                 if token_input and token_input.get('value'):
                     token = token_input['value']
-                    print('Found token via id attribute')
+                    logger.debug('Found token via id attribute')
 
             # Method 3: Look for any input with "token" in the name
             if not token:
@@ -163,7 +837,7 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                     if 'token' in input_name or 'csrf' in input_name:
                         if inp.get('value'):
                             token = inp['value']
-                            print(f'Found token via input name: {inp.get("name")}')
+                            logger.debug('Found token via input name: %s', inp.get("name"))
                             break
 
             if not token:
@@ -181,36 +855,34 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                     raise Exception('AO3 appears to be in maintenance mode. Please try again later.')
 
                 # Generic error with detailed debugging
-                print('=' * 50)
-                print('ERROR: Could not find authenticity token')
-                print('Response URL:', login_page_response.url)
-                print('Response status:', login_page_response.status_code)
-                print('Response headers:', dict(login_page_response.headers))
-                print('Response length:', len(login_page_response.text))
-                print('First 1000 chars of response:')
-                print(login_page_response.text[:1000])
-                print('=' * 50)
+                logger.error(
+                    'Could not find authenticity token (url=%s status=%s length=%s headers=%s). First 1000 chars of response:\n%s',
+                    login_page_response.url,
+                    login_page_response.status_code,
+                    len(login_page_response.text),
+                    dict(login_page_response.headers),
+                    login_page_response.text[:1000]
+                )
 
                 # Save full response for debugging
                 try:
-                    import os
                     debug_dir = '/tmp/cc-agent'
                     os.makedirs(debug_dir, exist_ok=True)
                     debug_path = os.path.join(debug_dir, 'ao3_login_page_debug.html')
                     with open(debug_path, 'w', encoding='utf-8') as f:
                         f.write(response_text)
-                    print(f'Full response saved to {debug_path}')
+                    logger.info('Full response saved to %s', debug_path)
                 except Exception as e:
-                    print(f'Could not save debug file: {e}')
+                    logger.warning('Could not save debug file: %s', e)
 
                 raise Exception('Could not find authenticity token on login page. AO3 may be blocking automated access or their page structure has changed. Check logs for details.')
 
-            print('Authenticity token found:', token[:20] + '...' if len(token) > 20 else token)
+            logger.debug('Authenticity token found: %s', token[:20] + '...' if len(token) > 20 else token)
 
             # Add random delay before logging in (2-4 seconds)
             login_delay = random.uniform(2, 4)
-            print(f'Waiting {login_delay:.1f} seconds before logging in...')
-            delay(login_delay)
+            logger.debug('Waiting %.1f seconds before logging in...', login_delay)
+            pause(login_delay)
 
             # Prepare login data
             login_data = {
@@ -220,20 +892,25 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
             }
 
             # Login
-            print('Attempting login...')
-            login_response = session.post(
-                'https://archiveofourown.org/users/login',
-                data=login_data,
-                headers={
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'Referer': 'https://archiveofourown.org/users/login',
-                    'Origin': 'https://archiveofourown.org'
-                },
-                timeout=60
-            )
-
-            print('Login response received')
-            print('Response status:', login_response.status_code)
+            logger.info('Attempting login...')
+            wait_turn()
+            with timings.span('login'):
+                login_response = session.post(
+                    'https://archiveofourown.org/users/login',
+                    data=login_data,
+                    headers={
+                        'Content-Type': 'application/x-www-form-urlencoded',
+                        'Referer': 'https://archiveofourown.org/users/login',
+                        'Origin': 'https://archiveofourown.org'
+                    },
+                    timeout=60
+                )
+
+            logger.debug('Login response received')
+            logger.debug('Response status: %s', login_response.status_code)
+            HTTP_RESPONSES.inc(kind='login', status=login_response.status_code)
+            if login_response.status_code >= 500:
+                raise AO3ServerError(f'AO3 returned error status {login_response.status_code} on login')
 
             # Check if login was successful
             login_check_soup = BeautifulSoup(login_response.text, 'html.parser')
@@ -248,48 +925,51 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
             user_nav = login_check_soup.find(id='greeting')
             is_logged_in = user_nav is not None
 
-            print('Login verification - user nav found:', is_logged_in)
+            logger.debug('Login verification - user nav found: %s', is_logged_in)
             if user_nav:
-                print('User greeting text:', user_nav.get_text(strip=True))
+                logger.debug('User greeting text: %s', user_nav.get_text(strip=True))
 
             if not is_logged_in:
-                print('Login may have failed - no user navigation found')
+                logger.warning('Login may have failed - no user navigation found')
                 page_title = login_check_soup.find('title')
                 if page_title:
-                    print('Page title:', page_title.get_text(strip=True))
+                    logger.debug('Page title: %s', page_title.get_text(strip=True))
 
                 # Try to find any error messages
                 all_errors = login_check_soup.find_all(class_=['error', 'alert', 'notice'])
                 if all_errors:
                     error_messages = [el.get_text(strip=True) for el in all_errors]
-                    print('Found error messages:', error_messages)
+                    logger.warning('Found error messages: %s', error_messages)
                     raise Exception(f"Login failed: {', '.join(error_messages)}")
 
-                print('No error messages found but login verification failed')
+                logger.warning('No error messages found but login verification failed')
 
-            print('Login successful')
+            logger.info('Login successful')
 
             # Add random delay after login before fetching history (2-4 seconds)
             post_login_delay = random.uniform(2, 4)
-            print(f'Waiting {post_login_delay:.1f} seconds after login...')
-            delay(post_login_delay)
+            logger.debug('Waiting %.1f seconds after login...', post_login_delay)
+            pause(post_login_delay)
 
             # Fetch all pages of history with pagination
             history_items = []
-            current_page = 1
+            # Tags, fandoms, authors and dates repeat heavily across a history
+            interner = StringInterner()
+            cached_works = 0
+            current_page = start_page
 
             if on_progress:
                 on_progress({
                     'currentPage': 0,
                     'totalItems': 0,
-                    'status': 'Starting to fetch history pages...'
+                    'status': 'Starting to fetch history pages...',
+                    **estimate.progress(0)
                 })
 
-            has_more_pages = True
-
-            while has_more_pages:
-                history_url = f'https://archiveofourown.org/users/{username}/readings?page={current_page}'
-                print(f'Fetching reading history page {current_page}...')
+            def fetch_history_page(page_number):
+                """Fetch one history page, retrying failures; runs on fetcher threads with page_concurrency > 1"""
+                history_url = f'https://archiveofourown.org/users/{username}/readings?page={page_number}'
+                logger.info('Fetching reading history page %d...', page_number)
 
                 # Retry logic for individual page fetches
                 page_fetch_attempts = 0
@@ -297,373 +977,201 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
                 history_response = None
 
                 while page_fetch_attempts < max_page_attempts:
+                    rate_limit_wait = 0
                     try:
-                        history_response = session.get(
-                            history_url,
-                            headers={'Referer': 'https://archiveofourown.org/'},
-                            timeout=60
-                        )
+                        wait_turn()
+                        with timings.span('fetch'):
+                            history_response = session.get(
+                                history_url,
+                                headers={'Referer': 'https://archiveofourown.org/'},
+                                timeout=60
+                            )
+
+                        HTTP_RESPONSES.inc(kind='history', status=history_response.status_code)
 
                         # Check for error status codes
                         if history_response.status_code == 525:
-                            print(f'525 SSL Handshake Failed on page {current_page}')
+                            logger.warning('525 SSL Handshake Failed on page %d', page_number)
                             raise Exception('SSL connection failed (525)')
 
                         if history_response.status_code == 429:
                             retry_after = history_response.headers.get('retry-after', '60')
-                            print(f'Rate limit detected (429) on page {current_page}')
+                            logger.warning('Rate limit detected (429) on page %d', page_number)
+                            report_rate_limited(retry_after)
+                            rate_limit_wait = parse_retry_after(retry_after)
                             raise Exception(f'Rate limited. Retry after {retry_after} seconds')
 
                         if history_response.status_code == 503:
-                            print(f'503 Service Unavailable on page {current_page}')
+                            logger.warning('503 Service Unavailable on page %d', page_number)
                             raise Exception('AO3 temporarily unavailable (503)')
 
                         if history_response.status_code >= 400:
-                            print(f'Unexpected status code {history_response.status_code} on page {current_page}')
+                            logger.warning('Unexpected status code %s on page %d', history_response.status_code, page_number)
                             raise Exception(f'HTTP error {history_response.status_code}')
 
                         history_response.raise_for_status()
-                        print(f'History page {current_page} fetched successfully')
+                        logger.debug('History page %d fetched successfully', page_number)
                         break  # Success, exit retry loop
 
                     except (requests.exceptions.SSLError, requests.exceptions.ConnectionError,
                             requests.exceptions.Timeout, Exception) as fetch_error:
                         page_fetch_attempts += 1
+                        if isinstance(fetch_error, requests.exceptions.RequestException):
+                            HTTP_RESPONSES.inc(kind='history', status='error')
                         error_message = str(fetch_error)
-                        print(f'Error fetching page {current_page} (attempt {page_fetch_attempts}/{max_page_attempts}): {error_message}')
+                        logger.warning('Error fetching page %d (attempt %d/%d): %s', page_number, page_fetch_attempts, max_page_attempts, error_message)
 
                         if page_fetch_attempts >= max_page_attempts:
-                            print(f'Failed to fetch page {current_page} after {max_page_attempts} attempts')
-                            raise Exception(f'Could not fetch page {current_page} after {max_page_attempts} attempts: {error_message}')
+                            logger.error('Failed to fetch page %d after %d attempts', page_number, max_page_attempts)
+                            raise Exception(f'Could not fetch page {page_number} after {max_page_attempts} attempts: {error_message}')
 
                         # Longer waits for SSL errors (525)
                         if '525' in error_message or isinstance(fetch_error, requests.exceptions.SSLError):
                             retry_wait = 30 + (page_fetch_attempts * 30)  # 60s, 90s, 120s, 150s
-                            print(f'SSL error detected - using extended cooldown period')
+                            logger.warning('SSL error detected - using extended cooldown period')
 
-                            # Recreate session adapter to reset SSL connection state
+                            # Drop pooled connections to reset SSL connection state
                             if page_fetch_attempts >= 2:
-                                print('Recreating session adapter to reset connection...')
-                                retry_strategy = Retry(
-                                    total=3,
-                                    backoff_factor=1,
-                                    status_forcelist=[429, 500, 502, 503, 504],
-                                )
-                                adapter = HTTPAdapter(max_retries=retry_strategy)
-                                session.mount("https://", adapter)
-                                session.mount("http://", adapter)
+                                logger.warning('Resetting pooled connections...')
+                                transport.reset_connections()
                         else:
                             retry_wait = page_fetch_attempts * 10  # 10s, 20s, 30s, 40s
+                        retry_wait = max(retry_wait, rate_limit_wait)
 
-                        print(f'Waiting {retry_wait} seconds before retrying page {current_page}...')
-                        delay(retry_wait)
+                        logger.warning('Waiting %s seconds before retrying page %d...', retry_wait, page_number)
+                        RETRIES.inc(scope='page')
+                        pause(retry_wait)
 
                 if not history_response:
-                    raise Exception(f'Failed to get response for page {current_page}')
-
-                soup = BeautifulSoup(history_response.text, 'html.parser')
+                    raise Exception(f'Failed to get response for page {page_number}')
+
+                return history_response
+
+            def fetch_and_parse(page_number):
+                started = time.monotonic()
+                page_result = parse_page(fetch_history_page(page_number), page_number)
+                _, has_next_page, last_page = page_result[:3]
+                # A history short enough to fit on one page has no pagination
+                estimate.page_finished(time.monotonic() - started,
+                                       last_page or (None if has_next_page else page_number))
+                return page_result
+
+            def pause_after_page(page_number):
+                random_delay = random.uniform(*page_delay_range(page_number))
+                logger.debug('Waiting %.1f seconds before page %d...', random_delay, page_number + 1)
+                pause(random_delay)
+
+                # Extended cooldowns every 5 and 10 pages to avoid detection
+                cooldown_time = page_cooldown(page_number)
+                if cooldown_time:
+                    logger.info('Completed %d pages, cooldown of %s seconds to avoid rate limiting...', page_number, cooldown_time)
+                    pause(cooldown_time)
 
-                # Debug: Log what we're seeing
-                page_title = soup.find('title')
-                if page_title:
-                    print('Page title:', page_title.get_text(strip=True))
-
-                # Try multiple selector patterns
-                possible_selectors = [
-                    'li.reading.work.blurb.group',
-                    'ol.reading li.blurb',
-                    'li.blurb.work',
-                    'li.work.blurb'
-                ]
-
-                work_items = []
-                working_selector = None
-
-                for selector in possible_selectors:
-                    if '.' in selector:
-                        classes = selector.replace('li.', '').split('.')
-                        if selector.startswith('ol.reading'):
-                            ol = soup.find('ol', class_='reading')
-                            if ol:
-                                items = ol.find_all('li', class_='blurb')
-                                work_items = items
-                        else:
-                            items = soup.find_all('li', class_=classes)
-                            work_items = items
-                    else:
-                        work_items = soup.find_all(selector)
-
-                    print(f'Trying selector "{selector}": found {len(work_items)} items')
-                    if len(work_items) > 0:
-                        working_selector = selector
-                        break
-
-                if not work_items:
-                    print('No items found with any selector.')
-
-                items_on_page = 0
-                last_item_on_page = None
+            has_more_pages = True
 
-                # Debug: Save first item HTML on first page
-                if current_page == 1 and len(work_items) > 0:
-                    try:
-                        import os
-                        debug_dir = '/tmp/cc-agent'
-                        os.makedirs(debug_dir, exist_ok=True)
-                        debug_path = os.path.join(debug_dir, 'ao3_first_item_debug.html')
-                        with open(debug_path, 'w', encoding='utf-8') as f:
-                            f.write(str(work_items[0].prettify()))
-                        print(f'First item HTML saved to {debug_path}')
-                    except Exception as e:
-                        print(f'Could not save first item debug: {e}')
-
-                for item in work_items:
-                    # Find the title link
-                    title_element = item.find('h4', class_='heading')
-                    if title_element:
-                        title_link = title_element.find('a', href=lambda x: x and '/works/' in x)
-
-                        if title_link:
-                            title = title_link.get_text(strip=True)
-                            link = title_link.get('href')
-
-                            # Find author
-                            author_element = item.find('a', rel='author')
-                            author = author_element.get_text(strip=True) if author_element else 'Unknown'
-
-                            # Extract word count
-                            word_count = 0
-                            stats_element = item.find('dd', class_='words')
-                            if stats_element:
-                                words_text = stats_element.get_text(strip=True).replace(',', '')
-                                try:
-                                    word_count = int(words_text)
-                                except ValueError:
-                                    word_count = 0
-
-                            # Extract tags (separated by type)
-                            tags = []  # Only freeform tags
-                            relationships = []  # Ship tags
-                            characters = []  # Character tags
-
-                            relationship_elements = item.find_all('li', class_='relationships')
-                            for rel_li in relationship_elements:
-                                rel_tag = rel_li.find('a', class_='tag')
-                                if rel_tag:
-                                    relationship = rel_tag.get_text(strip=True)
-                                    relationships.append(relationship)
-
-                            character_elements = item.find_all('li', class_='characters')
-                            for char_li in character_elements:
-                                char_tag = char_li.find('a', class_='tag')
-                                if char_tag:
-                                    characters.append(char_tag.get_text(strip=True))
-
-                            freeform_elements = item.find_all('li', class_='freeforms')
-                            for free_li in freeform_elements:
-                                free_tag = free_li.find('a', class_='tag')
-                                if free_tag:
-                                    tag_text = free_tag.get_text(strip=True)
-                                    tags.append(tag_text)
-
-                            if current_page == 1 and items_on_page == 0 and len(tags) > 0:
-                                print(f'First item freeform tags: {tags}')
-
-                            # Extract warnings
-                            warnings = []
-                            warning_elements = item.find_all('li', class_='warnings')
-                            for warn_li in warning_elements:
-                                warn_tag = warn_li.find('a', class_='tag')
-                                if warn_tag:
-                                    warnings.append(warn_tag.get_text(strip=True))
-
-                            # Extract categories
-                            categories = []
-                            category_elements = item.find_all('li', class_='categories')
-                            for cat_li in category_elements:
-                                cat_tag = cat_li.find('a', class_='tag')
-                                if cat_tag:
-                                    categories.append(cat_tag.get_text(strip=True))
-
-                            # Extract rating
-                            rating_element = item.find('span', class_='rating')
-                            if rating_element:
-                                rating_text = rating_element.find('span', class_='text')
-                                rating = rating_text.get_text(strip=True) if rating_text else 'Not Rated'
-                            else:
-                                rating = 'Not Rated'
-
-                            # Extract fandoms
-                            fandoms = []
-                            fandom_heading = item.find('h5', class_='fandoms')
-                            if fandom_heading:
-                                fandom_links = fandom_heading.find_all('a', class_='tag')
-                                fandoms = [f.get_text(strip=True) for f in fandom_links]
-
-                            # Extract last visited date
-                            last_visited = None
-                            date_text = None
-                            import re
-
-                            # Try multiple approaches to find the date
-
-                            # Approach 1: Look for h4.viewed with "Last visited:"
-                            viewed_heading = item.find('h4', class_='viewed')
-                            if viewed_heading:
-                                full_heading_text = viewed_heading.get_text()
-                                if 'Last visited:' in full_heading_text:
-                                    date_match = re.search(r'(\d{1,2}\s+\w+\s+\d{4})', full_heading_text)
-                                    if date_match:
-                                        date_text = date_match.group(1)
-
-                            # Approach 2: Look for span with datetime attribute
-                            if not date_text:
-                                datetime_span = item.find('span', {'datetime': True})
-                                if datetime_span:
-                                    date_text = datetime_span.get_text(strip=True)
-
-                            # Approach 3: Look in any element with "Last visited" text
-                            if not date_text:
-                                all_text = item.get_text()
-                                if 'Last visited:' in all_text:
-                                    # Find text after "Last visited:"
-                                    match = re.search(r'Last visited:\s*(\d{1,2}\s+\w+\s+\d{4})', all_text)
-                                    if match:
-                                        date_text = match.group(1)
-
-                            # Approach 4: Look for dd element with date class
-                            if not date_text:
-                                date_dd = item.find('dd', class_='date')
-                                if date_dd:
-                                    date_text = date_dd.get_text(strip=True)
-
-                            if date_text:
-                                print(f'Found date text for "{title}": "{date_text}"')
-                                try:
-                                    # Try different date formats
-                                    formats = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
-                                    for fmt in formats:
-                                        try:
-                                            last_visited = datetime.strptime(date_text, fmt)
-                                            print(f'✓ Parsed date for "{title}": {last_visited.isoformat()} (Year: {last_visited.year})')
-                                            break
-                                        except ValueError:
-                                            continue
-
-                                    if not last_visited:
-                                        print(f'✗ Could not parse date from text: "{date_text}" for "{title}"')
-                                except Exception as e:
-                                    print(f'✗ Error parsing date: {e}')
-                            else:
-                                print(f'✗ No "Last visited" date found for "{title}"')
-
-                            if title and link:
-                                work_item = {
-                                    'title': title,
-                                    'author': author,
-                                    'url': f'https://archiveofourown.org{link}',
-                                    'wordCount': word_count,
-                                    'tags': tags,
-                                    'characters': characters,
-                                    'relationships': relationships,
-                                    'warnings': warnings,
-                                    'categories': categories,
-                                    'rating': rating,
-                                    'fandoms': fandoms,
-                                    'lastVisited': last_visited.isoformat() if last_visited else None
-                                }
-                                history_items.append(work_item)
-
-                                if last_visited:
-                                    last_item_on_page = work_item
-
-                                items_on_page += 1
-
-                print(f'Found {items_on_page} items on page {current_page} (total: {len(history_items)})')
+            while has_more_pages:
+                if page_fetcher is not None and page_fetcher.covers(current_page):
+                    page_result = page_fetcher.result(current_page)
+                else:
+                    page_result = fetch_and_parse(current_page)
+                works, has_next_page, _, parse_seconds, extract_seconds, cache_hits = page_result
+                timings.add('parse', parse_seconds)
+                timings.add('extract', extract_seconds)
+                WORK_CACHE_LOOKUPS.inc(cache_hits, stage='blurb', result='hit')
+                WORK_CACHE_LOOKUPS.inc(len(works) - cache_hits, stage='blurb', result='miss')
+                cached_works += cache_hits
+
+                page_items = [HistoryItem.from_dict(work, interner) for work in works]
+                history_items.extend(page_items)
+                items_on_page = len(page_items)
+                last_item_on_page = next((item for item in reversed(page_items) if item.last_visited), None)
+                logger.info('Found %d items on page %d (total: %d)', items_on_page, current_page, len(history_items))
+
+                if on_items:
+                    on_items(current_page, page_items)
 
                 if on_progress:
                     on_progress({
                         'currentPage': current_page,
                         'totalItems': len(history_items),
-                        'status': f'Fetched page {current_page} - Found {len(history_items)} total items'
+                        'status': f'Fetched page {current_page} - Found {len(history_items)} total items',
+                        **estimate.progress(current_page)
                     })
 
                 # If filtering by year, check if we should stop
-                if year and last_item_on_page and last_item_on_page.get('lastVisited'):
-                    last_visited_dt = datetime.fromisoformat(last_item_on_page['lastVisited'])
+                if year and last_item_on_page and last_item_on_page.last_visited:
+                    last_visited_dt = datetime.fromisoformat(last_item_on_page.last_visited)
                     last_item_year = last_visited_dt.year
                     target_year = int(year)
-                    print(f'Year filter check - Last item on page: {last_item_year}, Target year: {target_year}')
+                    logger.debug('Year filter check - Last item on page: %s, Target year: %s', last_item_year, target_year)
 
                     if last_item_year < target_year:
-                        print(f'\n========================================')
-                        print(f'STOPPING: Last item on page {current_page} is from {last_item_year}, which is before target year {target_year}.')
-                        print(f'All items from year {target_year} have been collected.')
-                        print(f'========================================\n')
+                        logger.info('Stopping: last item on page %d is from %s, before target year %s. All items from %s have been collected.', current_page, last_item_year, target_year, target_year)
                         has_more_pages = False
                     else:
-                        print(f'Last item year ({last_item_year}) is >= target year ({target_year}), continuing...')
+                        logger.debug('Last item year (%s) is >= target year (%s), continuing...', last_item_year, target_year)
                 elif year:
-                    print(f'Year filter enabled ({year}) but no valid dated item found on page {current_page}, continuing...')
+                    logger.debug('Year filter enabled (%s) but no valid dated item found on page %d, continuing...', year, current_page)
 
                 # Check if there's a next page
                 if has_more_pages:
-                    next_page_link = soup.find('ol', class_='pagination')
-                    if next_page_link:
-                        next_li = next_page_link.find('li', class_='next')
-                        has_more_pages = next_li is not None and items_on_page > 0
-                    else:
-                        has_more_pages = False
+                    has_more_pages = has_next_page and items_on_page > 0
 
                     if has_more_pages:
-                        # Progressive delay that increases with page count
-                        # Pages 1-10: 3-6 seconds
-                        # Pages 11-20: 5-8 seconds
-                        # Pages 21-30: 8-12 seconds
-                        # Pages 31+: 12-18 seconds
-                        if current_page <= 10:
-                            random_delay = random.uniform(3, 6)
-                        elif current_page <= 20:
-                            random_delay = random.uniform(5, 8)
-                        elif current_page <= 30:
-                            random_delay = random.uniform(8, 12)
-                        else:
-                            random_delay = random.uniform(12, 18)
-
-                        print(f'Waiting {random_delay:.1f} seconds before next page...')
-                        delay(random_delay)
-
-                        # Extended cooldown every 10 pages to avoid detection
-                        if current_page % 10 == 0:
-                            cooldown_time = 90  # 1.5 minutes
-                            print(f'Completed {current_page} pages, extended cooldown of {cooldown_time} seconds to avoid rate limiting...')
-                            delay(cooldown_time)
-                        # Additional brief pause every 5 pages
-                        elif current_page % 5 == 0:
-                            print(f'Completed {current_page} pages, waiting 30 seconds...')
-                            delay(30)
+                        more_pages_known = estimate.total_pages is not None and estimate.total_pages > current_page
+                        if page_fetcher is None and page_concurrency > 1 and more_pages_known:
+                            # The page count is known now; fetch the rest up to page_concurrency at a time
+                            page_fetcher = OrderedPageFetcher(fetch_and_parse, current_page + 1, estimate.total_pages,
+                                                              page_concurrency, pause_after_page)
+                        elif page_fetcher is None or not page_fetcher.covers(current_page + 1):
+                            pause_after_page(current_page)
 
                         current_page += 1
 
-            print(f'\nPagination stopped. Found {len(history_items)} total items across {current_page} pages')
+            if page_fetcher is not None:
+                page_fetcher.close()
+
+            logger.info('Pagination stopped. Found %d total items across %d pages', len(history_items), current_page)
+            estimate.pages_done(current_page)
+            logger.info('Work cache supplied %d of %d works', cached_works, len(history_items))
 
             # Filter by year if specified
             filtered_items = history_items
             if year:
                 filtered_items = [
                     item for item in history_items
-                    if item.get('lastVisited') and
-                    datetime.fromisoformat(item['lastVisited']).year == int(year)
+                    if item.last_visited and
+                    datetime.fromisoformat(item.last_visited).year == int(year)
                 ]
-                print(f'Filtered to {len(filtered_items)} items for year {year}')
+                logger.info('Filtered to %d items for year %s', len(filtered_items), year)
+
+            if enrich:
+                def on_enrich_progress(fetched, to_fetch):
+                    if on_progress:
+                        on_progress({
+                            'currentPage': current_page,
+                            'totalItems': len(history_items),
+                            'status': f'Fetched details for {fetched} of {to_fetch} works',
+                            **estimate.progress(current_page, extra_requests=to_fetch - fetched)
+                        })
+
+                enrich_items(session, filtered_items, pause, timings, on_enrich_progress, throttle=wait_turn,
+                             on_rate_limited=report_rate_limited)
+
+            if owns_timings:
+                timings.log_summary(logger, items=len(filtered_items), pages=current_page, status='ok')
 
             return filtered_items
 
         except Exception as error:
-            print(f'Attempt {attempt}/{retries} failed: {str(error)}')
+            logger.warning('Attempt %d/%d failed: %s', attempt, retries, error)
+            if page_fetcher is not None:
+                # Pages still in flight finish before anything is retried
+                page_fetcher.close()
 
             # Check if this is a retryable error
             is_retryable = isinstance(error, (
+                AO3ServerError,
                 requests.exceptions.ConnectionError,
                 requests.exceptions.Timeout,
                 requests.exceptions.SSLError
@@ -683,7 +1191,8 @@ def scrape_ao3_history(username, password, year=None, retries=3, on_progress=Non
 
             # Wait before retrying (exponential backoff)
             wait_time = attempt * 10
-            print(f'Retrying in {wait_time} seconds...')
-            delay(wait_time)
+            logger.warning('Retrying in %s seconds...', wait_time)
+            RETRIES.inc(scope='scrape')
+            pause(wait_time)
 
     raise Exception('All retry attempts failed')
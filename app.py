@@ -1,16 +1,84 @@
 from flask import Flask, request, jsonify, send_from_directory, Response, send_file
 from flask_cors import CORS
+import io
 import json
+import logging
 import sys
 import os
-from ao3_scraper import scrape_ao3_history
-from image_generator import generate_all_stat_images
+from history_item import items_to_dicts
+from history_stats import StatisticsAggregator, calculate_statistics, calculate_yearly_statistics
+from metrics import ACTIVE_SCRAPES, SSE_CONNECTIONS, render_metrics
+from profiling import profiling_enabled, run_profiled
+from result_cache import RESULT_CACHE, CachedResult, result_cache_key, result_cache_stats
+from timing import PhaseTimer
+from payloads import (
+    compress_body, compress_stream, encode_compact_items, negotiate_encoding, MIN_COMPRESS_SIZE
+)
+
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_folder='public')
 CORS(app)
 
-print('Python version:', sys.version)
-print('Flask and scraper loaded successfully')
+logger.info('Python version: %s', sys.version)
+logger.info('Flask loaded successfully')
+
+# Loaded on first use (or by preload_heavy_modules) so cold starts can answer
+# /api/health before requests, BeautifulSoup and Pillow are imported
+HEAVY_MODULES = ('ao3_scraper', 'capture', 'image_generator')
+
+
+def preload_heavy_modules():
+    """Import the scraper and image stack so the first scrape doesn't pay for it"""
+    import importlib
+    import time
+
+    started = time.perf_counter()
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+    logger.info('Preloaded %s in %.0f ms', ', '.join(HEAVY_MODULES), (time.perf_counter() - started) * 1000)
+
+    from parse_pool import warm_parse_pool
+    warm_parse_pool()
+
+
+@app.after_request
+def compress_json_response(response):
+    """Compress JSON responses when the client accepts gzip or brotli"""
+    if (response.mimetype != 'application/json' or response.direct_passthrough
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(compress_body(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def parse_year(value):
+    """Year filter from a request as an int (None when absent); raises ValueError if it isn't a year"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not str(value).strip().isdigit():
+        raise ValueError(f'Invalid year: {value!r}')
+    return int(value)
+
+
+def serialize_items(history_items, payload_format=None):
+    """Serialize items as plain dicts, or as a string table plus index arrays for 'compact'"""
+    if payload_format == 'compact':
+        return encode_compact_items(history_items)
+    return items_to_dicts(history_items)
 
 
 @app.route('/')
@@ -23,6 +91,25 @@ def health():
     return jsonify({'status': 'ok', 'timestamp': str(__import__('datetime').datetime.now().isoformat())})
 
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Expose process metrics in the Prometheus text format"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/api/work-cache', methods=['GET'])
+def work_cache():
+    """Report the shared work metadata cache's size and hit rates"""
+    from work_cache import work_cache_stats
+    return jsonify(work_cache_stats())
+
+
+@app.route('/api/result-cache', methods=['GET'])
+def result_cache():
+    """Report the scrape result cache's size and hit counts"""
+    return jsonify(result_cache_stats())
+
+
 @app.route('/api/debug', methods=['GET'])
 def debug():
     file_type = request.args.get('file', 'login')
@@ -44,86 +131,265 @@ def debug():
     return jsonify({'found': False, 'message': f'Debug file not found: {debug_file}'})
 
 
+def negotiate_image_format():
+    """Pick the best image format the client explicitly accepts, defaulting to PNG"""
+    from image_generator import supported_image_formats, IMAGE_MIMETYPES
+
+    requested = request.args.get('format')
+    available = supported_image_formats()
+    if requested:
+        return requested if requested in available else None
+
+    accepted = {mimetype for mimetype, quality in request.accept_mimetypes if quality > 0}
+    for fmt in available:
+        if IMAGE_MIMETYPES[fmt] in accepted:
+            return fmt
+    return 'png'
+
+
 @app.route('/api/stats-image/<image_type>', methods=['GET'])
-def get_stats_image(image_type):
-    """Serve generated stat images"""
-    image_files = {
-        'ships': 'top_ships.png',
-        'tags': 'top_tags.png',
-        'fandoms': 'top_fandoms.png',
-        'overall': 'overall_stats.png'
-    }
-
-    if image_type not in image_files:
-        return jsonify({'error': 'Invalid image type'}), 400
+@app.route('/api/stats-image/<int:year>/<image_type>', methods=['GET'])
+def get_stats_image(image_type, year=None):
+    """Serve generated stat images from memory, optionally for one year of a yearly scrape"""
+    from image_generator import get_stat_image, stat_image_version, IMAGE_MIMETYPES, IMAGE_SIZES
 
-    image_path = os.path.join('/tmp/ao3_stats', image_files[image_type])
+    if image_type not in ('ships', 'tags', 'fandoms', 'overall'):
+        return jsonify({'error': 'Invalid image type'}), 400
 
-    if not os.path.exists(image_path):
+    size = request.args.get('size', 'full')
+    if size not in IMAGE_SIZES:
+        return jsonify({'error': 'Invalid image size'}), 400
+
+    fmt = negotiate_image_format()
+    if not fmt:
+        return jsonify({'error': 'Unsupported image format'}), 400
+
+    requested_version = request.args.get('v')
+    if requested_version:
+        version = requested_version
+        image_data = get_stat_image(image_type, fmt, size, year, version=version)
+        if image_data is None:
+            # Cards another instance rendered, or ones this instance has since let go
+            image_data = shared_stat_image(image_type, version, fmt, size)
+    else:
+        version = stat_image_version(year)
+        image_data = get_stat_image(image_type, fmt, size, year)
+    if image_data is None:
         return jsonify({'error': 'Image not found. Please run scraper first.'}), 404
 
-    return send_file(image_path, mimetype='image/png')
-
-
-def calculate_statistics(history_items):
-    stats = {
-        'totalFics': len(history_items),
-        'totalWords': 0,
-        'topTags': [],
-        'topShips': [],
-        'topFandoms': [],
-        'longestFic': {
-            'title': '',
-            'wordCount': 0,
-            'author': '',
-            'url': ''
-        }
-    }
-
-    tag_counts = {}
-    ship_counts = {}
-    fandom_counts = {}
-    longest_fic = None
-
-    for item in history_items:
-        word_count = item.get('wordCount', 0)
-        stats['totalWords'] += word_count
-
-        # Track longest fic
-        if word_count > stats['longestFic']['wordCount']:
-            stats['longestFic'] = {
-                'title': item.get('title', ''),
-                'wordCount': word_count,
-                'author': item.get('author', ''),
-                'url': item.get('url', '')
-            }
+    response = send_file(io.BytesIO(image_data), mimetype=IMAGE_MIMETYPES[fmt])
+    response.headers['Vary'] = 'Accept'
+    if requested_version == version:
+        # A versioned URL always names the same card, so browsers can keep it
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    response.set_etag(f'{version}-{image_type}-{fmt}-{size}')
+    return response.make_conditional(request)
+
+
+def share_statistics(statistics, year=None):
+    """Store the statistics behind each set of cards under its version, so any instance can draw them"""
+    from image_generator import statistics_version
+    from state_store import get_state_store
+
+    store = get_state_store()
+    if not store.shared:
+        return
+    card_sets = [(year, statistics)]
+    card_sets += [(int(stat_year), year_statistics) for stat_year, year_statistics in statistics.get('years', {}).items()]
+    for card_year, card_statistics in card_sets:
+        drawn = {key: value for key, value in card_statistics.items() if key not in ('years', 'imagePaths')}
+        store.put_blob(
+            f'statistics:{statistics_version(card_statistics, card_year)}',
+            json.dumps({'year': card_year, 'statistics': drawn}).encode('utf-8')
+        )
+
+
+def shared_stat_image(image_type, version, fmt='png', size='full'):
+    """Encoded card for a version stored by share_statistics, drawn and stored on first request; None if unknown"""
+    from image_generator import encode_image, render_stat_image, stat_image_types
+    from state_store import get_state_store
+
+    store = get_state_store()
+    if not store.shared:
+        return None
+    image_key = f'image:{version}:{image_type}:{fmt}:{size}'
+    image_data = store.get_blob(image_key)
+    if image_data is not None:
+        return image_data
+
+    stored = store.get_blob(f'statistics:{version}')
+    if stored is None:
+        return None
+    card_set = json.loads(stored)
+    if image_type not in stat_image_types(card_set['statistics']):
+        return None
+    image_data = encode_image(render_stat_image(image_type, card_set['statistics'], card_set['year']), fmt, size)
+    store.put_blob(image_key, image_data)
+    return image_data
+
+
+def capture_transport(username):
+    """Return a recording transport when AO3_RECORD is on, else None (the default transport)"""
+    from capture import CaptureRecorder, recording_enabled
+
+    if not recording_enabled():
+        return None
+    recorder = CaptureRecorder(username)
+    logger.info('Recording AO3 responses to %s', recorder.path)
+    return recorder.transport()
+
+
+def store_history(username, history_items, timings):
+    """Save items to the history database when AO3_HISTORY_DB is set; returns the access token or None"""
+    from history_db import history_db_enabled, save_history
+
+    if not history_db_enabled():
+        return None
+    try:
+        with timings.span('store'):
+            return save_history(username, history_items)
+    except Exception as store_error:
+        logger.error('Error storing history: %s', store_error)
+        return None
+
 
-        for tag in item.get('tags', []):
-            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+def cache_result(cache_key, history_items, statistics, history_token, year=None):
+    """Keep a finished scrape for identical requests within AO3_RESULT_CACHE_TTL"""
+    from image_generator import statistics_version
 
-        for ship in item.get('relationships', []):
-            ship_counts[ship] = ship_counts.get(ship, 0) + 1
+    image_version = statistics_version(statistics, int(year) if year else None) if statistics.get('imagePaths') else None
+    RESULT_CACHE.put(cache_key, CachedResult(history_items, statistics, image_version, history_token))
 
-        for fandom in item.get('fandoms', []):
-            fandom_counts[fandom] = fandom_counts.get(fandom, 0) + 1
 
-    # Sort and get top 10
-    stats['topTags'] = [
-        {'tag': tag, 'count': count}
-        for tag, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    ]
+def restore_cached_result(username, cached, timings, year=None):
+    """Make sure a cached result's stat images can still be served; returns its (still valid) history token"""
+    from image_generator import generate_all_stat_images, has_card_sets
+
+    logger.info('Answering %s from a result cached %.0fs ago', username, cached.age())
+    # Newer scrapes may have pushed its cards out; redrawing them is cheap next to a scrape
+    if cached.image_version and not has_card_sets(cached.statistics, int(year) if year else None):
+        with timings.span('render'):
+            generate_all_stat_images(cached.statistics, int(year) if year else None)
+
+    if cached.history_token:
+        from history_db import authorize
+        # A later scrape of the same account issues a new token and invalidates this one
+        if not authorize(username, cached.history_token):
+            cached.history_token = store_history(username, cached.items, timings)
+    return cached.history_token
+
+
+def build_statistics(history_items, timings, profile=False, year=None, yearly=False):
+    """
+    Calculate statistics for scraped items and render their stat images
+
+    With yearly, the result is all-time statistics plus a 'years' map with
+    each year's statistics and image paths, all from the same items.
+    """
+    from image_generator import card_set_versions, generate_all_stat_images, stat_image_types
+
+    with timings.span('stats'):
+        if yearly:
+            statistics = run_profiled(profile, 'statistics', calculate_yearly_statistics, history_items)
+        else:
+            statistics = run_profiled(profile, 'statistics', calculate_statistics, history_items)
+
+    # Generate stat images
+    logger.info('Generating stat images...')
+    try:
+        with timings.span('render'):
+            image_types = run_profiled(
+                profile, 'render', generate_all_stat_images, statistics, int(year) if year else None
+            )
+        # Paths carry a content version so browsers can cache them, computed from
+        # these statistics rather than read back, since another scrape may render meanwhile
+        versions = card_set_versions(statistics, int(year) if year else None)
+        statistics['imagePaths'] = {
+            image_type: f'/api/stats-image/{image_type}?v={versions[None]}'
+            for image_type in image_types
+        }
+        for stat_year, year_statistics in statistics.get('years', {}).items():
+            year_statistics['imagePaths'] = {
+                image_type: f'/api/stats-image/{stat_year}/{image_type}?v={versions[int(stat_year)]}'
+                for image_type in stat_image_types(year_statistics)
+            }
+        share_statistics(statistics, int(year) if year else None)
+        logger.info('Stat images generated successfully')
+    except Exception as img_error:
+        logger.error('Error generating images: %s', img_error)
+        statistics['imagePaths'] = {}
+
+    return statistics
 
-    stats['topShips'] = [
-        {'ship': ship, 'count': count}
-        for ship, count in sorted(ship_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    ]
 
-    stats['topFandoms'] = [
-        {'fandom': fandom, 'count': count}
-        for fandom, count in sorted(fandom_counts.items(), key=lambda x: x[1], reverse=True)[:10]
-    ]
+def stream_job_events(store, job_id, after=0):
+    """Yield a job's stored events as SSE until it has finished, polling the shared store"""
+    import time
 
-    return stats
+    SSE_CONNECTIONS.inc()
+    try:
+        while True:
+            job = store.get_job(job_id)
+            if job is None:
+                yield f'event: error\ndata: {json.dumps({"error": "Unknown or expired job"})}\n\n'
+                return
+            # Every event is stored before the job is marked finished, so reading
+            # the status first means nothing can be missed on the last pass
+            finished = job['status'] != 'running'
+            for seq, event, data in store.events_after(job_id, after):
+                yield f'id: {seq}\nevent: {event}\ndata: {data}\n\n'
+                after = seq
+            if finished:
+                return
+            time.sleep(0.5)
+    finally:
+        SSE_CONNECTIONS.dec()
+
+
+def event_stream_response(events):
+    """Wrap an SSE generator in a streaming response, compressed when the client allows it"""
+    encoding = negotiate_encoding(request.headers.get('Accept-Encoding'))
+    if encoding:
+        return Response(
+            compress_stream(events, encoding),
+            mimetype='text/event-stream',
+            headers={'Content-Encoding': encoding, 'Vary': 'Accept-Encoding'}
+        )
+    return Response(events, mimetype='text/event-stream')
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report a scrape job's status; the job ID is only known to whoever started it"""
+    from state_store import get_state_store
+
+    job = get_state_store().get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify({'jobId': job_id, 'status': job['status']})
+
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """
+    Stream a scrape job's events from any instance
+
+    Events after Last-Event-ID (or the after query parameter) are replayed
+    first, so a dropped stream resumes where it stopped.
+    """
+    from state_store import get_state_store
+
+    after = request.headers.get('Last-Event-ID', request.args.get('after', '0'))
+    try:
+        after = int(after)
+    except ValueError:
+        after = 0
+    return event_stream_response(stream_job_events(get_state_store(), job_id, after))
 
 
 @app.route('/api/scrape-stream', methods=['GET'])
@@ -131,84 +397,174 @@ def scrape_stream():
     username = request.args.get('username')
     password = request.args.get('password')
     year = request.args.get('year')
+    payload_format = request.args.get('payload')
+    profile = profiling_enabled(request.args.get('profile'))
+    # One scrape of every page, with statistics for each year it covers
+    yearly = request.args.get('yearly', '').lower() in ('1', 'true', 'yes', 'on')
+    if yearly:
+        year = None
+    # Send each page's items as it arrives instead of the full list at the end
+    incremental = request.args.get('incremental', '').lower() in ('1', 'true', 'yes', 'on')
+    # Fetch kudos, chapters and completion for works the cache and blurbs can't supply
+    enrich = request.args.get('enrich', '').lower() in ('1', 'true', 'yes', 'on')
+    # Scrape again even if an identical request was answered moments ago
+    refresh = request.args.get('refresh', '').lower() in ('1', 'true', 'yes', 'on')
 
     if not username or not password:
         def error_generator():
             yield f'event: error\ndata: {json.dumps({"error": "Username and password required"})}\n\n'
         return Response(error_generator(), mimetype='text/event-stream')
+    try:
+        year = parse_year(year)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    timings = PhaseTimer()
+    cache_key = result_cache_key(username, password, year, yearly, enrich)
+    cached = None if refresh or profile else RESULT_CACHE.get(cache_key)
+    if cached is None:
+        logger.info('Starting scrape for user: %s%s', username, ' (Year: %s)' % year if year else '')
+        transport = capture_transport(username)
+
+    def cached_events():
+        history_token = restore_cached_result(username, cached, timings, year)
+        if incremental:
+            event_data = {'page': 1, 'reset': True, 'items': serialize_items(cached.items, payload_format)}
+            yield f'event: items\ndata: {json.dumps(event_data)}\n\n'
+            result = {'totalItems': len(cached.items), 'statistics': cached.statistics}
+        else:
+            result = {'items': serialize_items(cached.items, payload_format), 'statistics': cached.statistics}
+        result['cached'] = True
+        if history_token:
+            result['historyToken'] = history_token
+        yield f'event: complete\ndata: {json.dumps(result)}\n\n'
+
+    def run_job(job_id, publisher):
+        from copy import copy
+        from ao3_scraper import scrape_ao3_history
+        from rate_limiter import get_request_limiter
+        from state_store import DeferredJSON
+
+        running_stats = StatisticsAggregator(year=year)
+        last_progress = {
+            'currentPage': 0, 'totalItems': 0, 'totalPages': None, 'percent': 0, 'etaSeconds': None,
+            'statistics': running_stats.result()
+        }
 
-    print(f'Starting scrape for user: {username}{f" (Year: {year})" if year else ""}')
-
-    def generate():
-        progress_queue = []
+        def on_throttle_wait(seconds):
+            # Called under the limiter's lock, so only reuse what the last progress event computed
+            publisher.publish('progress', {
+                **last_progress,
+                'status': f'Waiting about {seconds:.0f}s for a turn at AO3 (shared with other scrapes)...',
+                'throttle': {**throttle.stats(), 'expectedWaitSeconds': round(seconds, 1)}
+            })
+
+        # Every scrape in this process shares one request budget to AO3
+        throttle = get_request_limiter().job(username, on_wait=on_throttle_wait)
+
+        def on_items(page_number, page_items):
+            # A retried attempt starts over from page 1
+            if page_number == 1:
+                running_stats.reset()
+            running_stats.add_items(page_items)
+
+            if incremental:
+                if year:
+                    page_items = [item for item in page_items if item.visited_year == int(year)]
+                # Encoded when read. Enrichment fills items in later, so then the batch
+                # holds copies (which still share every string) to keep the event as sent
+                batch = [copy(item) for item in page_items] if enrich else tuple(page_items)
+                publisher.publish('items', {
+                    'page': page_number,
+                    'reset': page_number == 1,
+                    'items': DeferredJSON(serialize_items, batch, payload_format)
+                })
 
         def on_progress(progress_data):
-            progress_queue.append(progress_data)
-
+            last_progress.update(
+                currentPage=progress_data['currentPage'],
+                totalItems=progress_data['totalItems'],
+                totalPages=progress_data['totalPages'],
+                percent=progress_data['percent'],
+                etaSeconds=progress_data['etaSeconds'],
+                statistics=running_stats.result()
+            )
+            publisher.publish('progress', {
+                **progress_data,
+                'statistics': last_progress['statistics'],
+                'throttle': throttle.stats()
+            })
+
+        ACTIVE_SCRAPES.inc()
         try:
-            # Start scraping in a way that allows us to yield progress
-            import threading
-            import time
-
-            scrape_result = {'items': None, 'error': None}
-
-            def scrape_thread():
-                try:
-                    scrape_result['items'] = scrape_ao3_history(
-                        username,
-                        password,
-                        year if year else None,
-                        retries=3,
-                        on_progress=on_progress
-                    )
-                except Exception as e:
-                    scrape_result['error'] = e
-
-            thread = threading.Thread(target=scrape_thread)
-            thread.start()
-
-            # Yield progress updates while scraping
-            while thread.is_alive():
-                while progress_queue:
-                    progress_data = progress_queue.pop(0)
-                    yield f'event: progress\ndata: {json.dumps(progress_data)}\n\n'
-                time.sleep(0.5)
-
-            # Yield any remaining progress updates
-            while progress_queue:
-                progress_data = progress_queue.pop(0)
-                yield f'event: progress\ndata: {json.dumps(progress_data)}\n\n'
-
-            # Check for errors
-            if scrape_result['error']:
-                raise scrape_result['error']
-
-            history_items = scrape_result['items']
-            print(f'Successfully scraped {len(history_items)} items')
-
-            statistics = calculate_statistics(history_items)
-
-            # Generate stat images
-            print('Generating stat images...')
             try:
-                image_paths = generate_all_stat_images(statistics)
-                statistics['imagePaths'] = {
-                    'ships': '/api/stats-image/ships',
-                    'tags': '/api/stats-image/tags',
-                    'fandoms': '/api/stats-image/fandoms',
-                    'overall': '/api/stats-image/overall'
+                history_items = run_profiled(
+                    profile,
+                    'scrape',
+                    scrape_ao3_history,
+                    username,
+                    password,
+                    year if year else None,
+                    retries=3,
+                    on_progress=on_progress,
+                    on_items=on_items,
+                    timings=timings,
+                    transport=transport,
+                    enrich=enrich,
+                    throttle=throttle
+                )
+            finally:
+                throttle.close()
+                ACTIVE_SCRAPES.dec()
+            logger.info('Successfully scraped %d items', len(history_items))
+
+            statistics = build_statistics(history_items, timings, profile, year, yearly)
+            history_token = store_history(username, history_items, timings)
+            cache_result(cache_key, history_items, statistics, history_token, year)
+            timings.log_summary(logger, user=username, year=year, items=len(history_items), status='ok')
+
+            if incremental:
+                result = {'totalItems': len(history_items), 'statistics': statistics}
+            else:
+                result = {
+                    'items': DeferredJSON(serialize_items, history_items, payload_format),
+                    'statistics': statistics
                 }
-                print('Stat images generated successfully')
-            except Exception as img_error:
-                print(f'Error generating images: {img_error}')
-                statistics['imagePaths'] = {}
-
-            yield f'event: complete\ndata: {json.dumps({"items": history_items, "statistics": statistics})}\n\n'
+            if history_token:
+                result['historyToken'] = history_token
+            publisher.publish('complete', result)
+            publisher.close(status='complete')
         except Exception as error:
-            print('Scraping error:', str(error))
-            yield f'event: error\ndata: {json.dumps({"error": str(error) or "Failed to scrape history"})}\n\n'
+            logger.error('Scraping error: %s', str(error))
+            timings.log_summary(logger, user=username, year=year, status='error')
+            publisher.publish('error', {'error': str(error) or 'Failed to scrape history'})
+            publisher.close(status='error')
 
-    return Response(generate(), mimetype='text/event-stream')
+    def generate():
+        if cached is not None:
+            SSE_CONNECTIONS.inc()
+            try:
+                yield from cached_events()
+            finally:
+                SSE_CONNECTIONS.dec()
+            return
+
+        import secrets
+        import threading
+        from state_store import JobPublisher, get_state_store
+
+        # The scrape runs here, but its events go to the shared store, so the
+        # stream can be picked up again from any instance via /api/jobs/<id>/events
+        store = get_state_store()
+        job_id = secrets.token_urlsafe(16)
+        store.create_job(job_id, status='running', username=username)
+        publisher = JobPublisher(store, job_id)
+        publisher.publish('job', {'jobId': job_id, 'events': f'/api/jobs/{job_id}/events'})
+        threading.Thread(target=run_job, args=(job_id, publisher), name=f'scrape-{job_id[:8]}').start()
+
+        yield from stream_job_events(store, job_id)
+
+    return event_stream_response(generate())
 
 
 @app.route('/api/scrape', methods=['POST'])
@@ -217,46 +573,150 @@ def scrape():
     username = data.get('username')
     password = data.get('password')
     year = data.get('year')
+    payload_format = data.get('payload')
+    profile = profiling_enabled(data.get('profile'))
+    yearly = bool(data.get('yearly'))
+    if yearly:
+        year = None
+    enrich = bool(data.get('enrich'))
+    refresh = bool(data.get('refresh'))
 
     if not username or not password:
         return jsonify({'error': 'Username and password required'}), 400
+    try:
+        year = parse_year(year)
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    timings = PhaseTimer()
+    cache_key = result_cache_key(username, password, year, yearly, enrich)
+    cached = None if refresh or profile else RESULT_CACHE.get(cache_key)
+    if cached is not None:
+        history_token = restore_cached_result(username, cached, timings, year)
+        result = {
+            'items': serialize_items(cached.items, payload_format),
+            'statistics': cached.statistics,
+            'cached': True
+        }
+        if history_token:
+            result['historyToken'] = history_token
+        return jsonify(result)
 
-    print(f'Starting scrape for user: {username}{f" (Year: {year})" if year else ""}')
+    logger.info('Starting scrape for user: %s%s', username, ' (Year: %s)' % year if year else '')
 
     try:
-        history_items = scrape_ao3_history(username, password, year if year else None)
-        print(f'Successfully scraped {len(history_items)} items')
-
-        statistics = calculate_statistics(history_items)
+        from ao3_scraper import scrape_ao3_history
+        from rate_limiter import get_request_limiter
 
-        # Generate stat images
-        print('Generating stat images...')
+        throttle = get_request_limiter().job(username)
+        ACTIVE_SCRAPES.inc()
         try:
-            image_paths = generate_all_stat_images(statistics)
-            statistics['imagePaths'] = {
-                'ships': '/api/stats-image/ships',
-                'tags': '/api/stats-image/tags',
-                'fandoms': '/api/stats-image/fandoms',
-                'overall': '/api/stats-image/overall'
-            }
-            print('Stat images generated successfully')
-        except Exception as img_error:
-            print(f'Error generating images: {img_error}')
-            statistics['imagePaths'] = {}
-
-        return jsonify({
-            'items': history_items,
+            history_items = run_profiled(
+                profile, 'scrape', scrape_ao3_history,
+                username, password, year if year else None,
+                timings=timings, transport=capture_transport(username), enrich=enrich,
+                throttle=throttle
+            )
+        finally:
+            throttle.close()
+            ACTIVE_SCRAPES.dec()
+        logger.info('Successfully scraped %d items', len(history_items))
+
+        statistics = build_statistics(history_items, timings, profile, year, yearly)
+        history_token = store_history(username, history_items, timings)
+        cache_result(cache_key, history_items, statistics, history_token, year)
+        timings.log_summary(logger, user=username, year=year, items=len(history_items), status='ok')
+
+        result = {
+            'items': serialize_items(history_items, payload_format),
             'statistics': statistics
-        })
+        }
+        if history_token:
+            result['historyToken'] = history_token
+        return jsonify(result)
     except Exception as error:
-        print('Scraping error:', str(error))
+        logger.error('Scraping error: %s', str(error))
+        timings.log_summary(logger, user=username, year=year, status='error')
         return jsonify({
             'error': str(error) or 'Failed to scrape history. Please check your credentials.'
         }), 500
 
 
+def check_history_access(username):
+    """Return an error response unless history storage is on and the request carries the user's token"""
+    from history_db import authorize, history_db_enabled
+
+    if not history_db_enabled():
+        return jsonify({'error': 'History storage is not enabled on this server'}), 404
+    if not authorize(username, request.headers.get('X-History-Token')):
+        return jsonify({'error': 'Invalid username or history token'}), 403
+    return None
+
+
+@app.route('/api/history', methods=['GET'])
+def history():
+    """
+    Query stored history for a user
+
+    Requires the historyToken returned by the user's latest scrape, sent as
+    an X-History-Token header. Supports year, fandom, relationship, tag,
+    character, minWords and maxWords filters plus sort, order, page and perPage.
+    """
+    from history_db import query_history, LABEL_FILTERS
+
+    username = request.args.get('username')
+    denied = check_history_access(username)
+    if denied:
+        return denied
+
+    filters = {name: request.args.get(name) for name in LABEL_FILTERS}
+    for name in ('year', 'minWords', 'maxWords'):
+        filters[name] = request.args.get(name, type=int)
+    try:
+        result = query_history(
+            username,
+            filters,
+            sort=request.args.get('sort', 'lastVisited'),
+            order=request.args.get('order', 'desc'),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('perPage', 50, type=int)
+        )
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    return jsonify(result)
+
+
+@app.route('/api/history/search', methods=['GET'])
+def search_history():
+    """Full-text search over a user's stored titles, authors, fandoms, relationships, characters and tags"""
+    from history_db import search_history as search_stored_history
+
+    username = request.args.get('username')
+    denied = check_history_access(username)
+    if denied:
+        return denied
+
+    try:
+        result = search_stored_history(
+            username,
+            request.args.get('q', ''),
+            page=request.args.get('page', 1, type=int),
+            per_page=request.args.get('perPage', 50, type=int)
+        )
+    except ValueError as error:
+        return jsonify({'error': str(error)}), 400
+
+    return jsonify(result)
+
+
 if __name__ == '__main__':
     port = int(__import__('os').environ.get('PORT', 3000))
-    print(f'Server running on http://localhost:{port}')
-    print(f'Health check available at: http://localhost:{port}/api/health')
+    logger.info('Server running on http://localhost:%d', port)
+    logger.info('Health check available at: http://localhost:%d/api/health', port)
+    # Warm the heavy imports in the background once the server is listening
+    import threading
+    preload = threading.Timer(float(os.environ.get('AO3_PRELOAD_DELAY', 1)), preload_heavy_modules)
+    preload.daemon = True
+    preload.start()
     app.run(host='0.0.0.0', port=port, debug=False)
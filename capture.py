@@ -0,0 +1,178 @@
+from datetime import datetime
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+import requests
+
+from transport import Transport, get_transport, make_response
+
+logger = logging.getLogger(__name__)
+
+CAPTURE_DIR = os.environ.get('AO3_CAPTURE_DIR', '/tmp/ao3_captures')
+
+# Headers that carry session secrets and must never be written to disk
+REDACTED_HEADERS = {'set-cookie', 'cookie', 'authorization'}
+
+_USER_PATH = re.compile(r'/users/[^/?]+/')
+
+
+def recording_enabled():
+    """True when AO3_RECORD asks for every scrape to be captured"""
+    return os.environ.get('AO3_RECORD', '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _replay_key(method, url):
+    # Captures replay for any username, so the user segment of the path is ignored
+    return method.upper(), _USER_PATH.sub('/users/*/', url)
+
+
+class CaptureRecorder:
+    """Append raw AO3 responses to a gzip-compressed JSON-lines capture file"""
+
+    def __init__(self, username, directory=None):
+        directory = directory or CAPTURE_DIR
+        os.makedirs(directory, exist_ok=True)
+        filename = f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.jsonl.gz'
+        self.path = os.path.join(directory, filename)
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._write({'type': 'meta', 'username': username, 'recordedAt': datetime.now().isoformat()})
+
+    def _write(self, record):
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._lock:
+            # Each append is its own gzip member; readers see one continuous stream
+            with gzip.open(self.path, 'ab') as f:
+                f.write(line)
+
+    def record(self, method, url, response, elapsed):
+        """Store one response with its headers and timing"""
+        self._write({
+            'type': 'response',
+            'method': method.upper(),
+            'url': url,
+            'finalUrl': response.url,
+            'status': response.status_code,
+            'headers': {
+                name: value for name, value in response.headers.items()
+                if name.lower() not in REDACTED_HEADERS
+            },
+            'offset': round(time.perf_counter() - self.started - elapsed, 4),
+            'elapsed': round(elapsed, 4),
+            'body': response.text
+        })
+
+    def transport(self, inner=None):
+        """Return a transport that records every response it receives"""
+        return RecordingTransport(self, inner)
+
+
+class RecordingTransport(Transport):
+    """Transport that sends through another one and passes every response to a CaptureRecorder"""
+
+    def __init__(self, recorder, inner=None):
+        super().__init__()
+        self.recorder = recorder
+        self.inner = inner or get_transport()
+        self.name = f'{self.inner.name}+record'
+
+    def new_session(self):
+        session = self.inner.new_session()
+        send = session.request
+        recorder = self.recorder
+
+        def request(method, url, *args, **kwargs):
+            started = time.perf_counter()
+            response = send(method, url, *args, **kwargs)
+            try:
+                recorder.record(method, url, response, time.perf_counter() - started)
+            except OSError as e:
+                logger.warning('Could not record response for %s: %s', url, e)
+            return response
+
+        # Whatever the backend, get() and post() go through request()
+        session.request = request
+        return session
+
+    def reset_connections(self):
+        self.inner.reset_connections()
+
+    def stats(self):
+        return self.inner.stats()
+
+
+def load_capture(path):
+    """Read a capture file and return (meta, list of response records)"""
+    meta = {}
+    responses = []
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            if record['type'] == 'meta':
+                meta = record
+            else:
+                responses.append(record)
+    return meta, responses
+
+
+class ReplaySession(requests.Session):
+    """
+    requests.Session that answers from a capture file instead of the network
+
+    Responses are matched by method and URL (ignoring the username) and served
+    in recorded order when the same URL was fetched more than once.
+    """
+
+    def __init__(self, responses, simulate_latency=False):
+        super().__init__()
+        self.simulate_latency = simulate_latency
+        self._responses = {}
+        for record in responses:
+            self._responses.setdefault(_replay_key(record['method'], record['url']), []).append(record)
+
+    def request(self, method, url, *args, **kwargs):
+        queue = self._responses.get(_replay_key(method, url))
+        if not queue:
+            raise requests.exceptions.ConnectionError(f'No recorded response for {method} {url}')
+        record = queue.pop(0) if len(queue) > 1 else queue[0]
+
+        if self.simulate_latency:
+            time.sleep(record['elapsed'])
+
+        # The stored body is already decoded text
+        return make_response(
+            method, url, record['status'], record['body'], record['headers'], final_url=record.get('finalUrl')
+        )
+
+
+class ReplayTransport(Transport):
+    """Transport that answers from recorded responses; each session replays them from the start"""
+    name = 'replay'
+
+    def __init__(self, responses, simulate_latency=False):
+        super().__init__()
+        self.responses = responses
+        self.simulate_latency = simulate_latency
+
+    def new_session(self):
+        return ReplaySession(self.responses, self.simulate_latency)
+
+
+def replay_scrape(path, simulate_latency=False, **kwargs):
+    """Run scrape_ao3_history against a capture file with no network access and no pacing"""
+    from ao3_scraper import scrape_ao3_history
+
+    meta, responses = load_capture(path)
+    return scrape_ao3_history(
+        meta.get('username', 'replay'),
+        'replay',
+        transport=ReplayTransport(responses, simulate_latency),
+        pace=False,
+        **kwargs
+    )
@@ -0,0 +1,88 @@
+"""
+Check that CLI exports hold the same items the scraper returns, enriched or not
+
+    python check_cli_export.py [--pages 3]
+
+Records an unpaced, enriched scrape of check_scrape_throughput.py's
+synthetic history (whose blurbs show no kudos or chapters) into a capture
+file. It then exports that capture to NDJSON with `python -m ao3_cli
+--replay`, with and without --enrich and with a year filter. Each export
+runs in a fresh process, so the work cache starts empty and enrichment
+really fetches the work pages. The check fails if an enriched export has a
+row without kudos, chapters or completion, or if any export's rows differ
+from what scrape_ao3_history returns for the same capture and options.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+ENRICHED_FIELDS = ('kudos', 'chapters', 'complete')
+
+
+def record_fixture(directory, pages):
+    """Capture an enriched scrape of the synthetic history and return the capture path"""
+    from ao3_scraper import scrape_ao3_history
+    from capture import CaptureRecorder
+    from check_scrape_throughput import synthetic_transport
+
+    recorder = CaptureRecorder('benchmark', directory)
+    transport = recorder.transport(synthetic_transport('benchmark', pages, 20, 0))
+    scrape_ao3_history('benchmark', 'benchmark', transport=transport, pace=False, enrich=True)
+    return recorder.path
+
+
+def export_rows(capture_path, output, options):
+    """Run the CLI on the capture in a fresh process and return the exported rows"""
+    command = [sys.executable, '-m', 'ao3_cli', 'benchmark', '-o', output, '--replay', capture_path, *options]
+    result = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+                            env={**os.environ, 'LOG_LEVEL': 'WARNING'})
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(options) or "plain"} export failed:\n{result.stderr}')
+    with open(output, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=9,
+                        help='pages of 20 works in the synthetic history (150 works per visit year)')
+    args = parser.parse_args(argv)
+
+    # Enrich every work, here and in the CLI processes
+    os.environ['AO3_ENRICH_LIMIT'] = str(args.pages * 20)
+    logging.disable(logging.INFO)
+    from capture import replay_scrape
+    from history_item import items_to_dicts
+    from work_cache import WORK_CACHE
+
+    workdir = tempfile.mkdtemp(prefix='ao3_cli_export_')
+    capture_path = record_fixture(workdir, args.pages)
+    # The synthetic history's second visit year
+    year = 2024
+
+    failures = []
+    for options, enrich, year_filter in (([], False, None), (['--enrich'], True, None),
+                                         (['--enrich', '--year', str(year)], True, year)):
+        label = ' '.join(options) or 'plain'
+        rows = export_rows(capture_path, os.path.join(workdir, 'export.ndjson'), options)
+        # Start from an empty work cache, as the CLI process does
+        WORK_CACHE.clear()
+        expected = items_to_dicts(replay_scrape(capture_path, enrich=enrich, year=year_filter))
+        missing = sum(1 for row in rows if any(row[field] is None for field in ENRICHED_FIELDS))
+        print(f'{label:24s} {len(rows):4d} rows, {missing:4d} without kudos/chapters/complete')
+        if rows != expected:
+            failures.append(f'{label}: rows differ from scrape_ao3_history')
+        if enrich and (missing or not rows):
+            failures.append(f'{label}: {missing} of {len(rows)} rows not enriched')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
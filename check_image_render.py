@@ -0,0 +1,250 @@
+"""
+Benchmark stat card rendering and compare it against golden images
+
+    python check_image_render.py [--runs 5] [--only ships] [--json results.json]
+    python check_image_render.py --update-goldens
+
+Renders every card type with short, long and Unicode-heavy names and with
+top lists of 1, 3 and 10 entries, each case in a fresh process. It reports
+the median render time and PNG encode time per card, plus the peak memory
+the render added over the worker's baseline. Each card is also compared
+with its golden image in image_goldens/ (lossless WebP at full size). Both
+are blurred slightly, so anti-aliasing and sub-pixel shifts don't count, but
+changed text, layout or colour does. The check fails when more than
+--max-changed of the pixels differ by more than --tolerance.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'image_goldens')
+LIST_LENGTHS = (1, 3, 10)
+COUNTS = [1523, 987, 456, 210, 99, 42, 17, 8, 3, 1]
+
+NAME_SETS = {
+    'short': {
+        'ships': ['Kirk/Spock', 'Aziraphale/Crowley', 'Buffy/Spike', 'Sherlock/John', 'Cas/Dean',
+                  'Finn/Poe', 'Jon/Sansa', 'Eret/Izzy', 'Will/Nico', 'Ed/Stede'],
+        'tags': ['Fluff', 'Angst', 'Smut', 'Slow Burn', 'AU', 'Hurt/Comfort', 'Canon Divergence',
+                 'Humor', 'Pining', 'Domestic'],
+        'fandoms': ['Good Omens', 'Supernatural', 'Star Trek', 'Sherlock', 'Star Wars', 'Hannibal',
+                    'Merlin', 'Haikyuu!!', 'Bleach', 'Dune'],
+        'title': 'Nocturne'
+    },
+    'long': {
+        'ships': [f'Hermione Granger/Draco Malfoy/Harry Potter/Ron Weasley/Original Female Character {i}'
+                  for i in range(1, 11)],
+        'tags': [f'Alternate Universe - Coffee Shops & Cafés - With Extremely Elaborate Worldbuilding Part {i}'
+                 for i in range(1, 11)],
+        'fandoms': [f'Marvel Cinematic Universe & The Avengers (Marvel Movies) & Captain America (Movies) {i}'
+                    for i in range(1, 11)],
+        'title': ('An Extraordinarily Long Title That Keeps Going Well Past The Point Where It Should Have '
+                  'Stopped, Through Several More Clauses, And Then A Few More For Good Measure')
+    },
+    'unicode': {
+        'ships': ['魏无羡/蓝忘机 | Wei Wuxian/Lan Wangji', 'Кирилл/Алёша', 'Ἀχιλλεύς/Πάτροκλος',
+                  'Zoë/Chloé 🌸', 'Ёжик/Медвежонок', '謝憐/花城', 'Søren/Åsa', 'Ñandú/Çiğdem',
+                  'אברהם/שרה', 'Nguyễn/Trần'],
+        'tags': ['🌸 Fluff 🌸', 'Флафф', 'Ангст', 'Bruderschaft ß', '甜文', 'Ästhetik',
+                 'Ελληνικά', 'Schmerz & Trost', '✨ Soft ✨', 'Café AU ☕'],
+        'fandoms': ['魔道祖师 - 墨香铜臭', 'Мастер и Маргарита', 'Ὀδύσσεια', 'Les Misérables',
+                    '天官赐福', 'Zoë’s Café', 'Ángeles', 'Çağ', 'Ærø', 'Đà Lạt'],
+        'title': '愛と哀しみのノクターン — Ноктюрн для Zoë ☕'
+    }
+}
+
+
+def build_cases():
+    """Return {case name: (card type, statistics, year)} for every benchmark case"""
+    cases = {}
+    for set_name, names in NAME_SETS.items():
+        for card_type, key, field in (('ships', 'topShips', 'ship'), ('tags', 'topTags', 'tag'),
+                                      ('fandoms', 'topFandoms', 'fandom')):
+            for length in LIST_LENGTHS:
+                entries = [{field: name, 'count': count} for name, count in zip(names[card_type], COUNTS)]
+                cases[f'{card_type}-{set_name}-{length}'] = (card_type, {key: entries[:length]}, None)
+        overall = {
+            'totalFics': 12345,
+            'totalWords': 98765432,
+            'longestFic': {'title': names['title'], 'wordCount': 1234567}
+        }
+        cases[f'overall-{set_name}'] = ('overall', overall, None)
+    cases['overall-short-year'] = ('overall', cases['overall-short'][1], 2024)
+    return cases
+
+
+def golden_path(case_name):
+    return os.path.join(GOLDEN_DIR, f'{case_name}.webp')
+
+
+def peak_rss_bytes():
+    """High-water mark of this process's resident memory, or None where it can't be read"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def perceptual_diff(image, golden, tolerance):
+    """Return (fraction of pixels changed beyond tolerance, mean difference) after a slight blur"""
+    from PIL import ImageChops, ImageFilter, ImageStat
+
+    if image.size != golden.size:
+        return 1.0, 255.0
+    blur = ImageFilter.GaussianBlur(1.5)
+    difference = ImageChops.difference(image.convert('RGB').filter(blur), golden.convert('RGB').filter(blur))
+    # Largest channel difference per pixel
+    red, green, blue = difference.split()
+    largest = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    histogram = largest.histogram()
+    changed = sum(histogram[tolerance + 1:])
+    return changed / (image.width * image.height), ImageStat.Stat(largest).mean[0]
+
+
+def run_case(case_name, runs, tolerance, update, diff_dir):
+    """Render one case in this process and return its measurements (run in a fresh worker)"""
+    from PIL import Image
+    from image_generator import encode_image, render_stat_image
+
+    card_type, card_statistics, year = build_cases()[case_name]
+    baseline = peak_rss_bytes()
+
+    render_times = []
+    peak = None
+    for _ in range(max(runs, 1)):
+        image = None
+        started = time.perf_counter()
+        image = render_stat_image(card_type, card_statistics, year)
+        render_times.append((time.perf_counter() - started) * 1000)
+        # Peak for a single card, before later runs add garbage of their own
+        if peak is None:
+            peak = peak_rss_bytes()
+
+    started = time.perf_counter()
+    encode_image(image, 'png')
+    encode_ms = (time.perf_counter() - started) * 1000
+
+    result = {
+        'case': case_name,
+        'renderMs': statistics.median(render_times),
+        'firstRenderMs': render_times[0],
+        'encodeMs': encode_ms,
+        'peakMiB': (peak - baseline) / 2 ** 20 if baseline is not None else None,
+        'changed': None,
+        'meanDiff': None
+    }
+
+    path = golden_path(case_name)
+    if update:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        image.save(path, 'WEBP', lossless=True, method=6)
+    elif os.path.exists(path):
+        with Image.open(path) as golden:
+            golden.load()
+            result['changed'], result['meanDiff'] = perceptual_diff(image, golden, tolerance)
+            if diff_dir and result['changed'] > 0:
+                from PIL import ImageChops
+                os.makedirs(diff_dir, exist_ok=True)
+                image.save(os.path.join(diff_dir, f'{case_name}.png'))
+                ImageChops.difference(image.convert('RGB'), golden.convert('RGB')).save(
+                    os.path.join(diff_dir, f'{case_name}-diff.png'))
+    return result
+
+
+def font_in_use():
+    from image_generator import get_font
+
+    return getattr(get_font(12), 'path', 'Pillow default font')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='renders per case (median is reported)')
+    parser.add_argument('--only', help='run only cases whose name contains this')
+    parser.add_argument('--tolerance', type=int, default=12, help='per-pixel difference (0-255) that counts as changed')
+    parser.add_argument('--max-changed', type=float, default=0.0001, help='fraction of changed pixels that fails a case')
+    parser.add_argument('--update-goldens', action='store_true', help='replace the golden images with the current output')
+    parser.add_argument('--diff-dir', help='write the render and a difference image for every case that changed')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--case', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        result = run_case(args.case, args.runs, args.tolerance, args.update_goldens, args.diff_dir)
+        print(json.dumps(result))
+        return 0
+
+    from PIL import __version__ as pillow_version, features
+
+    if not features.check_module('webp'):
+        print('FAIL: golden images need Pillow built with WebP support')
+        return 1
+
+    manifest_path = os.path.join(GOLDEN_DIR, 'manifest.json')
+    environment = {'font': font_in_use(), 'pillow': pillow_version, 'freetype': features.version('freetype2')}
+    if args.update_goldens:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(environment, f, indent=2)
+            f.write('\n')
+    elif os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            recorded = json.load(f)
+        if recorded != environment:
+            print(f'Note: goldens were made with {recorded}, this is {environment}; expect small differences')
+
+    names = [name for name in build_cases() if not args.only or args.only in name]
+    results = []
+    print(f'{"case":28s} {"render ms":>9s} {"first ms":>9s} {"png ms":>8s} {"peak MiB":>9s} {"changed":>9s}')
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), '--case', name, '--runs', str(args.runs),
+                   '--tolerance', str(args.tolerance)]
+        if args.update_goldens:
+            command.append('--update-goldens')
+        if args.diff_dir:
+            command += ['--diff-dir', args.diff_dir]
+        worker = subprocess.run(command, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if worker.returncode != 0:
+            raise RuntimeError(f'case {name} failed:\n{worker.stderr}')
+        result = json.loads(worker.stdout.strip().splitlines()[-1])
+        results.append(result)
+
+        peak = f'{result["peakMiB"]:.1f}' if result['peakMiB'] is not None else '-'
+        if args.update_goldens:
+            changed = 'updated'
+        elif result['changed'] is None:
+            changed = 'no golden'
+        else:
+            changed = f'{result["changed"] * 100:.3f}%'
+        print(f'{name:28s} {result["renderMs"]:9.1f} {result["firstRenderMs"]:9.1f} '
+              f'{result["encodeMs"]:8.1f} {peak:>9s} {changed:>9s}')
+
+    render_times = [result['renderMs'] for result in results]
+    print(f'{len(results)} cards: median render {statistics.median(render_times):.1f} ms, '
+          f'slowest {max(render_times):.1f} ms')
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'environment': environment, 'results': results}, f, indent=2)
+
+    if args.update_goldens:
+        print(f'Wrote {len(results)} golden images to {GOLDEN_DIR}')
+        return 0
+    missing = [result['case'] for result in results if result['changed'] is None]
+    changed = [result['case'] for result in results if result['changed'] is not None and result['changed'] > args.max_changed]
+    if missing:
+        print(f'FAIL: no golden image for {", ".join(missing)} (run with --update-goldens)')
+    if changed:
+        print(f'FAIL: output changed for {", ".join(changed)}')
+    return 1 if missing or changed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
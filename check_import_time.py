@@ -0,0 +1,71 @@
+"""
+Fail when `import app` exceeds its cold-start import budget
+
+    python check_import_time.py [--budget-ms 400] [--runs 3]
+
+Runs `python -X importtime -c "import app"` in fresh interpreters and checks
+the best cumulative time for the app module against the budget. It also fails
+if the scraper or image stack (app.HEAVY_MODULES, bs4, PIL) is imported eagerly.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# Modules that must only be imported lazily by app.py
+FORBIDDEN_AT_IMPORT = ('ao3_scraper', 'capture', 'image_generator', 'bs4', 'PIL')
+
+
+def measure_import(module='app'):
+    """Return (cumulative microseconds for module, set of imported module names)"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        env={**os.environ, 'LOG_LEVEL': 'WARNING'}
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{result.stderr}')
+
+    cumulative = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            cumulative = int(cumulative_us)
+    return cumulative, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('AO3_IMPORT_BUDGET_MS', 400)))
+    parser.add_argument('--runs', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    timings = []
+    eager = set()
+    for _ in range(args.runs):
+        cumulative, imported = measure_import()
+        timings.append(cumulative / 1000)
+        eager |= imported & set(FORBIDDEN_AT_IMPORT)
+
+    best = min(timings)
+    print(f'import app: best {best:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)')
+
+    failed = False
+    if eager:
+        print(f'FAIL: imported eagerly: {", ".join(sorted(eager))}')
+        failed = True
+    if best > args.budget_ms:
+        print(f'FAIL: import time {best:.0f} ms is over budget')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Measure how much memory a long history takes as dicts and as HistoryItems
+
+    python check_item_memory.py [--items 20000] [--max-ratio 0.5]
+
+Builds a synthetic history with the repetition of a real one (a few hundred
+tags, a few dozen fandoms, characters and authors, the same ratings and
+warnings on most works). Every string is a separate copy, as it would be
+straight out of the HTML parser. The history is held once as the API's dicts
+and once as HistoryItems built through a shared StringInterner, the way the
+scraper builds them page by page. The memory each takes is measured with
+tracemalloc. The check fails when the HistoryItems take more than
+--max-ratio of the dicts' memory, or don't convert back to the same dicts.
+"""
+import argparse
+import random
+import sys
+import tracemalloc
+
+from history_item import HistoryItem, StringInterner, items_to_dicts
+
+PAGE_SIZE = 20
+RATINGS = ['General Audiences', 'Teen And Up Audiences', 'Mature', 'Explicit', 'Not Rated']
+WARNINGS = ['No Archive Warnings Apply', 'Creator Chose Not To Use Archive Warnings',
+            'Graphic Depictions Of Violence', 'Major Character Death']
+CATEGORIES = ['M/M', 'F/F', 'F/M', 'Gen', 'Multi', 'Other']
+
+
+def fresh(value):
+    """A new copy of value, as the parser would hand back for each blurb"""
+    return (value + ' ')[:-1]
+
+
+def synthetic_works(count, seed=0):
+    """Yield count work dicts in the API schema with realistic repetition"""
+    rng = random.Random(seed)
+    tags = [f'Tag {i}' for i in range(300)]
+    characters = [f'Character {i}' for i in range(40)]
+    fandoms = [f'Fandom {i}' for i in range(20)]
+    authors = [f'author{i}' for i in range(50)]
+    for i in range(count):
+        year = 2025 - i // 2000
+        pair = rng.sample(characters, 2)
+        yield {
+            'title': f'Work number {i}: the coffee shop AU',
+            'author': fresh(rng.choice(authors)),
+            'url': f'https://archiveofourown.org/works/{1000 + i}',
+            'wordCount': rng.randint(100, 200000),
+            'tags': [fresh(tag) for tag in rng.sample(tags, rng.randint(2, 10))],
+            'characters': [fresh(name) for name in rng.sample(characters, rng.randint(1, 4))],
+            'relationships': [fresh('/'.join(pair))] if rng.random() < 0.7 else [],
+            'warnings': [fresh(rng.choice(WARNINGS[:2]) if rng.random() < 0.9 else rng.choice(WARNINGS))],
+            'categories': [fresh(rng.choice(CATEGORIES))],
+            'rating': fresh(rng.choice(RATINGS)),
+            'fandoms': [fresh(fandom) for fandom in rng.sample(fandoms, rng.randint(1, 2))],
+            'lastVisited': f'{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'kudos': rng.randint(0, 20000),
+            'chapters': fresh(rng.choice(['1/1', '3/3', '5/?', '12/20'])),
+            'complete': rng.random() < 0.8
+        }
+
+
+def traced_bytes(build):
+    """Return (result of build(), bytes it still holds once built)"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, held
+
+
+def build_items(count):
+    """Build HistoryItems page by page, dropping each page's dicts, as the scraper does"""
+    interner = StringInterner()
+    items = []
+    page = []
+    for work in synthetic_works(count):
+        page.append(work)
+        if len(page) == PAGE_SIZE:
+            items.extend(HistoryItem.from_dict(data, interner) for data in page)
+            page = []
+    items.extend(HistoryItem.from_dict(data, interner) for data in page)
+    return items, interner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--max-ratio', type=float, default=0.5,
+                        help='fail when HistoryItems take more than this fraction of the dicts\' memory')
+    args = parser.parse_args(argv)
+
+    works, dict_bytes = traced_bytes(lambda: list(synthetic_works(args.items)))
+    del works
+    (items, interner), item_bytes = traced_bytes(lambda: build_items(args.items))
+
+    ratio = item_bytes / dict_bytes
+    print(f'{args.items} items, {len(interner)} distinct interned strings')
+    print(f'  dict items   {dict_bytes / 2 ** 20:7.1f} MiB  {dict_bytes / args.items:6.0f} B/item')
+    print(f'  HistoryItem  {item_bytes / 2 ** 20:7.1f} MiB  {item_bytes / args.items:6.0f} B/item  ({ratio:.0%})')
+
+    failed = False
+    if items_to_dicts(items) != list(synthetic_works(args.items)):
+        print('FAIL: HistoryItems don\'t convert back to the same dicts')
+        failed = True
+    if ratio > args.max_ratio:
+        print(f'FAIL: HistoryItems take {ratio:.0%} of the dicts\' memory (limit {args.max_ratio:.0%})')
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,106 @@
+"""
+Compare plain and compact item payloads: size and serialization time, raw, gzip and brotli
+
+    python check_payloads.py [--items 5000] [--runs 5]
+    python check_payloads.py --capture /tmp/ao3_captures/<file>.jsonl.gz
+
+Serializes a history the way the app sends it, as plain item dicts and as
+the compact string-table payload (payload=compact). The history is
+check_item_memory.py's synthetic one, whose tags, fandoms and authors
+repeat like a real history's, or the items of a capture recorded with
+AO3_RECORD=1. The whole history is encoded as one body, as in the complete
+event and /api/scrape, and page by page, as in the stream's item events
+of 20 items. For each it prints the raw, gzip and brotli sizes (brotli
+only if it's installed) and the best time over --runs to build and
+json.dumps the payload, and to compress it. Compression uses the app's
+own settings: compress_body for whole bodies, and compress_stream,
+flushing after every event, for pages. Compressed, compact only comes out
+ahead on long histories sent whole: each page, and each short history,
+carries its own string table, while the compressor already matches the
+strings plain items repeat. The check fails if the compact payload doesn't
+decode back to the plain items, or is larger than the plain one raw.
+"""
+import argparse
+import json
+import sys
+import time
+
+PAGE_SIZE = 20
+
+
+def best_ms(function, runs):
+    """Return (best milliseconds over runs, last result)"""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def load_items(args):
+    """The HistoryItems to serialize, and a description of where they came from"""
+    if args.capture:
+        import logging
+        logging.disable(logging.INFO)
+        from capture import replay_scrape
+
+        return replay_scrape(args.capture), args.capture
+    from check_item_memory import build_items
+
+    return build_items(args.items)[0], 'synthetic history'
+
+
+def page_events(items, encode):
+    """The stream's item events for items, PAGE_SIZE per page"""
+    return [f'event: items\ndata: {json.dumps({"page": start // PAGE_SIZE + 1, "items": encode(items[start:start + PAGE_SIZE])})}\n\n'
+            for start in range(0, len(items), PAGE_SIZE)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=5000, help='items in the synthetic history')
+    parser.add_argument('--capture', help='serialize the items of this capture file instead')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from history_item import items_to_dicts
+    from payloads import brotli, compress_body, compress_stream, decode_compact_items, encode_compact_items
+
+    items, source = load_items(args)
+    encodings = ['gzip', 'br'] if brotli is not None else ['gzip']
+    print(f'{len(items)} items from the {source}' + ('' if brotli is not None else '; brotli is not installed'))
+    print(f'{"":16s} {"raw KB":>8s} {"encode ms":>9s}' + ''.join(f' {e + " KB":>8s} {"+ms":>6s}' for e in encodings))
+
+    failures = []
+    sizes = {}
+    for payload, encode in (('plain', items_to_dicts), ('compact', encode_compact_items)):
+        body_ms, body = best_ms(lambda: json.dumps(encode(items)).encode('utf-8'), args.runs)
+        pages_ms, events = best_ms(lambda: page_events(items, encode), args.runs)
+        for label, raw, encode_ms in ((f'{payload} body', body, body_ms),
+                                      (f'{payload} pages', ''.join(events).encode('utf-8'), pages_ms)):
+            row = f'{label:16s} {len(raw) / 1024:8.0f} {encode_ms:9.1f}'
+            sizes[label] = len(raw)
+            for encoding in encodings:
+                if label.endswith('body'):
+                    compress_ms, compressed = best_ms(lambda: compress_body(raw, encoding), args.runs)
+                else:
+                    compress_ms, compressed = best_ms(lambda: b''.join(compress_stream(events, encoding)), args.runs)
+                row += f' {len(compressed) / 1024:8.0f} {compress_ms:6.1f}'
+            print(row)
+
+    if decode_compact_items(encode_compact_items(items)) != items_to_dicts(items):
+        failures.append('the compact payload does not decode back to the plain items')
+    for kind in ('body', 'pages'):
+        plain, compact = sizes[f'plain {kind}'], sizes[f'compact {kind}']
+        if compact > plain:
+            failures.append(f'the compact {kind} is larger than the plain one: {compact} > {plain} bytes')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
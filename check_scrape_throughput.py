@@ -0,0 +1,229 @@
+"""
+Benchmark how many history pages per second concurrent scrapes get through
+
+    python check_scrape_throughput.py [--pages 10] [--scrapes 1 4 16] [--parse-workers 0 4]
+    python check_scrape_throughput.py --latency 0.12 --pages 24 --scrapes 1 --parse-workers 0 --page-concurrency 1 2 4
+    python check_scrape_throughput.py --capture /tmp/ao3_captures/<file>.jsonl.gz
+
+Runs scrapes with no pacing against an offline AO3: a synthetic history
+served through FixtureTransport, or a capture file recorded with
+AO3_RECORD=1. It runs them for every combination of concurrent scrapes,
+AO3_PARSE_WORKERS (0 parses on each scrape's own thread) and
+AO3_PAGE_CONCURRENCY; give --latency a realistic round trip to see what
+overlapping page fetches saves. For each it reports the wall time,
+aggregate pages per second and the p99 lateness of a 10 ms timer
+thread, which stands in for the app's other request threads competing for
+the GIL. It fails if any scrape returns different items from the first.
+"""
+import argparse
+import random
+import statistics
+import sys
+import threading
+import time
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+LOGIN_PAGE = '''<html><head><title>Log In | Archive of Our Own</title></head><body>
+<form id="new_user" action="/users/login" method="post">
+<input type="hidden" name="authenticity_token" value="benchmark-authenticity-token">
+<input name="user[login]"><input name="user[password]" type="password"></form></body></html>'''
+LOGGED_IN_PAGE = '''<html><head><title>Archive of Our Own</title></head><body>
+<ul id="greeting"><li>Hi, benchmark!</li></ul></body></html>'''
+WORK_PAGE = '''<html><head><title>Work | Archive of Our Own</title></head><body>
+<dl class="work meta group"><dd class="stats"><dl class="stats">
+<dt class="chapters">Chapters:</dt><dd class="chapters">{chapters}</dd>
+<dt class="kudos">Kudos:</dt><dd class="kudos">{kudos:,}</dd>
+</dl></dd></dl><div id="chapters">{text}</div></body></html>'''
+
+
+def work_blurb(index, rng):
+    """One reading-history blurb with a realistic spread of tags"""
+    fandoms = ''.join(f'<a class="tag" href="/tags/f">Fandom {rng.randint(0, 20)}</a>'
+                      for _ in range(rng.randint(1, 2)))
+    relationships = ''.join(f'<li class="relationships"><a class="tag" href="/tags/r">'
+                            f'Character {rng.randint(0, 40)}/Character {rng.randint(0, 40)}</a></li>'
+                            for _ in range(rng.randint(0, 3)))
+    characters = ''.join(f'<li class="characters"><a class="tag" href="/tags/c">Character {rng.randint(0, 40)}</a></li>'
+                         for _ in range(rng.randint(1, 4)))
+    tags = ''.join(f'<li class="freeforms"><a class="tag" href="/tags/t">Tag {rng.randint(0, 300)}</a></li>'
+                   for _ in range(rng.randint(2, 10)))
+    visited = f'{rng.randint(1, 28)} {rng.choice(MONTHS)} {2025 - index // 150}'
+    return f'''<li id="work_{1000 + index}" class="reading work blurb group" role="article">
+<div class="header module">
+<h4 class="heading"><a href="/works/{1000 + index}">Work number {index}</a> by <a rel="author" href="/users/author{index % 50}/pseuds/author{index % 50}">author{index % 50}</a></h4>
+<h5 class="fandoms heading"><span class="landmark">Fandoms:</span>{fandoms}</h5>
+<ul class="required-tags"><li><a class="help symbol question modal" title="Symbols key"><span class="rating-teen rating" title="Teen And Up Audiences"><span class="text">Teen And Up Audiences</span></span></a></li></ul>
+</div>
+<ul class="tags commas">
+<li class="warnings"><strong><a class="tag" href="/tags/w">No Archive Warnings Apply</a></strong></li>
+{relationships}{characters}{tags}
+</ul>
+<dl class="stats"><dt class="words">Words:</dt><dd class="words">{rng.randint(100, 200000):,}</dd></dl>
+<div class="user module group"><h4 class="viewed heading"><span>Last visited:</span> {visited} Visited once</h4></div>
+</li>'''
+
+
+def history_page(username, page, total_pages, per_page):
+    """The HTML of one page of a synthetic reading history"""
+    rng = random.Random(page)
+    works = ''.join(work_blurb((page - 1) * per_page + i, rng) for i in range(per_page))
+    links = ''.join(f'<li><a href="/users/{username}/readings?page={p}">{p}</a></li>'
+                    for p in range(1, total_pages + 1))
+    if page < total_pages:
+        links += f'<li class="next" title="next"><a rel="next" href="/users/{username}/readings?page={page + 1}">Next →</a></li>'
+    return f'''<html><head><title>History | Archive of Our Own</title></head><body>
+<h2 class="heading">History</h2>
+<ol class="pagination actions">{links}</ol>
+<ol class="reading work index group">{works}</ol>
+<ol class="pagination actions">{links}</ol>
+</body></html>'''
+
+
+def work_page(work_id):
+    """The HTML of a synthetic work page; its blurb shows no kudos or chapters, so enrichment fetches it"""
+    written = work_id % 7 + 1
+    chapters = f'{written}/{written}' if work_id % 3 else f'{written}/?'
+    return WORK_PAGE.format(chapters=chapters, kudos=work_id * 3, text='Lorem ipsum dolor sit amet. ' * 200)
+
+
+def synthetic_transport(username, total_pages, per_page, latency):
+    """FixtureTransport answering login, history and work page requests for a synthetic history"""
+    from transport import FixtureTransport
+
+    pages = {page: history_page(username, page, total_pages, per_page) for page in range(1, total_pages + 1)}
+    headers = {'Content-Type': 'text/html; charset=utf-8'}
+
+    def handler(method, url, **kwargs):
+        if latency:
+            time.sleep(latency)
+        if url.endswith('/users/login'):
+            return 200, LOGIN_PAGE if method == 'GET' else LOGGED_IN_PAGE, headers
+        if '/readings?page=' in url:
+            page = int(url.rsplit('page=', 1)[1].split('&')[0])
+            if page in pages:
+                return 200, pages[page], headers
+        if '/works/' in url:
+            return 200, work_page(int(url.split('/works/', 1)[1].split('?')[0])), headers
+        return 404, 'Not found', headers
+
+    return FixtureTransport(handler)
+
+
+def capture_transport(path, latency):
+    """ReplayTransport for a capture file, with its username and history page count"""
+    from capture import ReplayTransport, load_capture
+
+    meta, responses = load_capture(path)
+    pages = sum(1 for record in responses if '/readings' in record['url'])
+    return ReplayTransport(responses, simulate_latency=latency > 0), meta.get('username', 'replay'), pages
+
+
+class TimerLag:
+    """Thread that sleeps in 10 ms steps and records how late each wake-up is"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.lags = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='timer-lag', daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            time.sleep(self.interval)
+            self.lags.append(time.perf_counter() - started - self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def p99_ms(self):
+        if len(self.lags) < 2:
+            return 0.0
+        return statistics.quantiles(self.lags, n=100)[98] * 1000
+
+
+def run_scrapes(count, transport, username, **kwargs):
+    """Run count scrapes at once and return (wall seconds, list of item dict lists)"""
+    from ao3_scraper import scrape_ao3_history
+    from history_item import items_to_dicts
+
+    results = [None] * count
+    errors = []
+
+    def scrape(index):
+        try:
+            results[index] = items_to_dicts(scrape_ao3_history(username, 'benchmark', transport=transport,
+                                                               pace=False, **kwargs))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=scrape, args=(i,), name=f'scrape-{i}') for i in range(count)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    if errors:
+        raise errors[0]
+    return wall, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=10, help='pages in the synthetic history')
+    parser.add_argument('--per-page', type=int, default=20, help='works per synthetic page')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each synthetic request takes (with --capture, any value > 0 replays the recorded times)')
+    parser.add_argument('--capture', help='replay this capture file instead of a synthetic history')
+    parser.add_argument('--scrapes', type=int, nargs='+', default=[1, 4, 16], help='concurrent scrapes to run')
+    parser.add_argument('--parse-workers', type=int, nargs='+', default=[0, 4], help='AO3_PARSE_WORKERS values to run')
+    parser.add_argument('--page-concurrency', type=int, nargs='+', default=[1],
+                        help='AO3_PAGE_CONCURRENCY values to run')
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+    import parse_pool
+
+    if args.capture:
+        transport, username, pages = capture_transport(args.capture, args.latency)
+    else:
+        username, pages = 'benchmark', args.pages
+        transport = synthetic_transport(username, pages, args.per_page, args.latency)
+
+    # Warm-up scrape: imports, and the items every later scrape must match
+    _, (expected,) = run_scrapes(1, transport, username, page_concurrency=1)
+    print(f'{pages} pages, {len(expected)} items per scrape')
+    print(f'{"workers":>7s} {"pages K":>8s} {"scrapes":>8s} {"pages/s":>8s} {"wall s":>7s} {"timer p99 ms":>13s}')
+
+    failures = []
+    try:
+        for workers in args.parse_workers:
+            parse_pool.configure_parse_pool(workers)
+            parse_pool.warm_parse_pool()
+            label = str(workers) if workers else 'inline'
+            for concurrency in args.page_concurrency:
+                for count in args.scrapes:
+                    with TimerLag() as lag:
+                        wall, results = run_scrapes(count, transport, username, page_concurrency=concurrency)
+                    print(f'{label:>7s} {concurrency:8d} {count:8d} {count * pages / wall:8.1f} {wall:7.2f} '
+                          f'{lag.p99_ms():13.1f}')
+                    if any(result != expected for result in results):
+                        failures.append(f'{label} K={concurrency} x{count}')
+    finally:
+        parse_pool.shutdown_parse_pool()
+
+    if failures:
+        print(f'FAIL: items differ from the first scrape for {", ".join(failures)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,99 @@
+"""
+Check that history search answers within its latency budget at 50k works
+
+    python check_search.py [--works 50000] [--budget-ms 50] [--db /tmp/search.db]
+
+Stores a synthetic history of --works works for one user in a history
+database (a temporary one unless --db names a file to build once and
+reuse). It then times searches from very broad (a word in every title) to
+selective (one title), on the first page and on the last. Each query
+runs --runs times and the best time counts, as it would on a warm server.
+The check fails when any query takes longer than --budget-ms.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+TITLE_WORDS = ['coffee', 'shop', 'moon', 'library', 'winter', 'letters', 'garden', 'storm', 'tea', 'river',
+               'stars', 'ghost', 'fire', 'summer', 'dragon', 'crown', 'ocean', 'paper', 'silver', 'sparrow']
+QUERIES = [
+    'work',                 # every title
+    'character',            # nearly every work
+    'tag 1',                # two common words
+    'coffee',               # about a third of the works
+    'coffee shop',
+    'fandom 3 tea',
+    'sparrow silver winter',
+    'coff',                 # prefix
+    'work 12345',           # one work
+    'nothing matches this'
+]
+
+
+def synthetic_history(count, seed=0):
+    """Yield count API item dicts with titles drawn from a small vocabulary"""
+    from check_item_memory import synthetic_works
+
+    rng = random.Random(seed)
+    for work in synthetic_works(count, seed):
+        index = int(work['url'].rsplit('/', 1)[1]) - 1000
+        work['title'] = f'{" ".join(rng.sample(TITLE_WORDS, 3)).title()} (work {index})'
+        yield work
+
+
+def build_database(path, works):
+    from history_db import save_history
+
+    started = time.perf_counter()
+    save_history('benchmark', list(synthetic_history(works)), path=path)
+    print(f'Stored {works} works in {time.perf_counter() - started:.1f}s')
+
+
+def time_query(path, text, page, runs):
+    """Return (best milliseconds, result) for one search"""
+    from history_db import search_history
+
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = search_history('benchmark', text, page=page, per_page=50, path=path)
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--works', type=int, default=50000)
+    parser.add_argument('--budget-ms', type=float, default=50.0)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--db', help='history database to build once and reuse')
+    args = parser.parse_args(argv)
+
+    path = args.db or os.path.join(tempfile.mkdtemp(prefix='ao3_search_'), 'history.db')
+    if not os.path.exists(path):
+        build_database(path, args.works)
+
+    slow = []
+    print(f'{"query":24s} {"page":>5s} {"matches":>8s} {"ranked":>7s} {"ms":>7s}')
+    for text in QUERIES:
+        _, first = time_query(path, text, 1, 1)
+        # The first page and the last one, deep past the ranked matches on broad queries
+        for page in sorted({1, max((first['total'] + 49) // 50, 1)}):
+            elapsed, result = time_query(path, text, page, args.runs)
+            print(f'{text:24s} {page:5d} {result["total"]:8d} {str(result["ranked"]):>7s} {elapsed:7.1f}')
+            if elapsed > args.budget_ms:
+                slow.append(f'{text!r} page {page}')
+
+    if slow:
+        print(f'FAIL: over the {args.budget_ms:.0f} ms budget: {", ".join(slow)}')
+        return 1
+    print(f'All searches within {args.budget_ms:.0f} ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
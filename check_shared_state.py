@@ -0,0 +1,172 @@
+"""
+Check that several app processes share job, event and image state
+
+    python check_shared_state.py --capture /tmp/ao3_captures/<file>.jsonl.gz [--instances 3] [--store URL]
+
+Starts the app in separate processes that answer AO3 requests from a
+capture file (record one with AO3_RECORD=1) and share one AO3_STATE_STORE,
+by default a SQLite file in a temporary directory; pass --store
+redis://host:6379/0 to check Redis instead. A scrape is started on the
+first instance and its stream dropped after the first progress event. The
+job is then resumed on the second instance from the last event ID, its
+status read and its events replayed on the last one, and each stat card is
+fetched from every instance and compared.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve(port, capture_path):
+    """Run one app instance whose AO3 requests are answered from the capture"""
+    from capture import ReplayTransport, load_capture
+    from transport import use_transport
+    import app
+
+    _, responses = load_capture(capture_path)
+    use_transport(ReplayTransport(responses))
+    app.app.run(host='127.0.0.1', port=port, threaded=True)
+
+
+def start_instances(count, capture_path, store_url):
+    """Start count app processes and return [(base URL, process)] once all answer /api/health"""
+    env = {**os.environ, 'AO3_STATE_STORE': store_url, 'LOG_LEVEL': 'WARNING', 'AO3_RECORD': '0'}
+    instances = []
+    for _ in range(count):
+        port = free_port()
+        process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--serve', str(port), '--capture', capture_path],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        instances.append((f'http://127.0.0.1:{port}', process))
+
+    deadline = time.monotonic() + 30
+    for base_url, process in instances:
+        while True:
+            try:
+                requests.get(f'{base_url}/api/health', timeout=1).raise_for_status()
+                break
+            except requests.RequestException:
+                if process.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f'instance at {base_url} did not start')
+                time.sleep(0.2)
+    return instances
+
+
+def read_events(response, stop_after=None):
+    """Parse an SSE response into [(id, event, data)], stopping after the named event"""
+    events = []
+    fields = {}
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            name, _, value = line.partition(': ')
+            fields[name] = value
+            continue
+        if 'event' in fields:
+            event_id = int(fields['id']) if 'id' in fields else None
+            events.append((event_id, fields['event'], json.loads(fields.get('data', 'null'))))
+            if fields['event'] in (stop_after, 'complete', 'error'):
+                break
+        fields = {}
+    response.close()
+    return events
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--capture', required=True, help='capture file recorded with AO3_RECORD=1')
+    parser.add_argument('--instances', type=int, default=3)
+    parser.add_argument('--store', help='AO3_STATE_STORE URL shared by the instances (default: a temporary SQLite file)')
+    parser.add_argument('--serve', type=int, metavar='PORT', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.capture)
+        return 0
+
+    from capture import load_capture
+
+    meta, _ = load_capture(args.capture)
+    username = meta.get('username', 'replay')
+    workdir = tempfile.mkdtemp(prefix='ao3_shared_state_')
+    store_url = args.store or f'sqlite:///{os.path.join(workdir, "state.db")}'
+    print(f'Starting {args.instances} instances sharing {store_url}')
+    instances = start_instances(max(args.instances, 2), args.capture, store_url)
+    urls = [base_url for base_url, _ in instances]
+    failures = []
+
+    def check(ok, message):
+        print(f'{"ok  " if ok else "FAIL"} {message}')
+        if not ok:
+            failures.append(message)
+
+    try:
+        # Start on the first instance and drop the connection mid-scrape
+        query = {'username': username, 'password': 'replay', 'incremental': '1', 'payload': 'compact', 'yearly': '1'}
+        started = time.perf_counter()
+        first = read_events(requests.get(f'{urls[0]}/api/scrape-stream', params=query, stream=True), 'progress')
+        job = next((data for _, event, data in first if event == 'job'), None)
+        check(job is not None, f'{urls[0]} announced the job before its first progress event')
+        if job is None:
+            return 1
+        last_id = first[-1][0]
+
+        # Pick it up on the second, from the last event received
+        resumed = read_events(requests.get(
+            f'{urls[1]}{job["events"]}', headers={'Last-Event-ID': str(last_id)}, stream=True
+        ))
+        ids = [event_id for event_id, _, _ in first + resumed]
+        check(ids == list(range(1, len(ids) + 1)), f'{urls[1]} resumed after event {last_id} with no gaps or repeats')
+        complete = next((data for _, event, data in resumed if event == 'complete'), None)
+        check(complete is not None, f'scrape completed in {time.perf_counter() - started:.1f}s, '
+                                    f'{complete["totalItems"] if complete else 0} items')
+
+        status = requests.get(f'{urls[-1]}/api/jobs/{job["jobId"]}').json().get('status')
+        check(status == 'complete', f'{urls[-1]} reports the job {status}')
+        replayed = read_events(requests.get(f'{urls[-1]}{job["events"]}', stream=True))
+        check([event for _, event, _ in replayed] == [event for _, event, _ in first + resumed],
+              f'{urls[-1]} replays all {len(replayed)} events')
+
+        # Every instance serves the same cards, whichever one rendered them
+        image_paths = dict((complete or {}).get('statistics', {}).get('imagePaths', {}))
+        for stat_year, year_statistics in (complete or {}).get('statistics', {}).get('years', {}).items():
+            image_paths.update({f'{stat_year}/{image_type}': path
+                                for image_type, path in year_statistics.get('imagePaths', {}).items()})
+        check(bool(image_paths), f'{len(image_paths)} stat cards to fetch')
+        for name, path in sorted(image_paths.items()):
+            bodies = []
+            for base_url in urls:
+                started = time.perf_counter()
+                response = requests.get(f'{base_url}{path}', headers={'Accept': 'image/png'})
+                bodies.append((response.status_code, response.content, (time.perf_counter() - started) * 1000))
+            check(all(status == 200 for status, _, _ in bodies) and len({body for _, body, _ in bodies}) == 1,
+                  f'{name}: identical on every instance (' +
+                  ', '.join(f'{status} {len(body)} B {ms:.0f} ms' for status, body, ms in bodies) + ')')
+    finally:
+        for _, process in instances:
+            process.terminate()
+        for _, process in instances:
+            process.wait()
+
+    print(f'{len(failures)} check(s) failed' if failures else 'All checks passed')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+"""
+Time the statistics aggregators on a long history against the old implementation
+
+    python check_statistics.py [--items 50000] [--years 10] [--runs 5] [--max-ratio 1.2]
+
+Builds a synthetic history of --items works over --years visit years,
+drawn from 5,000 tags, 2,000 ships and 500 fandoms. It times the old
+calculate_statistics (the dict loop app.py had before history_stats.py),
+including the old way to get per-year statistics: one year-filtered run
+per year on top of the all-time one. It then times the aggregators on the
+same history: calculate_statistics and calculate_yearly_statistics on
+the API's dicts and on HistoryItems, the page-by-page folding a scrape
+does (20 items per add_items), and the result() snapshot each progress
+event takes. Each timing is the best of --runs, with the old and new
+implementations taking turns. The check fails when the aggregators give
+different statistics from the old code, or when building all-time or
+per-year statistics takes longer than --max-ratio times the old
+implementation. On dicts, hashing every tag costs the same as it did in
+the old loop, so the default ratio leaves room for timing noise.
+"""
+import argparse
+import random
+import sys
+import time
+
+PAGE_SIZE = 20
+
+
+def legacy_calculate_statistics(history_items):
+    """calculate_statistics as app.py had it before StatisticsAggregator, for dict items"""
+    stats = {
+        'totalFics': len(history_items),
+        'totalWords': 0,
+        'topTags': [],
+        'topShips': [],
+        'topFandoms': [],
+        'longestFic': {
+            'title': '',
+            'wordCount': 0,
+            'author': '',
+            'url': ''
+        }
+    }
+
+    tag_counts = {}
+    ship_counts = {}
+    fandom_counts = {}
+
+    for item in history_items:
+        word_count = item.get('wordCount', 0)
+        stats['totalWords'] += word_count
+
+        if word_count > stats['longestFic']['wordCount']:
+            stats['longestFic'] = {
+                'title': item.get('title', ''),
+                'wordCount': word_count,
+                'author': item.get('author', ''),
+                'url': item.get('url', '')
+            }
+
+        for tag in item.get('tags', []):
+            tag_counts[tag] = tag_counts.get(tag, 0) + 1
+
+        for ship in item.get('relationships', []):
+            ship_counts[ship] = ship_counts.get(ship, 0) + 1
+
+        for fandom in item.get('fandoms', []):
+            fandom_counts[fandom] = fandom_counts.get(fandom, 0) + 1
+
+    stats['topTags'] = [
+        {'tag': tag, 'count': count}
+        for tag, count in sorted(tag_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    ]
+    stats['topShips'] = [
+        {'ship': ship, 'count': count}
+        for ship, count in sorted(ship_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    ]
+    stats['topFandoms'] = [
+        {'fandom': fandom, 'count': count}
+        for fandom, count in sorted(fandom_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    ]
+    return stats
+
+
+def legacy_yearly_statistics(works):
+    """Per-year statistics the old way: the all-time run plus one year-filtered run per year"""
+    statistics = legacy_calculate_statistics(works)
+    years = sorted({work['lastVisited'][:4] for work in works}, reverse=True)
+    statistics['years'] = {
+        year: legacy_calculate_statistics([work for work in works if work['lastVisited'].startswith(year)])
+        for year in years
+    }
+    return statistics
+
+
+def synthetic_history(count, years, seed=0):
+    """Return count work dicts with a wide tag vocabulary, visited over the last `years` years"""
+    from check_item_memory import synthetic_works
+
+    rng = random.Random(seed)
+    # Popular tags, ships and fandoms come up far more often than the long tail
+    tags = [f'Tag {i}' for i in range(5000)]
+    ships = [f'Character {i}/Character {i + 1}' for i in range(2000)]
+    fandoms = [f'Fandom {i}' for i in range(500)]
+    weights = [1 / (rank + 1) for rank in range(5000)]
+    works = []
+    for i, work in enumerate(synthetic_works(count, seed)):
+        work['tags'] = list(dict.fromkeys(rng.choices(tags, weights, k=rng.randint(2, 10))))
+        work['relationships'] = list(dict.fromkeys(rng.choices(ships, weights[:2000], k=rng.randint(0, 3))))
+        work['fandoms'] = list(dict.fromkeys(rng.choices(fandoms, weights[:500], k=rng.randint(1, 2))))
+        work['lastVisited'] = f'{2025 - i * years // count}{work["lastVisited"][4:]}'
+        works.append(work)
+    return works
+
+
+def best_ms(function, runs):
+    """Return (best milliseconds over runs, last result)"""
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def interleaved_best_ms(cases, runs):
+    """
+    Time (label, function) cases round-robin and return {label: (best milliseconds, last result)}
+
+    Each round runs every case once, so drift in machine speed hits the old
+    and new implementations alike.
+    """
+    timings = {}
+    for _ in range(runs):
+        for label, function in cases:
+            elapsed, result = best_ms(function, 1)
+            timings[label] = (min(elapsed, timings.get(label, (elapsed,))[0]), result)
+    return timings
+
+
+def fold_pages(aggregator, items):
+    """Fold items page by page, as the scraper's on_items callback does, and return the aggregator"""
+    for start in range(0, len(items), PAGE_SIZE):
+        aggregator.add_items(items[start:start + PAGE_SIZE])
+    return aggregator
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=50000)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-ratio', type=float, default=1.2,
+                        help='fail when the aggregators take more than this multiple of the old implementation')
+    args = parser.parse_args(argv)
+
+    from history_item import HistoryItem, StringInterner
+    from history_stats import (StatisticsAggregator, YearlyStatisticsAggregator, calculate_statistics,
+                               calculate_yearly_statistics)
+
+    works = synthetic_history(args.items, args.years)
+    interner = StringInterner()
+    items = [HistoryItem.from_dict(work, interner) for work in works]
+    pages = -(-len(items) // PAGE_SIZE)
+    print(f'{args.items} items over {args.years} years, {pages} pages of {PAGE_SIZE}')
+
+    old, old_yearly = 'old calculate_statistics', 'old per-year (all-time + one run per year)'
+    # (label, function, the old implementation it replaces)
+    cases = [
+        (old, lambda: legacy_calculate_statistics(works), None),
+        (old_yearly, lambda: legacy_yearly_statistics(works), None),
+        ('calculate_statistics, dicts', lambda: calculate_statistics(works), old),
+        ('calculate_statistics, HistoryItems', lambda: calculate_statistics(items), old),
+        ('StatisticsAggregator, page by page', lambda: fold_pages(StatisticsAggregator(), items).result(), old),
+        ('calculate_yearly_statistics, dicts', lambda: calculate_yearly_statistics(works), old_yearly),
+        ('calculate_yearly_statistics, HistoryItems', lambda: calculate_yearly_statistics(items), old_yearly),
+        ('YearlyStatisticsAggregator, page by page', lambda: fold_pages(YearlyStatisticsAggregator(), items).result(),
+         old_yearly)
+    ]
+    timings = interleaved_best_ms([(label, function) for label, function, _ in cases], args.runs)
+
+    aggregator = fold_pages(StatisticsAggregator(), items)
+    page_ms, _ = best_ms(lambda: aggregator.add_items(items[:PAGE_SIZE]), args.runs)
+    snapshot_ms, _ = best_ms(aggregator.result, args.runs)
+    yearly = fold_pages(YearlyStatisticsAggregator(), items)
+    yearly_snapshot_ms, _ = best_ms(yearly.result, args.runs)
+
+    failures = []
+    for label, _, baseline in cases:
+        elapsed, result = timings[label]
+        ratio = f'{elapsed / timings[baseline][0]:5.2f}x' if baseline else ''
+        print(f'  {label:44s} {elapsed:8.1f} ms {ratio}')
+        if not baseline:
+            continue
+        budget, expected = timings[baseline]
+        if result != expected:
+            failures.append(f'{label}: statistics differ from the old implementation')
+        if elapsed > budget * args.max_ratio:
+            failures.append(f'{label}: {elapsed:.1f} ms, over {args.max_ratio:g}x the old {budget:.1f} ms')
+    print(f'  {"add_items, one page":44s} {page_ms * 1000:8.0f} us')
+    print(f'  {"StatisticsAggregator.result()":44s} {snapshot_ms:8.2f} ms')
+    print(f'  {"YearlyStatisticsAggregator.result()":44s} {yearly_snapshot_ms:8.2f} ms')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
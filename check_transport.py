@@ -0,0 +1,331 @@
+"""
+Count the connections each HTTP transport opens and time its page requests
+
+    python check_transport.py [--scrapes 10] [--pages 8] [--page-ms 120] [--rtt-ms 40] [--plain]
+
+Serves check_scrape_throughput.py's synthetic history from a local HTTPS
+server (a self-signed certificate made with the openssl command; --plain,
+or no openssl, serves HTTP). The server speaks HTTP/1.1, and HTTP/2 as
+well when h2 is installed. Each page takes --page-ms of server time, and
+each new connection waits two round trips of --rtt-ms before its
+handshake, standing in for a distant AO3. Unpaced scrapes are sent to it
+through each transport: a new requests pool per scrape attempt (how the
+scraper worked before transport.py), the shared requests pool, and httpx
+over HTTP/1.1 and HTTP/2. They run --scrapes at a time and one after
+another. For each it prints the connections the transport counted (and
+the server accepted), the first request of a scrape, which pays for any
+new connection, and the median and p95 history page latency. It fails if
+a pooled transport opens more than one connection for scrapes run one
+after another, if HTTP/2 needs more than one for concurrent scrapes, or
+if any scrape returns different items from the first.
+"""
+import argparse
+import heapq
+import http.server
+import importlib.util
+import os
+import select
+import shutil
+import socket
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from transport import HttpxTransport, RequestsTransport, Transport
+
+AO3 = 'https://archiveofourown.org'
+
+
+def make_certificate(directory):
+    """Write a self-signed certificate for 127.0.0.1 and return (certfile, keyfile), or None without openssl"""
+    if not shutil.which('openssl'):
+        return None
+    certfile, keyfile = os.path.join(directory, 'cert.pem'), os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                    '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', keyfile, '-out', certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+class _PageHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP/1.1 keep-alive handler answering from the server's page handler"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        time.sleep(self.server.page_seconds)
+        status, body, headers = self.server.page(self.command, self.path)
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalAO3:
+    """
+    Local AO3 stand-in serving a FixtureTransport-style handler over the network
+
+    Every connection gets its own thread. TLS connections that negotiate h2
+    are served with the h2 package, one request stream per page, with the
+    page time overlapping across streams as it would on a real server.
+    """
+
+    def __init__(self, handler, page_seconds, connect_seconds, certificate=None):
+        self.handler = handler
+        self.page_seconds = page_seconds
+        self.connect_seconds = connect_seconds
+        self.connections = {'http/1.1': 0, 'h2': 0}
+        self._lock = threading.Lock()
+        self._context = None
+        if certificate:
+            self._context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            self._context.load_cert_chain(*certificate)
+            self._context.set_alpn_protocols(['h2', 'http/1.1'] if h2_available() else ['http/1.1'])
+        self._listener = socket.create_server(('127.0.0.1', 0))
+        scheme = 'https' if certificate else 'http'
+        self.base_url = f'{scheme}://127.0.0.1:{self._listener.getsockname()[1]}'
+        threading.Thread(target=self._accept, name='local-ao3', daemon=True).start()
+
+    def close(self):
+        self._listener.close()
+
+    def page(self, method, path):
+        """Return (status, body bytes, headers) for one request"""
+        status, body, headers = self.handler(method, AO3 + path)
+        return status, body.encode('utf-8') if isinstance(body, str) else body, headers
+
+    def _accept(self):
+        while True:
+            try:
+                sock, address = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(sock, address), daemon=True).start()
+
+    def _serve(self, sock, address):
+        # The TCP and TLS round trips to a distant server
+        time.sleep(self.connect_seconds)
+        try:
+            # Headers and body go out in separate writes; don't hold the body back for an ACK
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self._context:
+                sock = self._context.wrap_socket(sock, server_side=True)
+            protocol = 'h2' if self._context and sock.selected_alpn_protocol() == 'h2' else 'http/1.1'
+            with self._lock:
+                self.connections[protocol] += 1
+            if protocol == 'h2':
+                self._serve_h2(sock)
+            else:
+                _PageHandler(sock, address, self)
+        except OSError:
+            pass
+        finally:
+            sock.close()
+
+    def _serve_h2(self, sock):
+        import h2.config
+        import h2.connection
+        import h2.events
+
+        connection = h2.connection.H2Connection(h2.config.H2Configuration(client_side=False, header_encoding='utf-8'))
+        connection.initiate_connection()
+        sock.sendall(connection.data_to_send())
+        requests = {}
+        due = []
+        bodies = {}
+        while True:
+            # One thread reads and writes the TLS socket; pages are answered once their time is up
+            timeout = max(due[0][0] - time.monotonic(), 0) if due else None
+            if sock.pending() or select.select([sock], [], [], timeout)[0]:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                for event in connection.receive_data(data):
+                    if isinstance(event, h2.events.RequestReceived):
+                        requests[event.stream_id] = dict(event.headers)
+                    elif isinstance(event, h2.events.DataReceived):
+                        connection.acknowledge_received_data(event.flow_controlled_length, event.stream_id)
+                    elif isinstance(event, h2.events.StreamEnded):
+                        heapq.heappush(due, (time.monotonic() + self.page_seconds, event.stream_id))
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+            while due and due[0][0] <= time.monotonic():
+                _, stream_id = heapq.heappop(due)
+                headers = requests.pop(stream_id)
+                status, body, response_headers = self.page(headers[':method'], headers[':path'])
+                connection.send_headers(stream_id, [(':status', str(status)), ('content-length', str(len(body))),
+                                                    *((name.lower(), value) for name, value in response_headers.items())])
+                bodies[stream_id] = body
+            for stream_id in list(bodies):
+                self._send_h2_body(connection, bodies, stream_id)
+            sock.sendall(connection.data_to_send())
+
+    @staticmethod
+    def _send_h2_body(connection, bodies, stream_id):
+        """Send as much of a response body as flow control allows; keep the rest for a window update"""
+        body = bodies.pop(stream_id)
+        while True:
+            size = min(connection.local_flow_control_window(stream_id), connection.max_outbound_frame_size, len(body))
+            if body and size <= 0:
+                bodies[stream_id] = body
+                return
+            connection.send_data(stream_id, body[:size], end_stream=size == len(body))
+            body = body[size:]
+            if not body:
+                return
+
+
+def h2_available():
+    return importlib.util.find_spec('h2') is not None
+
+
+class LocalTransport(Transport):
+    """Sends another transport's requests to the local server and times each one"""
+
+    def __init__(self, inner, base_url):
+        super().__init__()
+        self.inner = inner
+        self.name = inner.name
+        self.base_url = base_url
+        self.first_requests = []
+        self.pages = []
+        self._lock = threading.Lock()
+
+    def new_session(self):
+        session = self.inner.new_session()
+        send = session.request
+        sent = []
+
+        def request(method, url, *args, **kwargs):
+            started = time.perf_counter()
+            response = send(method, url.replace(AO3, self.base_url, 1), *args, **kwargs)
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                if not sent:
+                    self.first_requests.append(elapsed)
+                elif '/readings' in url:
+                    self.pages.append(elapsed)
+            sent.append(url)
+            return response
+
+        session.request = request
+        return session
+
+    def reset_connections(self):
+        self.inner.reset_connections()
+
+    def stats(self):
+        return self.inner.stats()
+
+
+class PerAttemptTransport(Transport):
+    """The scraper before transport.py: every scrape attempt builds its own requests pool"""
+    name = 'requests'
+
+    def new_session(self):
+        import requests
+
+        pool = RequestsTransport()
+        pool._connection_opened = self._connection_opened
+        session = requests.Session()
+        session.mount('https://', pool._adapter)
+        session.mount('http://', pool._adapter)
+        return session
+
+
+def backends(server):
+    """(label, transport factory) for every backend to run"""
+    yield 'per-attempt pool', PerAttemptTransport
+    yield 'requests pool', RequestsTransport
+    yield 'httpx HTTP/1.1', lambda: HttpxTransport(http2=False)
+    if server.base_url.startswith('https') and h2_available():
+        yield 'httpx HTTP/2', lambda: HttpxTransport(http2=True)
+
+
+def run_backend(server, make_transport, count, concurrent):
+    """Run count scrapes through a new transport; return (LocalTransport, wall seconds, item dict lists)"""
+    from check_scrape_throughput import run_scrapes
+
+    transport = LocalTransport(make_transport(), server.base_url)
+    server.connections = dict.fromkeys(server.connections, 0)
+    if concurrent:
+        wall, results = run_scrapes(count, transport, 'benchmark', page_concurrency=1)
+    else:
+        wall, results = 0.0, []
+        for _ in range(count):
+            elapsed, (items,) = run_scrapes(1, transport, 'benchmark', page_concurrency=1)
+            wall += elapsed
+            results.append(items)
+    # Closes the idle keep-alive connections, and with them the server's threads
+    transport.reset_connections()
+    return transport, wall, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scrapes', type=int, default=10, help='scrapes per run')
+    parser.add_argument('--pages', type=int, default=8, help='history pages per scrape')
+    parser.add_argument('--page-ms', type=float, default=120.0, help='server time per request')
+    parser.add_argument('--rtt-ms', type=float, default=40.0, help='round trip; a new connection waits two')
+    parser.add_argument('--plain', action='store_true', help='serve HTTP instead of HTTPS (no HTTP/2)')
+    args = parser.parse_args(argv)
+
+    import logging
+    logging.disable(logging.INFO)
+    from check_scrape_throughput import synthetic_transport
+
+    certificate = None if args.plain else make_certificate(tempfile.mkdtemp(prefix='ao3_transport_'))
+    if certificate:
+        # Both backends trust the certificate through the environment
+        os.environ['REQUESTS_CA_BUNDLE'] = os.environ['SSL_CERT_FILE'] = certificate[0]
+    elif not args.plain:
+        print('openssl not found; serving HTTP, without HTTP/2')
+    server = LocalAO3(synthetic_transport('benchmark', args.pages, 20, 0).handler, args.page_ms / 1000,
+                      2 * args.rtt_ms / 1000, certificate)
+    print(f'{server.base_url}: {args.scrapes} scrapes of {args.pages} pages, {args.page_ms:.0f} ms per request, '
+          f'{2 * args.rtt_ms:.0f} ms per new connection')
+    print(f'{"":9s} {"transport":17s} {"opened":>6s} {"server":>11s} {"first ms":>8s} {"page ms":>8s} '
+          f'{"p95 ms":>7s} {"wall s":>7s}')
+
+    expected = None
+    failures = []
+    try:
+        for concurrent in (False, True):
+            mode = 'at once' if concurrent else 'in turn'
+            for label, make_transport in backends(server):
+                transport, wall, results = run_backend(server, make_transport, args.scrapes, concurrent)
+                opened = transport.stats()['connectionsOpened']
+                accepted = ' '.join(f'{count} {protocol}' for protocol, count in server.connections.items() if count)
+                print(f'{mode:9s} {label:17s} {opened:6d} {accepted:>11s} '
+                      f'{statistics.mean(transport.first_requests) * 1000:8.0f} {statistics.median(transport.pages) * 1000:8.0f} '
+                      f'{statistics.quantiles(transport.pages, n=20)[18] * 1000:7.0f} {wall:7.2f}')
+                expected = expected or results[0]
+                if any(result != expected for result in results):
+                    failures.append(f'{label} {mode}: items differ from the first scrape')
+                if label != 'per-attempt pool' and not concurrent and opened > 1:
+                    failures.append(f'{label} {mode}: {opened} connections for scrapes one after another')
+                if label == 'httpx HTTP/2' and opened > 1:
+                    failures.append(f'{label} {mode}: {opened} connections')
+    finally:
+        server.close()
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Time parse_visit_date per item against the strptime chain it replaced
+
+    python check_visit_dates.py [--items 20000] [--dates 400] [--runs 5]
+
+Draws --items "Last visited" strings from --dates distinct dates, as a
+history repeats the same days. Most are in AO3's usual 'd Mon YYYY' form,
+and the rest are in the fallback formats, impossible ('31 Feb 2024') or
+unparseable. Each string is parsed by the strptime chain the scraper used
+before parse_visit_date, by parse_visit_date's uncached fast path, and by
+parse_visit_date itself starting from an empty cache (as in a new
+process) and from a warm one. The best per-item time over --runs is
+printed for each. The check fails if any string parses differently from
+the old chain, or if a new path is slower per item than the old chain.
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime
+
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+FALLBACK_FORMATS = ['%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
+
+
+def legacy_parse_visit_date(date_text):
+    """The scraper's date parsing before parse_visit_date: every format through strptime"""
+    formats = ['%d %b %Y', '%d %B %Y', '%Y-%m-%d', '%b %d, %Y', '%B %d, %Y']
+    for fmt in formats:
+        try:
+            return datetime.strptime(date_text, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+def synthetic_dates(count, distinct, seed=0):
+    """count date strings drawn from `distinct` different ones, mostly in AO3's format"""
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(distinct):
+        day = datetime(rng.randint(2015, 2025), rng.randint(1, 12), rng.randint(1, 28))
+        roll = rng.random()
+        if roll < 0.9:
+            pool.append(f'{day.day:{rng.choice(["", "02"])}} {MONTH_NAMES[day.month - 1]} {day.year}')
+        elif roll < 0.97:
+            pool.append(day.strftime(rng.choice(FALLBACK_FORMATS)))
+        elif roll < 0.99:
+            pool.append(f'31 {rng.choice(["Feb", "Apr", "Jun", "Sep", "Nov"])} {day.year}')
+        else:
+            pool.append(f'visited {day.year}')
+    return [rng.choice(pool) for _ in range(count)]
+
+
+def best_us_per_item(parse, dates, runs, before=None):
+    """Best microseconds per date over runs; before() runs untimed ahead of each run"""
+    best = None
+    for _ in range(runs):
+        if before:
+            before()
+        started = time.perf_counter()
+        for date_text in dates:
+            parse(date_text)
+        elapsed = (time.perf_counter() - started) / len(dates) * 1e6
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--dates', type=int, default=400, help='distinct date strings among the items')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from ao3_scraper import parse_visit_date
+
+    dates = synthetic_dates(args.items, args.dates)
+    print(f'{len(dates)} dates, {len(set(dates))} distinct')
+
+    failures = []
+    mismatched = [text for text in set(dates) if parse_visit_date.__wrapped__(text) != legacy_parse_visit_date(text)]
+    if mismatched:
+        failures.append(f'{len(mismatched)} dates parse differently from the old chain, e.g. {mismatched[0]!r}')
+
+    old_us = best_us_per_item(legacy_parse_visit_date, dates, args.runs)
+    print(f'  {"strptime chain (old)":28s} {old_us:6.2f} us/item')
+    for label, parse, before in (('fast path, uncached', parse_visit_date.__wrapped__, None),
+                                 ('cached, from empty', parse_visit_date, parse_visit_date.cache_clear),
+                                 ('cached, warm', parse_visit_date, None)):
+        elapsed = best_us_per_item(parse, dates, args.runs, before)
+        print(f'  {label:28s} {elapsed:6.2f} us/item  ({old_us / elapsed:5.1f}x faster)')
+        if elapsed > old_us:
+            failures.append(f'{label}: {elapsed:.2f} us per item, slower than the old {old_us:.2f} us')
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
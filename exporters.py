@@ -0,0 +1,124 @@
+import csv
+import json
+import os
+import sqlite3
+
+# Columns shared by every export format, in output order
+EXPORT_FIELDS = [
+    'title', 'author', 'url', 'wordCount', 'tags', 'characters', 'relationships',
+    'warnings', 'categories', 'rating', 'fandoms', 'lastVisited', 'kudos', 'chapters', 'complete'
+]
+LIST_FIELDS = {'tags', 'characters', 'relationships', 'warnings', 'categories', 'fandoms'}
+
+
+class NDJSONExporter:
+    """Write one JSON object per line, optionally appending to an existing file"""
+
+    def __init__(self, path, append=False):
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8')
+
+    def write_items(self, items):
+        for item in items:
+            self._file.write(json.dumps(item.to_dict(), ensure_ascii=False))
+            self._file.write('\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CSVExporter:
+    """Write a CSV with a header row; list columns are JSON arrays"""
+
+    def __init__(self, path):
+        self._file = open(path, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(EXPORT_FIELDS)
+
+    def write_items(self, items):
+        for item in items:
+            data = item.to_dict()
+            self._writer.writerow([
+                json.dumps(data[field], ensure_ascii=False) if field in LIST_FIELDS else data[field]
+                for field in EXPORT_FIELDS
+            ])
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteExporter:
+    """Write an 'items' table, committing once per page; list columns are JSON arrays"""
+
+    def __init__(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            'CREATE TABLE items (title TEXT, author TEXT, url TEXT, wordCount INTEGER, tags TEXT, '
+            'characters TEXT, relationships TEXT, warnings TEXT, categories TEXT, rating TEXT, '
+            'fandoms TEXT, lastVisited TEXT, kudos INTEGER, chapters TEXT, complete INTEGER)'
+        )
+
+    def write_items(self, items):
+        rows = []
+        for item in items:
+            data = item.to_dict()
+            rows.append([
+                json.dumps(data[field], ensure_ascii=False) if field in LIST_FIELDS else data[field]
+                for field in EXPORT_FIELDS
+            ])
+        with self._connection:
+            self._connection.executemany(f'INSERT INTO items VALUES ({", ".join("?" * len(EXPORT_FIELDS))})', rows)
+
+    def close(self):
+        self._connection.close()
+
+
+class ParquetExporter:
+    """Write a Parquet file with one row group per page (requires pyarrow)"""
+
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception('Parquet export requires the pyarrow package (pip install pyarrow)')
+
+        self._pa = pa
+        self._schema = pa.schema([
+            (field, pa.list_(pa.string()) if field in LIST_FIELDS
+             else pa.int64() if field in ('wordCount', 'kudos')
+             else pa.bool_() if field == 'complete' else pa.string())
+            for field in EXPORT_FIELDS
+        ])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write_items(self, items):
+        if not items:
+            return
+        rows = [item.to_dict() for item in items]
+        columns = {field: [row[field] for row in rows] for field in EXPORT_FIELDS}
+        self._writer.write_table(self._pa.Table.from_pydict(columns, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+
+EXPORTERS = {
+    'ndjson': NDJSONExporter,
+    'csv': CSVExporter,
+    'sqlite': SQLiteExporter,
+    'parquet': ParquetExporter
+}
+
+_EXTENSIONS = {
+    '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv',
+    '.sqlite': 'sqlite', '.sqlite3': 'sqlite', '.db': 'sqlite', '.parquet': 'parquet'
+}
+
+
+def guess_export_format(path):
+    """Infer an export format from a file extension, defaulting to NDJSON"""
+    return _EXTENSIONS.get(os.path.splitext(path)[1].lower(), 'ndjson')
@@ -0,0 +1,299 @@
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import time
+
+from history_item import as_history_item
+
+# Opt-in: history is only stored when this points at a database file
+HISTORY_DB_PATH = os.environ.get('AO3_HISTORY_DB')
+
+SORT_COLUMNS = {
+    'lastVisited': 'last_visited',
+    'wordCount': 'word_count',
+    'title': 'title COLLATE NOCASE',
+    'author': 'author COLLATE NOCASE'
+}
+# Query parameter -> label kind stored in item_labels
+LABEL_FILTERS = {
+    'fandom': 'fandom',
+    'relationship': 'relationship',
+    'tag': 'tag',
+    'character': 'character'
+}
+MAX_PER_PAGE = 500
+# bm25 column weights for items_fts: owner, title, author, fandoms, relationships, characters, tags
+SEARCH_WEIGHTS = (0.0, 10.0, 4.0, 2.0, 3.0, 2.0, 1.0)
+# Columns the search terms are matched against (never the owner token)
+SEARCH_COLUMNS = 'title author fandoms relationships characters tags'
+# At most this many matches are scored with bm25, keeping broad queries on
+# big histories within the search budget. Past it, a query's first
+# SEARCH_RANK_LIMIT matches in stored order are ranked and the rest follow
+# them in stored order
+SEARCH_RANK_LIMIT = int(os.environ.get('AO3_SEARCH_RANK_LIMIT', 5000))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    user TEXT PRIMARY KEY,
+    token_hash TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    user TEXT NOT NULL,
+    url TEXT NOT NULL,
+    title TEXT NOT NULL,
+    author TEXT,
+    word_count INTEGER NOT NULL DEFAULT 0,
+    rating TEXT,
+    last_visited TEXT,
+    data TEXT NOT NULL,
+    UNIQUE (user, url)
+);
+CREATE INDEX IF NOT EXISTS items_user_visited ON items (user, last_visited);
+CREATE INDEX IF NOT EXISTS items_user_words ON items (user, word_count);
+CREATE TABLE IF NOT EXISTS item_labels (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    item_id INTEGER NOT NULL REFERENCES items (id) ON DELETE CASCADE,
+    PRIMARY KEY (kind, value, item_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS item_labels_item ON item_labels (item_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5 (
+    owner, title, author, fandoms, relationships, characters, tags,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+'''
+
+
+def history_db_enabled():
+    return bool(HISTORY_DB_PATH)
+
+
+def _normalize_user(username):
+    return username.strip().lower()
+
+
+def _hash_token(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def _owner_token(user):
+    # A single alphanumeric token, so one user's name can never tokenize into another's
+    return 'u' + hashlib.sha256(user.encode('utf-8')).hexdigest()[:20]
+
+
+def connect(path=None):
+    """Open the history database, creating the schema on first use"""
+    connection = sqlite3.connect(path or HISTORY_DB_PATH, timeout=30)
+    connection.row_factory = sqlite3.Row
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    # A full-history save touches the label and search indexes at random;
+    # a bigger page cache keeps that from spilling to the WAL mid-transaction
+    connection.execute('PRAGMA cache_size=-65536')
+    connection.execute('PRAGMA foreign_keys=ON')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def save_history(username, items, path=None):
+    """
+    Upsert scraped items for a user and return the token that grants access to them
+
+    Items are keyed by (user, url), so a single-year scrape only refreshes
+    that year's works and leaves the rest of the stored history alone.
+    """
+    user = _normalize_user(username)
+    token = secrets.token_urlsafe(24)
+    connection = connect(path)
+    try:
+        with connection:
+            connection.execute(
+                'INSERT INTO users (user, token_hash, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT (user) DO UPDATE SET token_hash = excluded.token_hash, updated_at = excluded.updated_at',
+                (user, _hash_token(token), time.time())
+            )
+            # Last occurrence wins if a work shows up twice in one scrape
+            items = list({item.url: item for item in map(as_history_item, items)}.values())
+            connection.executemany(
+                'INSERT INTO items (user, url, title, author, word_count, rating, last_visited, data) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (user, url) DO UPDATE SET title = excluded.title, author = excluded.author, '
+                'word_count = excluded.word_count, rating = excluded.rating, '
+                'last_visited = excluded.last_visited, data = excluded.data',
+                [
+                    (user, item.url, item.title, item.author, item.word_count, item.rating,
+                     item.last_visited, json.dumps(item.to_dict(), ensure_ascii=False))
+                    for item in items
+                ]
+            )
+
+            item_ids = dict(connection.execute('SELECT url, id FROM items WHERE user = ?', (user,)).fetchall())
+            saved_ids = [(item_ids[item.url],) for item in items]
+            connection.executemany('DELETE FROM item_labels WHERE item_id = ?', saved_ids)
+            connection.executemany(
+                'INSERT OR IGNORE INTO item_labels (kind, value, item_id) VALUES (?, ?, ?)',
+                (
+                    (kind, value, item_ids[item.url])
+                    for item in items
+                    for kind, values in (
+                        ('fandom', item.fandoms), ('relationship', item.relationships),
+                        ('tag', item.tags), ('character', item.characters)
+                    )
+                    for value in values
+                )
+            )
+
+            # Search rows share the item's id as their rowid
+            connection.executemany('DELETE FROM items_fts WHERE rowid = ?', saved_ids)
+            connection.executemany(
+                'INSERT INTO items_fts (rowid, owner, title, author, fandoms, relationships, characters, tags) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (
+                    (item_ids[item.url], _owner_token(user), item.title, item.author, '\n'.join(item.fandoms),
+                     '\n'.join(item.relationships), '\n'.join(item.characters), '\n'.join(item.tags))
+                    for item in items
+                )
+            )
+    finally:
+        connection.close()
+    return token
+
+
+def authorize(username, token, path=None):
+    """True when token is the current access token for username's stored history"""
+    if not username or not token:
+        return False
+    connection = connect(path)
+    try:
+        row = connection.execute(
+            'SELECT token_hash FROM users WHERE user = ?', (_normalize_user(username),)
+        ).fetchone()
+    finally:
+        connection.close()
+    return row is not None and secrets.compare_digest(row['token_hash'], _hash_token(token))
+
+
+def query_history(username, filters=None, sort='lastVisited', order='desc', page=1, per_page=50, path=None):
+    """
+    Filter, sort and paginate a user's stored items
+
+    filters may contain year, fandom, relationship, tag, character,
+    minWords and maxWords. Returns {'items', 'total', 'page', 'perPage'}.
+    """
+    filters = filters or {}
+    clauses = ['user = ?']
+    params = [_normalize_user(username)]
+
+    year = filters.get('year')
+    if year:
+        clauses.append('last_visited >= ? AND last_visited < ?')
+        params += [f'{int(year):04d}-01-01', f'{int(year) + 1:04d}-01-01']
+
+    for name, kind in LABEL_FILTERS.items():
+        value = filters.get(name)
+        if value:
+            clauses.append('id IN (SELECT item_id FROM item_labels WHERE kind = ? AND value = ?)')
+            params += [kind, value]
+
+    if filters.get('minWords') is not None:
+        clauses.append('word_count >= ?')
+        params.append(int(filters['minWords']))
+    if filters.get('maxWords') is not None:
+        clauses.append('word_count <= ?')
+        params.append(int(filters['maxWords']))
+
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f'Invalid sort: {sort}')
+    direction = 'ASC' if order == 'asc' else 'DESC'
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), MAX_PER_PAGE)
+    where = ' AND '.join(clauses)
+
+    connection = connect(path)
+    try:
+        total = connection.execute(f'SELECT COUNT(*) FROM items WHERE {where}', params).fetchone()[0]
+        rows = connection.execute(
+            f'SELECT data FROM items WHERE {where} ORDER BY {SORT_COLUMNS[sort]} {direction}, id LIMIT ? OFFSET ?',
+            params + [per_page, (page - 1) * per_page]
+        ).fetchall()
+    finally:
+        connection.close()
+
+    return {
+        'items': [json.loads(row['data']) for row in rows],
+        'total': total,
+        'page': page,
+        'perPage': per_page
+    }
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query that matches every word
+
+    Words are quoted so punctuation can't be parsed as FTS5 syntax. The last
+    word is a prefix match (when it is long enough to be selective) so
+    partially typed queries still find results.
+    """
+    words = text.replace('"', ' ').split()
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= 3:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def search_history(username, text, page=1, per_page=50, path=None):
+    """
+    Rank a user's stored items against a free-text query
+
+    Title matches weigh most, then author, relationships, fandoms,
+    characters and tags. Returns {'items', 'total', 'page', 'perPage',
+    'ranked'}; ranked is False when there were more than SEARCH_RANK_LIMIT
+    matches, so only the first SEARCH_RANK_LIMIT of them were ranked.
+    """
+    terms = build_match_query(text or '')
+    if not terms:
+        raise ValueError('Search query is empty')
+    page = max(int(page), 1)
+    per_page = min(max(int(per_page), 1), MAX_PER_PAGE)
+    # Restricting to the owner inside the MATCH lets FTS5 answer without touching items
+    match = f'owner : {_owner_token(_normalize_user(username))} AND {{{SEARCH_COLUMNS}}} : ({terms})'
+    weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+
+    connection = connect(path)
+    try:
+        total = connection.execute('SELECT COUNT(*) FROM items_fts WHERE items_fts MATCH ?', (match,)).fetchone()[0]
+        offset = (page - 1) * per_page
+        ranked_count = min(total, SEARCH_RANK_LIMIT)
+        item_ids = []
+        if offset < ranked_count:
+            # Only the candidate window is scored (about 2 µs per match)
+            item_ids += [row[0] for row in connection.execute(
+                f'SELECT rowid FROM (SELECT rowid, bm25(items_fts, {weights}) AS score FROM items_fts '
+                'WHERE items_fts MATCH ? ORDER BY rowid LIMIT ?) ORDER BY score, rowid LIMIT ? OFFSET ?',
+                (match, ranked_count, min(per_page, ranked_count - offset), offset)
+            )]
+        if len(item_ids) < per_page and total > ranked_count:
+            item_ids += [row[0] for row in connection.execute(
+                'SELECT rowid FROM items_fts WHERE items_fts MATCH ? ORDER BY rowid LIMIT ? OFFSET ?',
+                (match, per_page - len(item_ids), max(offset, ranked_count))
+            )]
+        data = dict(connection.execute(
+            f'SELECT id, data FROM items WHERE id IN ({", ".join("?" * len(item_ids))})', item_ids
+        ).fetchall()) if item_ids else {}
+    finally:
+        connection.close()
+
+    return {
+        'items': [json.loads(data[item_id]) for item_id in item_ids],
+        'total': total,
+        'page': page,
+        'perPage': per_page,
+        'ranked': total <= SEARCH_RANK_LIMIT
+    }
@@ -0,0 +1,102 @@
+from dataclasses import dataclass
+
+
+class StringInterner:
+    """Per-scrape table that hands back one shared copy of each repeated string"""
+
+    def __init__(self):
+        self._strings = {}
+
+    def __len__(self):
+        return len(self._strings)
+
+    def intern(self, value):
+        """Return the canonical copy of value (None passes through)"""
+        if value is None:
+            return None
+        return self._strings.setdefault(value, value)
+
+    def intern_all(self, values):
+        """Intern every string in values and return them as a tuple"""
+        strings = self._strings
+        return tuple([strings.setdefault(value, value) for value in values])
+
+
+@dataclass(slots=True)
+class HistoryItem:
+    """Compact representation of one work in a user's reading history"""
+    title: str
+    author: str
+    url: str
+    word_count: int
+    tags: tuple
+    characters: tuple
+    relationships: tuple
+    warnings: tuple
+    categories: tuple
+    rating: str
+    fandoms: tuple
+    last_visited: str = None
+    kudos: int = None
+    chapters: str = None
+    complete: bool = None
+
+    @property
+    def visited_year(self):
+        """Year of the last visit, or None when the date is unknown"""
+        return int(self.last_visited[:4]) if self.last_visited else None
+
+    def to_dict(self):
+        """Convert to the dict schema returned by the API"""
+        return {
+            'title': self.title,
+            'author': self.author,
+            'url': self.url,
+            'wordCount': self.word_count,
+            'tags': list(self.tags),
+            'characters': list(self.characters),
+            'relationships': list(self.relationships),
+            'warnings': list(self.warnings),
+            'categories': list(self.categories),
+            'rating': self.rating,
+            'fandoms': list(self.fandoms),
+            'lastVisited': self.last_visited,
+            'kudos': self.kudos,
+            'chapters': self.chapters,
+            'complete': self.complete
+        }
+
+    @classmethod
+    def from_dict(cls, data, interner=None):
+        """Build an item from the API dict schema, optionally interning its strings"""
+        if interner is None:
+            interner = StringInterner()
+        return cls(
+            title=data.get('title', ''),
+            author=interner.intern(data.get('author', '')),
+            url=data.get('url', ''),
+            word_count=data.get('wordCount', 0),
+            tags=interner.intern_all(data.get('tags', [])),
+            characters=interner.intern_all(data.get('characters', [])),
+            relationships=interner.intern_all(data.get('relationships', [])),
+            warnings=interner.intern_all(data.get('warnings', [])),
+            categories=interner.intern_all(data.get('categories', [])),
+            rating=interner.intern(data.get('rating', 'Not Rated')),
+            fandoms=interner.intern_all(data.get('fandoms', [])),
+            last_visited=interner.intern(data.get('lastVisited')),
+            kudos=data.get('kudos'),
+            chapters=interner.intern(data.get('chapters')),
+            complete=data.get('complete')
+        )
+
+
+def as_history_item(item, interner=None):
+    """Accept either a HistoryItem or an API dict and return a HistoryItem"""
+    if isinstance(item, HistoryItem):
+        return item
+    return HistoryItem.from_dict(item, interner)
+
+
+def items_to_dicts(items):
+    """Convert a list of HistoryItems to the API dict schema"""
+    return [item.to_dict() for item in items]
@@ -0,0 +1,170 @@
+from collections import Counter, defaultdict
+from itertools import chain
+import heapq
+from operator import attrgetter
+
+from history_item import as_history_item
+
+
+def _batch(items):
+    """
+    Return (items as a list, whether they are API dicts)
+
+    Dicts are read as they are, which is much cheaper than building
+    HistoryItems from them. Only a batch mixing the two is converted.
+    """
+    items = list(items)
+    dicts = sum(isinstance(item, dict) for item in items)
+    if 0 < dicts < len(items):
+        return [as_history_item(item) for item in items], False
+    return items, dicts > 0
+
+
+def _column(items, dicts, attribute, key, default):
+    """One field of every item in a batch from _batch"""
+    if dicts:
+        return [item.get(key, default) for item in items]
+    return list(map(attrgetter(attribute), items))
+
+
+def _field(item, attribute, key, default):
+    """One field of a single HistoryItem or API dict"""
+    return item.get(key, default) if isinstance(item, dict) else getattr(item, attribute)
+
+
+def _visited_year(item):
+    if isinstance(item, dict):
+        last_visited = item.get('lastVisited')
+        return int(last_visited[:4]) if last_visited else None
+    return item.visited_year
+
+
+class StatisticsAggregator:
+    """Incrementally build reading statistics as history pages arrive"""
+
+    def __init__(self, top_k=10, year=None):
+        """
+        Args:
+            top_k: How many entries to keep in each top list
+            year: Optional year; items last visited in other years are ignored
+        """
+        self.top_k = top_k
+        self.year = int(year) if year else None
+        self.reset()
+
+    def reset(self):
+        """Drop everything seen so far (e.g. when a scrape restarts from page 1)"""
+        self.total_fics = 0
+        self.total_words = 0
+        self.longest_fic = {
+            'title': '',
+            'wordCount': 0,
+            'author': '',
+            'url': ''
+        }
+        self.tag_counts = Counter()
+        self.ship_counts = Counter()
+        self.fandom_counts = Counter()
+
+    def _include(self, item):
+        return self.year is None or _visited_year(item) == self.year
+
+    def add(self, item):
+        """Fold a single history item into the running totals"""
+        self.add_items((item,))
+
+    def add_items(self, items):
+        """Fold a batch of history items (usually one page) into the running totals"""
+        items, dicts = _batch(items)
+        if self.year is not None:
+            items = [item for item in items if self._include(item)]
+
+        word_counts = _column(items, dicts, 'word_count', 'wordCount', 0)
+        self.total_fics += len(items)
+        self.total_words += sum(word_counts)
+
+        # Track longest fic; of equally long fics, the first one seen
+        longest_words = max(word_counts, default=0)
+        if longest_words > self.longest_fic['wordCount']:
+            longest = items[word_counts.index(longest_words)]
+            self.longest_fic = {
+                'title': _field(longest, 'title', 'title', ''),
+                'wordCount': longest_words,
+                'author': _field(longest, 'author', 'author', ''),
+                'url': _field(longest, 'url', 'url', '')
+            }
+
+        # One Counter.update per field keeps the counting loop in C
+        self.tag_counts.update(chain.from_iterable(_column(items, dicts, 'tags', 'tags', ())))
+        self.ship_counts.update(chain.from_iterable(_column(items, dicts, 'relationships', 'relationships', ())))
+        self.fandom_counts.update(chain.from_iterable(_column(items, dicts, 'fandoms', 'fandoms', ())))
+
+    def _top(self, counts, label):
+        # nlargest is stable like sorted(..., reverse=True), so ties keep first-seen order
+        return [
+            {label: name, 'count': count}
+            for name, count in heapq.nlargest(self.top_k, counts.items(), key=lambda x: x[1])
+        ]
+
+    def result(self):
+        """Return the statistics in the schema served by the API"""
+        return {
+            'totalFics': self.total_fics,
+            'totalWords': self.total_words,
+            'topTags': self._top(self.tag_counts, 'tag'),
+            'topShips': self._top(self.ship_counts, 'ship'),
+            'topFandoms': self._top(self.fandom_counts, 'fandom'),
+            'longestFic': dict(self.longest_fic)
+        }
+
+
+class YearlyStatisticsAggregator:
+    """Build all-time statistics plus one set per lastVisited year from a single pass"""
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self.reset()
+
+    def reset(self):
+        """Drop everything seen so far (e.g. when a scrape restarts from page 1)"""
+        self.all_time = StatisticsAggregator(self.top_k)
+        self.years = {}
+
+    def add_items(self, items):
+        """Fold a batch of history items into the all-time totals and their year's totals"""
+        items, _ = _batch(items)
+        self.all_time.add_items(items)
+
+        by_year = defaultdict(list)
+        for item in items:
+            # Items without a visit date only count toward all-time
+            year = _visited_year(item)
+            if year is not None:
+                by_year[year].append(item)
+        for year, year_items in by_year.items():
+            if year not in self.years:
+                self.years[year] = StatisticsAggregator(self.top_k)
+            self.years[year].add_items(year_items)
+
+    def result(self):
+        """Return all-time statistics with a 'years' map of per-year statistics, newest first"""
+        statistics = self.all_time.result()
+        statistics['years'] = {
+            str(year): self.years[year].result()
+            for year in sorted(self.years, reverse=True)
+        }
+        return statistics
+
+
+def calculate_statistics(history_items):
+    """Calculate reading statistics for a complete list of history items (HistoryItems or dicts)"""
+    aggregator = StatisticsAggregator()
+    aggregator.add_items(history_items)
+    return aggregator.result()
+
+
+def calculate_yearly_statistics(history_items):
+    """Calculate all-time and per-year statistics for a complete list of history items"""
+    aggregator = YearlyStatisticsAggregator()
+    aggregator.add_items(history_items)
+    return aggregator.result()
@@ -1,5 +1,38 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, features
+from collections import OrderedDict
+import hashlib
+import io
+import json
+import logging
 import os
+import threading
+import time
+
+# Output sizes served by /api/stats-image; full is the native render size
+IMAGE_SIZES = {
+    'full': (1080, 1920),
+    'preview': (540, 960),
+    'thumb': (270, 480)
+}
+
+IMAGE_MIMETYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'png': 'image/png'
+}
+
+# Card sets kept for versioned URLs, least recently used dropped first
+CARD_SET_CACHE_SIZE = int(os.environ.get('AO3_CARD_SET_CACHE_SIZE', 64))
+
+# Card sets keyed by content version: the statistics they are drawn from, the
+# year they are labelled with, full-size renders (only for the newest main
+# cards) and encoded variants keyed by (type, format, size)
+_card_sets = OrderedDict()
+# Version of the newest render per year (None for the main cards), for unversioned URLs
+_current_versions = {}
+_store_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
 
 def create_gradient(width, height, color1, color2):
     """Create a subtle vertical gradient from color1 to color2"""
@@ -38,6 +71,10 @@ def draw_text_centered(draw, y, text, font, fill_color, width):
     x = (width - text_width) // 2
     draw.text((x, y), text, font=font, fill=fill_color)
 
+def card_subtitle(text, year=None):
+    """Suffix a card subtitle with the year it covers, if any"""
+    return f"{text} in {year}" if year else text
+
 def wrap_text(text, font, max_width, draw):
     """Wrap text to fit within max_width"""
     words = text.split()
@@ -59,7 +96,7 @@ def wrap_text(text, font, max_width, draw):
 
     return lines
 
-def create_top_ships_image(ships, output_path):
+def create_top_ships_image(ships, year=None):
     """Create an image showing top 5 ships"""
     width, height = 1080, 1920
 
@@ -76,7 +113,7 @@ def create_top_ships_image(ships, output_path):
 
     # Subtitle
     subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Most Read Relationships", subtitle_font, (255, 220, 220), width)
+    draw_text_centered(draw, 190, card_subtitle("Your Most Read Relationships", year), subtitle_font, (255, 220, 220), width)
 
     # Draw ships
     y_offset = 400
@@ -128,10 +165,9 @@ def create_top_ships_image(ships, output_path):
 
         y_offset += 250
 
-    img.save(output_path, 'PNG')
-    return output_path
+    return img
 
-def create_top_tags_image(tags, output_path):
+def create_top_tags_image(tags, year=None):
     """Create an image showing top 5 tags"""
     width, height = 1080, 1920
 
@@ -148,7 +184,7 @@ def create_top_tags_image(tags, output_path):
 
     # Subtitle
     subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Favorite Themes", subtitle_font, (255, 220, 220), width)
+    draw_text_centered(draw, 190, card_subtitle("Your Favorite Themes", year), subtitle_font, (255, 220, 220), width)
 
     # Draw tags
     y_offset = 400
@@ -200,10 +236,9 @@ def create_top_tags_image(tags, output_path):
 
         y_offset += 250
 
-    img.save(output_path, 'PNG')
-    return output_path
+    return img
 
-def create_top_fandoms_image(fandoms, output_path):
+def create_top_fandoms_image(fandoms, year=None):
     """Create an image showing top 5 fandoms"""
     width, height = 1080, 1920
 
@@ -220,7 +255,7 @@ def create_top_fandoms_image(fandoms, output_path):
 
     # Subtitle
     subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your Favorite Universes", subtitle_font, (255, 220, 220), width)
+    draw_text_centered(draw, 190, card_subtitle("Your Favorite Universes", year), subtitle_font, (255, 220, 220), width)
 
     # Draw fandoms
     y_offset = 400
@@ -272,10 +307,9 @@ def create_top_fandoms_image(fandoms, output_path):
 
         y_offset += 250
 
-    img.save(output_path, 'PNG')
-    return output_path
+    return img
 
-def create_overall_stats_image(stats, output_path):
+def create_overall_stats_image(stats, year=None):
     """Create an image showing overall reading stats"""
     width, height = 1080, 1920
 
@@ -292,7 +326,7 @@ def create_overall_stats_image(stats, output_path):
 
     # Subtitle
     subtitle_font = get_font(42)
-    draw_text_centered(draw, 190, "Your AO3 Journey", subtitle_font, (255, 220, 220), width)
+    draw_text_centered(draw, 190, card_subtitle("Your AO3 Journey", year), subtitle_font, (255, 220, 220), width)
 
     # Stats section
     y_offset = 450
@@ -337,38 +371,161 @@ def create_overall_stats_image(stats, output_path):
             draw_text_centered(draw, title_y, line, title_font_small, (90, 0, 8), width)
             title_y += 45
 
-    img.save(output_path, 'PNG')
-    return output_path
-
-def generate_all_stat_images(statistics):
-    """Generate all stat images and return their paths"""
-    output_dir = '/tmp/ao3_stats'
-    os.makedirs(output_dir, exist_ok=True)
-
-    image_paths = {}
-
-    # Generate each image
-    if statistics['topShips']:
-        image_paths['ships'] = create_top_ships_image(
-            statistics['topShips'],
-            os.path.join(output_dir, 'top_ships.png')
-        )
-
-    if statistics['topTags']:
-        image_paths['tags'] = create_top_tags_image(
-            statistics['topTags'],
-            os.path.join(output_dir, 'top_tags.png')
-        )
-
-    if statistics['topFandoms']:
-        image_paths['fandoms'] = create_top_fandoms_image(
-            statistics['topFandoms'],
-            os.path.join(output_dir, 'top_fandoms.png')
-        )
-
-    image_paths['overall'] = create_overall_stats_image(
-        statistics,
-        os.path.join(output_dir, 'overall_stats.png')
-    )
-
-    return image_paths
+    return img
+
+def supported_image_formats():
+    """Return the output formats this Pillow build can encode, best first"""
+    formats = []
+    for fmt in ('avif', 'webp'):
+        try:
+            if features.check_module(fmt):
+                formats.append(fmt)
+        except ValueError:
+            # Older Pillow releases don't know about the module at all
+            logger.debug('Pillow has no %s support', fmt)
+    formats.append('png')
+    return formats
+
+def encode_image(img, fmt='png', size='full'):
+    """Encode a rendered card into an in-memory buffer and return its bytes"""
+    if size != 'full':
+        img = img.resize(IMAGE_SIZES[size], Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    if fmt == 'avif':
+        img.save(buffer, 'AVIF', quality=60, speed=8)
+    elif fmt == 'webp':
+        img.save(buffer, 'WEBP', quality=85, method=4)
+    else:
+        img.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+# Card type -> (statistics key it needs, or None if always drawn, renderer)
+CARD_RENDERERS = {
+    'ships': ('topShips', create_top_ships_image),
+    'tags': ('topTags', create_top_tags_image),
+    'fandoms': ('topFandoms', create_top_fandoms_image),
+    'overall': (None, create_overall_stats_image)
+}
+
+def stat_image_types(statistics):
+    """Return the card types that have something to show for these statistics"""
+    return [
+        image_type for image_type, (key, renderer) in CARD_RENDERERS.items()
+        if key is None or statistics[key]
+    ]
+
+def render_stat_image(image_type, statistics, year=None):
+    """Draw a single card for the given statistics"""
+    key, renderer = CARD_RENDERERS[image_type]
+    return renderer(statistics if key is None else statistics[key], year)
+
+def statistics_version(statistics, year=None):
+    """Short hash of everything a set of cards is drawn from"""
+    drawn = {key: value for key, value in statistics.items() if key not in ('years', 'imagePaths')}
+    payload = json.dumps([year, drawn], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+def stat_image_version(year=None):
+    """Return the content version of the newest cards for a year (None for the main cards)"""
+    with _store_lock:
+        return _current_versions.get(year)
+
+def card_set_versions(statistics, year=None):
+    """Map year (None for the main cards) -> version for every card set these statistics produce"""
+    versions = {
+        int(stat_year): statistics_version(year_statistics, int(stat_year))
+        for stat_year, year_statistics in statistics.get('years', {}).items()
+    }
+    versions[None] = statistics_version(statistics, year)
+    return versions
+
+def has_card_sets(statistics, year=None):
+    """Whether every card set for these statistics is still held"""
+    versions = card_set_versions(statistics, year).values()
+    with _store_lock:
+        return all(version in _card_sets for version in versions)
+
+def get_stat_image(image_type, fmt='png', size='full', year=None, version=None):
+    """
+    Return encoded bytes for a card, or None if its set isn't held
+
+    version names a card set, as in a versioned URL; without it the newest
+    cards for year are used. Cards without a full-size render are drawn on
+    first request, and only their encodings are kept, so a long history
+    doesn't hold a bitmap for every card of every year.
+    """
+    key = (image_type, fmt, size)
+    with _store_lock:
+        if version is None:
+            version = _current_versions.get(year)
+        card_set = _card_sets.get(version)
+        if card_set is None:
+            return None
+        _card_sets.move_to_end(version)
+        encoded = card_set['encoded'].get(key)
+        source = card_set['rendered'].get(image_type)
+    if encoded is not None:
+        return encoded
+
+    started = time.perf_counter()
+    if source is None:
+        if image_type not in stat_image_types(card_set['statistics']):
+            return None
+        source = render_stat_image(image_type, card_set['statistics'], card_set['year'])
+    encoded = encode_image(source, fmt, size)
+    logger.debug('Encoded %s card %s as %s/%s: %d bytes in %.0f ms', image_type, version,
+                 fmt, size, len(encoded), (time.perf_counter() - started) * 1000)
+    with _store_lock:
+        card_set['encoded'][key] = encoded
+    return encoded
+
+def generate_all_stat_images(statistics, year=None):
+    """
+    Render all stat images into memory and return the rendered image types
+
+    year labels the cards when the statistics cover a single year. If the
+    statistics carry a 'years' map, each year's cards become available
+    through get_stat_image(..., year=...) without being drawn up front.
+    Earlier card sets stay available by version until CARD_SET_CACHE_SIZE
+    newer ones push them out.
+    """
+    started = time.perf_counter()
+    images = {
+        image_type: render_stat_image(image_type, statistics, year)
+        for image_type in stat_image_types(statistics)
+    }
+    logger.debug('Rendered %d cards in %.0f ms', len(images), (time.perf_counter() - started) * 1000)
+
+    versions = card_set_versions(statistics, year)
+    card_statistics = {stat_year: year_statistics for stat_year, year_statistics in statistics.get('years', {}).items()}
+    with _store_lock:
+        # Only the newest main cards keep their full-size bitmaps
+        for card_set in _card_sets.values():
+            card_set['rendered'] = {}
+        for card_year, version in versions.items():
+            drawn = statistics if card_year is None else card_statistics[str(card_year)]
+            card_set = _card_sets.get(version) or {
+                'statistics': {key: value for key, value in drawn.items() if key not in ('years', 'imagePaths')},
+                'year': year if card_year is None else card_year,
+                'rendered': {},
+                'encoded': {}
+            }
+            if card_year is None:
+                card_set['rendered'] = images
+            _card_sets[version] = card_set
+            _card_sets.move_to_end(version)
+        _current_versions.clear()
+        _current_versions.update(versions)
+
+        current = set(versions.values())
+        for version in [version for version in _card_sets if version not in current]:
+            if len(_card_sets) <= CARD_SET_CACHE_SIZE:
+                break
+            del _card_sets[version]
+
+    # Encode the default PNGs up front so the first request is served from memory
+    for image_type in images:
+        get_stat_image(image_type, version=versions[None])
+
+    return list(images)
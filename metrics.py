@@ -0,0 +1,170 @@
+import os
+import sys
+import threading
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+_registry = []
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    body = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return '{' + body + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        if not self.labelnames and self.kind != 'histogram':
+            self._values[()] = 0
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self):
+        """Yield (suffix, label values, extra label, value) tuples for exposition"""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield '', key, None, value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {value}')
+        return '\n'.join(lines)
+
+
+class CounterMetric(_Metric):
+    """Monotonically increasing count"""
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class GaugeMetric(_Metric):
+    """Value that can go up and down, optionally computed at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self._function = function
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self):
+        if self._function is not None:
+            yield '', (), None, self._function()
+            return
+        yield from super().samples()
+
+
+class HistogramMetric(_Metric):
+    """Distribution of observed values in cumulative buckets"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state['buckets'][i] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def samples(self):
+        with self._lock:
+            values = {key: {**state, 'buckets': list(state['buckets'])} for key, state in self._values.items()}
+        for key, state in sorted(values.items()):
+            for bound, count in zip(self.buckets, state['buckets']):
+                yield '_bucket', key, ('le', bound), count
+            yield '_bucket', key, ('le', '+Inf'), state['count']
+            yield '_sum', key, None, round(state['sum'], 6)
+            yield '_count', key, None, state['count']
+
+
+def _resident_memory_bytes():
+    """Current RSS from /proc where available, otherwise peak RSS"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is bytes on macOS and kilobytes elsewhere
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def render_metrics():
+    """Render every registered metric in the Prometheus text exposition format"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+ACTIVE_SCRAPES = GaugeMetric('ao3_active_scrapes', 'Scrapes currently running')
+QUEUED_SCRAPES = GaugeMetric('ao3_queued_scrapes', 'Scrapes with a request waiting for the shared AO3 request budget')
+HTTP_RESPONSES = CounterMetric(
+    'ao3_http_responses_total', 'Responses received from AO3 by request kind and status', ('kind', 'status')
+)
+RETRIES = CounterMetric('ao3_retries_total', 'Retried page fetches and whole-scrape attempts', ('scope',))
+PHASE_SECONDS = HistogramMetric(
+    'ao3_phase_seconds', 'Latency of scrape phases (login, fetch, parse, extract, sleep, stats, render)', ('phase',)
+)
+SLEEP_SECONDS = CounterMetric('ao3_sleep_seconds_total', 'Total time spent sleeping in delay()')
+SSE_CONNECTIONS = GaugeMetric('ao3_sse_connections', 'Open /api/scrape-stream connections')
+MEMORY_BYTES = GaugeMetric('ao3_resident_memory_bytes', 'Resident memory of this process', function=_resident_memory_bytes)
+WORK_CACHE_LOOKUPS = CounterMetric(
+    'ao3_work_cache_lookups_total', 'Shared work metadata cache lookups by stage (blurb, enrich) and result', ('stage', 'result')
+)
+WORK_CACHE_EVICTIONS = CounterMetric('ao3_work_cache_evictions_total', 'Work cache entries dropped by reason', ('reason',))
+WORK_CACHE_ENTRIES = GaugeMetric('ao3_work_cache_entries', 'Works held in the shared metadata cache')
+LIMITER_WAIT_SECONDS = HistogramMetric('ao3_limiter_wait_seconds', 'Time requests waited for the shared AO3 request budget')
+LIMITER_QUEUED = GaugeMetric('ao3_limiter_queued_requests', 'Requests waiting for the shared AO3 request budget')
+LIMITER_BACKOFFS = CounterMetric('ao3_limiter_backoffs_total', 'Process-wide backoffs started after AO3 rate limited a request')
+HTTP_CONNECTIONS = CounterMetric(
+    'ao3_http_connections_total', 'Connections (TCP and TLS handshakes) opened to AO3 by transport', ('transport',)
+)
+RESULT_CACHE_LOOKUPS = CounterMetric('ao3_result_cache_lookups_total', 'Scrape result cache lookups by result', ('result',))
+RESULT_CACHE_EVICTIONS = CounterMetric('ao3_result_cache_evictions_total', 'Scrape results dropped from the cache by reason', ('reason',))
+RESULT_CACHE_ENTRIES = GaugeMetric('ao3_result_cache_entries', 'Finished scrapes held in the result cache')
+RESULT_CACHE_ITEMS = GaugeMetric('ao3_result_cache_items', 'History items held across all cached results')
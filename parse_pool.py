@@ -0,0 +1,83 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 0 keeps parsing on each scrape's own thread
+PARSE_WORKERS = int(os.environ.get('AO3_PARSE_WORKERS', 0))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def parse_workers():
+    """Number of worker processes history pages are parsed in (0 = parse inline)"""
+    return PARSE_WORKERS
+
+
+def _warm_worker():
+    # Importing the scraper pulls in BeautifulSoup, so the first real page doesn't pay for it
+    import ao3_scraper  # noqa: F401
+    return os.getpid()
+
+
+def get_parse_pool():
+    """Return the shared parse pool, starting it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn rather than fork: the web process has live threads, locks and sockets
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            logger.info('Started parse pool with %d worker processes', PARSE_WORKERS)
+        return _pool
+
+
+def warm_parse_pool():
+    """Start every worker process and import the parser in each"""
+    if PARSE_WORKERS:
+        pool = get_parse_pool()
+        pids = {future.result() for future in [pool.submit(_warm_worker) for _ in range(PARSE_WORKERS)]}
+        logger.info('Parse pool warmed (%d processes)', len(pids))
+
+
+def configure_parse_pool(workers):
+    """Change the number of parse workers, replacing any running pool"""
+    global PARSE_WORKERS
+    shutdown_parse_pool()
+    PARSE_WORKERS = int(workers)
+
+
+def shutdown_parse_pool():
+    """Stop the worker processes; the next parse starts a new pool if still enabled"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def parse_in_pool(content, encoding, page_number):
+    """
+    Send raw page bytes to a worker and return extract_history_page's result
+
+    Falls back to parsing on the calling thread if the pool has died.
+    """
+    global _pool
+    from ao3_scraper import extract_history_page
+
+    pool = get_parse_pool()
+    try:
+        return pool.submit(extract_history_page, content, page_number, encoding).result()
+    except BrokenProcessPool:
+        logger.warning('Parse pool is broken; parsing page %d on the scrape thread', page_number)
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return extract_history_page(content, page_number, encoding)
@@ -0,0 +1,140 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+from history_item import as_history_item
+
+COMPACT_FORMAT = 'compact-v1'
+
+# Column order of each row in a compact payload
+COMPACT_FIELDS = [
+    'title', 'author', 'url', 'wordCount', 'tags', 'characters', 'relationships',
+    'warnings', 'categories', 'rating', 'fandoms', 'lastVisited', 'kudos', 'chapters', 'complete'
+]
+
+# Responses smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def encode_compact_items(items):
+    """
+    Encode history items as a shared string table plus index arrays
+
+    Every author, tag, character, relationship, warning, category, rating,
+    fandom and visit date is stored once in 'strings' and referenced by index.
+    Titles and URLs are unique per work, so they are kept inline.
+    """
+    strings = []
+    index = {}
+
+    def ref(value):
+        if value is None:
+            return None
+        position = index.get(value)
+        if position is None:
+            position = index[value] = len(strings)
+            strings.append(value)
+        return position
+
+    rows = []
+    for item in items:
+        item = as_history_item(item)
+        rows.append([
+            item.title,
+            ref(item.author),
+            item.url,
+            item.word_count,
+            [ref(tag) for tag in item.tags],
+            [ref(character) for character in item.characters],
+            [ref(relationship) for relationship in item.relationships],
+            [ref(warning) for warning in item.warnings],
+            [ref(category) for category in item.categories],
+            ref(item.rating),
+            [ref(fandom) for fandom in item.fandoms],
+            ref(item.last_visited),
+            item.kudos,
+            ref(item.chapters),
+            item.complete
+        ])
+
+    return {
+        'format': COMPACT_FORMAT,
+        'fields': COMPACT_FIELDS,
+        'strings': strings,
+        'rows': rows
+    }
+
+
+def decode_compact_items(payload):
+    """Expand a compact payload back into the plain item dict schema"""
+    strings = payload['strings']
+    items = []
+    for row in payload['rows']:
+        (title, author, url, word_count, tags, characters, relationships,
+         warnings, categories, rating, fandoms, last_visited, kudos, chapters, complete) = row
+        items.append({
+            'title': title,
+            'author': strings[author],
+            'url': url,
+            'wordCount': word_count,
+            'tags': [strings[i] for i in tags],
+            'characters': [strings[i] for i in characters],
+            'relationships': [strings[i] for i in relationships],
+            'warnings': [strings[i] for i in warnings],
+            'categories': [strings[i] for i in categories],
+            'rating': strings[rating],
+            'fandoms': [strings[i] for i in fandoms],
+            'lastVisited': strings[last_visited] if last_visited is not None else None,
+            'kudos': kudos,
+            'chapters': strings[chapters] if chapters is not None else None,
+            'complete': complete
+        })
+    return items
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick 'br', 'gzip' or None from an Accept-Encoding header value"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.strip().replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        accepted.add(coding.strip().lower())
+
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress_body(data, encoding):
+    """Compress a complete response body with the negotiated encoding"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a streamed response chunk by chunk
+
+    Each chunk is flushed as soon as it is compressed so server-sent events
+    still reach the browser immediately.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode('utf-8')) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
@@ -0,0 +1,176 @@
+from collections import Counter
+from datetime import datetime
+import logging
+import os
+import re
+import sys
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = os.environ.get('AO3_PROFILE_DIR', '/tmp/ao3_profiles')
+PROFILE_MAX_FILES = int(os.environ.get('AO3_PROFILE_MAX_FILES', 50))
+SAMPLE_INTERVAL = float(os.environ.get('AO3_PROFILE_INTERVAL', 0.005))
+
+# Functions whose time is deliberate pacing rather than work: pacing sleeps and
+# turns in the shared request budget
+SLEEP_FUNCTIONS = {'ao3_scraper:delay', 'rate_limiter:acquire'}
+# Functions that block on work done elsewhere: pages on the fetcher threads
+# (sampled themselves) or parsing in AO3_PARSE_WORKERS processes (not sampled).
+# Any other stack blocked in a threading wait counts as waiting too
+WAIT_FUNCTIONS = {'ao3_scraper:result', 'parse_pool:parse_in_pool'}
+
+# Thread id -> sampler for every thread whose stacks a running profile includes
+_followed_threads = {}
+_followed_lock = threading.Lock()
+
+
+def profiling_enabled(request_flag=None):
+    """True when AO3_PROFILE is set or the request asked for profiling"""
+    truthy = ('1', 'true', 'yes', 'on')
+    if os.environ.get('AO3_PROFILE', '').lower() in truthy:
+        return True
+    return str(request_flag or '').lower() in truthy
+
+
+def follow_profiled_thread():
+    """
+    Return a callable that adds the thread it runs on to the calling thread's profile
+
+    Call it where worker threads are created (e.g. as a ThreadPoolExecutor
+    initializer) so work handed to them shows up in the profile. Returns
+    None when the calling thread isn't being profiled.
+    """
+    with _followed_lock:
+        sampler = _followed_threads.get(threading.get_ident())
+    if sampler is None:
+        return None
+    return lambda: sampler.add_thread(threading.get_ident(), threading.current_thread().name)
+
+
+class StackSampler(threading.Thread):
+    """
+    Periodically sample a thread's Python stack into collapsed-stack counts
+
+    Threads added with add_thread (see follow_profiled_thread) are sampled
+    too, under a node named after the thread.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        # Thread id -> node its stacks are grouped under (None for the profiled thread)
+        self._threads = {thread_id: None}
+        self._stopped = threading.Event()
+        with _followed_lock:
+            _followed_threads[thread_id] = self
+
+    def add_thread(self, thread_id, name):
+        # page-fetch_0, page-fetch_1, ... are grouped as one node
+        self._threads[thread_id] = f'thread:{re.sub(r"[_-]?[0-9]+$", "", name)}'
+        with _followed_lock:
+            _followed_threads[thread_id] = self
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id, node in list(self._threads.items()):
+                frame = frames.get(thread_id)
+                stack = self._collapse(frame, node) if frame is not None else None
+                if stack is not None:
+                    self.stacks[stack] += 1
+
+    def _collapse(self, frame, node=None):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            # Stacks start at the profiled function, not the web server above it
+            if code is run_profiled.__code__:
+                break
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f'{module}:{code.co_name}')
+            frame = frame.f_back
+        names.reverse()
+        # Worker threads start in threading's bootstrap and the executor's work loop
+        while names and names[0].startswith(('threading:', 'thread:')):
+            names.pop(0)
+        if node and not names:
+            # An idle worker waiting for its next task
+            return None
+        if node:
+            names.insert(0, node)
+
+        # Root every stack under [sleep], [wait] or [active] so they show up as separate towers
+        if SLEEP_FUNCTIONS.intersection(names):
+            root = '[sleep]'
+            if names[-1] == 'ao3_scraper:delay':
+                names.append('time.sleep')
+        elif WAIT_FUNCTIONS.intersection(names) or names[-1:] == ['threading:wait']:
+            root = '[wait]'
+        else:
+            root = '[active]'
+        return ';'.join([root] + names)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        with _followed_lock:
+            for thread_id in self._threads:
+                if _followed_threads.get(thread_id) is self:
+                    del _followed_threads[thread_id]
+
+
+def _prune_profiles(directory, max_files):
+    profiles = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.collapsed')),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    for entry in profiles[:max(len(profiles) - max_files, 0)]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def write_profile(label, stacks, interval=SAMPLE_INTERVAL, directory=None):
+    """Write collapsed stacks (speedscope / flamegraph.pl format) and return the file path"""
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    filename = f'{datetime.now().strftime("%Y%m%d-%H%M%S")}-{label}-{uuid.uuid4().hex[:8]}.collapsed'
+    path = os.path.join(directory, filename)
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+    _prune_profiles(directory, PROFILE_MAX_FILES)
+
+    # Samples from several threads can add up to more than the wall time
+    samples = Counter(stack.split(';', 1)[0] for stack in stacks.elements())
+    logger.info('Profile for %s written to %s (active ~%.1fs, sleep ~%.1fs, wait ~%.1fs thread time)',
+                label, path, samples['[active]'] * interval, samples['[sleep]'] * interval,
+                samples['[wait]'] * interval)
+    return path
+
+
+def run_profiled(enabled, label, func, *args, **kwargs):
+    """
+    Call func(*args, **kwargs), sampling its stacks to a profile file when enabled
+
+    When disabled this is a plain call, so there is no profiling overhead.
+    """
+    if not enabled:
+        return func(*args, **kwargs)
+
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        sampler.stop()
+        try:
+            write_profile(label, sampler.stacks, sampler.interval)
+        except OSError as e:
+            logger.warning('Could not write profile for %s: %s', label, e)
@@ -0,0 +1,210 @@
+from email.utils import parsedate_to_datetime
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from metrics import LIMITER_BACKOFFS, LIMITER_QUEUED, LIMITER_WAIT_SECONDS, QUEUED_SCRAPES
+
+# Requests per minute to AO3 from this whole process, shared by every web scrape
+GLOBAL_RPM = float(os.environ.get('AO3_GLOBAL_RPM', 40))
+# Process-wide pause after a 429 that has no usable Retry-After header
+DEFAULT_BACKOFF_SECONDS = 60
+# Waits shorter than this aren't announced to the job
+ANNOUNCE_WAIT_SECONDS = 1.0
+
+
+def parse_retry_after(value, default=DEFAULT_BACKOFF_SECONDS):
+    """Seconds to back off for a Retry-After header value (seconds or an HTTP date)"""
+    if value is None:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+class RequestBudget:
+    """
+    Share one requests-per-minute budget between several jobs
+
+    Requests are spaced at least 60 / requests_per_minute seconds apart.
+    When more than one job is waiting, the next slot goes to the request
+    with the lowest weighted-fair-queuing finish tag. A job with weight 2
+    therefore gets twice the share of a job with weight 1, and a job that
+    was idle can't save up turns to burst later. backoff() holds every job
+    until the given time has passed.
+    """
+
+    def __init__(self, requests_per_minute, clock=time.monotonic):
+        self.interval = 60.0 / requests_per_minute
+        self._clock = clock
+        self._condition = threading.Condition()
+        self._queue = []
+        # job -> requests it has waiting (several with page concurrency)
+        self._waiting_jobs = {}
+        self._sequence = itertools.count()
+        self._finish_tags = {}
+        self._virtual_time = 0.0
+        self._next_slot = 0.0
+        self._blocked_until = 0.0
+        self.granted = 0
+
+    @property
+    def requests_per_minute(self):
+        return 60.0 / self.interval
+
+    @property
+    def queued(self):
+        """Requests currently waiting for a slot"""
+        return len(self._queue)
+
+    @property
+    def queued_jobs(self):
+        """Jobs (scrapes) with at least one request waiting for a slot"""
+        return len(self._waiting_jobs)
+
+    def _export_queue(self):
+        # Called under the lock whenever the queue changes
+        LIMITER_QUEUED.set(len(self._queue))
+        QUEUED_SCRAPES.set(len(self._waiting_jobs))
+
+    def set_rate(self, requests_per_minute):
+        """Change the budget; waiting requests pick up the new spacing"""
+        with self._condition:
+            self._next_slot += 60.0 / requests_per_minute - self.interval
+            self.interval = 60.0 / requests_per_minute
+            self._condition.notify_all()
+
+    def backoff(self, seconds):
+        """Hold every job's requests for at least seconds (e.g. after a 429)"""
+        with self._condition:
+            self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+            self._condition.notify_all()
+        LIMITER_BACKOFFS.inc()
+
+    def backoff_remaining(self):
+        """Seconds left in the current backoff, or 0"""
+        return max(self._blocked_until - self._clock(), 0.0)
+
+    def acquire(self, job, weight=1.0, on_wait=None):
+        """
+        Block until job may send its next request; returns the seconds spent waiting
+
+        on_wait, when given, is called once with the estimated wait if that is
+        at least ANNOUNCE_WAIT_SECONDS. It runs under the budget's lock, so it
+        must not block.
+        """
+        started = self._clock()
+        with self._condition:
+            tag = max(self._virtual_time, self._finish_tags.get(job, 0.0)) + 1.0 / weight
+            self._finish_tags[job] = tag
+            entry = (tag, next(self._sequence))
+            heapq.heappush(self._queue, entry)
+            self._waiting_jobs[job] = self._waiting_jobs.get(job, 0) + 1
+            self._export_queue()
+            self._condition.notify_all()
+
+            if on_wait is not None:
+                ahead = sum(1 for queued in self._queue if queued < entry)
+                estimate = max(self._next_slot, self._blocked_until) - started + ahead * self.interval
+                if estimate >= ANNOUNCE_WAIT_SECONDS:
+                    on_wait(estimate)
+
+            while True:
+                now = self._clock()
+                if self._queue[0] is entry:
+                    ready_at = max(self._next_slot, self._blocked_until)
+                    if now >= ready_at:
+                        heapq.heappop(self._queue)
+                        if self._waiting_jobs[job] == 1:
+                            del self._waiting_jobs[job]
+                        else:
+                            self._waiting_jobs[job] -= 1
+                        self._export_queue()
+                        self._virtual_time = tag
+                        self._next_slot = now + self.interval
+                        self.granted += 1
+                        self._condition.notify_all()
+                        waited = now - started
+                        LIMITER_WAIT_SECONDS.observe(waited)
+                        return waited
+                    self._condition.wait(ready_at - now)
+                else:
+                    self._condition.wait()
+
+    def forget(self, job):
+        """Drop a finished job's fairness state"""
+        with self._condition:
+            self._finish_tags.pop(job, None)
+
+    def job(self, name=None, weight=1.0, on_wait=None):
+        """Return a BudgetJob handle for one scrape"""
+        return BudgetJob(self, name, weight, on_wait)
+
+
+class BudgetJob:
+    """
+    One scrape's handle on a RequestBudget
+
+    Call it before each request. Report 429s with rate_limited() so every job
+    sharing the budget backs off. Requests and wait times are counted for
+    progress reporting.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, budget, name=None, weight=1.0, on_wait=None):
+        # The weight divides the job's finish tags, so it must be a positive number
+        if not weight > 0:
+            raise ValueError(f'Budget job weight must be positive, not {weight!r}')
+        self.budget = budget
+        # Two scrapes of the same account are still queued as separate jobs
+        self.key = (name, next(self._ids))
+        self.weight = weight
+        self.on_wait = on_wait
+        self.requests = 0
+        self.wait_seconds = 0.0
+        self.last_wait_seconds = 0.0
+
+    def __call__(self):
+        waited = self.budget.acquire(self.key, self.weight, self.on_wait)
+        self.requests += 1
+        self.wait_seconds += waited
+        self.last_wait_seconds = waited
+        return waited
+
+    def rate_limited(self, retry_after=None):
+        """Back off the whole budget for Retry-After (or DEFAULT_BACKOFF_SECONDS)"""
+        self.budget.backoff(parse_retry_after(retry_after))
+
+    def close(self):
+        self.budget.forget(self.key)
+
+    def stats(self):
+        """Wait times in the camelCase shape used by progress events"""
+        return {
+            'requests': self.requests,
+            'waitSeconds': round(self.wait_seconds, 1),
+            'lastWaitSeconds': round(self.last_wait_seconds, 1),
+            'queued': self.budget.queued,
+            'backoffSeconds': round(self.budget.backoff_remaining(), 1)
+        }
+
+
+_request_limiter = None
+_request_limiter_lock = threading.Lock()
+
+
+def get_request_limiter():
+    """The process-wide budget every web scrape's requests go through (AO3_GLOBAL_RPM)"""
+    global _request_limiter
+    with _request_limiter_lock:
+        if _request_limiter is None:
+            _request_limiter = RequestBudget(GLOBAL_RPM)
+        return _request_limiter
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+
+from metrics import RESULT_CACHE_ENTRIES, RESULT_CACHE_EVICTIONS, RESULT_CACHE_ITEMS, RESULT_CACHE_LOOKUPS
+
+# Seconds a finished scrape is reused for an identical request (0 turns the cache off)
+RESULT_CACHE_TTL = float(os.environ.get('AO3_RESULT_CACHE_TTL', 300))
+# Most results kept, and most history items held across all of them
+RESULT_CACHE_SIZE = int(os.environ.get('AO3_RESULT_CACHE_SIZE', 32))
+RESULT_CACHE_MAX_ITEMS = int(os.environ.get('AO3_RESULT_CACHE_MAX_ITEMS', 100000))
+
+# Fingerprints are keyed per process, so they can't be checked against guessed passwords elsewhere
+_FINGERPRINT_KEY = secrets.token_bytes(32)
+
+
+def credential_fingerprint(username, password):
+    """Keyed hash of a username and password; the password itself is never stored"""
+    message = f'{username.lower()}\0{password}'.encode('utf-8')
+    return hmac.new(_FINGERPRINT_KEY, message, hashlib.sha256).hexdigest()
+
+
+def result_cache_key(username, password, year=None, yearly=False, enrich=False):
+    """Cache key for a scrape request; only the same credentials and options map to the same key"""
+    return (username.lower(), int(year) if year else None, bool(yearly), bool(enrich),
+            credential_fingerprint(username, password))
+
+
+@dataclass
+class CachedResult:
+    """A finished scrape: its items, statistics (with image paths) and the stat image version they point at"""
+    items: list
+    statistics: dict
+    image_version: str = None
+    history_token: str = None
+    stored_at: float = field(default_factory=time.monotonic)
+
+    def age(self):
+        return time.monotonic() - self.stored_at
+
+
+class ResultCache:
+    """
+    Thread-safe LRU of finished scrapes for answering repeated identical requests
+
+    Entries expire after ttl seconds. The least recently used are evicted
+    once there are more than max_entries results or more than max_items
+    history items in total.
+    """
+
+    def __init__(self, ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_SIZE, max_items=RESULT_CACHE_MAX_ITEMS):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_items = max_items
+        self._entries = OrderedDict()
+        self.item_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key):
+        """Return the CachedResult for key, or None if absent or expired"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.age() > self.ttl:
+                self._remove(key, 'expired')
+                entry = None
+            if entry is None:
+                RESULT_CACHE_LOOKUPS.inc(result='miss')
+                return None
+            self._entries.move_to_end(key)
+        RESULT_CACHE_LOOKUPS.inc(result='hit')
+        return entry
+
+    def put(self, key, entry):
+        """Store entry under key, evicting the least recently used results to stay within the bounds"""
+        if not self.enabled or len(entry.items) > self.max_items:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key, 'replaced')
+            self._entries[key] = entry
+            self.item_count += len(entry.items)
+            while len(self._entries) > self.max_entries or self.item_count > self.max_items:
+                self._remove(next(iter(self._entries)), 'lru')
+            self._update_gauges()
+
+    def _remove(self, key, reason):
+        entry = self._entries.pop(key)
+        self.item_count -= len(entry.items)
+        RESULT_CACHE_EVICTIONS.inc(reason=reason)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        RESULT_CACHE_ENTRIES.set(len(self._entries))
+        RESULT_CACHE_ITEMS.set(self.item_count)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.item_count = 0
+            self._update_gauges()
+
+
+RESULT_CACHE = ResultCache()
+
+
+def result_cache_stats():
+    """Entries and items held plus hit and miss counts since startup"""
+    lookups = {result: value for _, (result,), _, value in RESULT_CACHE_LOOKUPS.samples()}
+    hits, misses = lookups.get('hit', 0), lookups.get('miss', 0)
+    return {
+        'entries': len(RESULT_CACHE),
+        'items': RESULT_CACHE.item_count,
+        'maxEntries': RESULT_CACHE.max_entries,
+        'maxItems': RESULT_CACHE.max_items,
+        'ttlSeconds': RESULT_CACHE.ttl,
+        'hits': hits,
+        'misses': misses,
+        'hitRate': round(hits / (hits + misses), 4) if hits + misses else None
+    }
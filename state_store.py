@@ -0,0 +1,379 @@
+"""
+Job, progress event and image state that every app instance can see
+
+AO3_STATE_STORE picks where it lives:
+
+    memory                      this process only (default)
+    sqlite:////path/state.db    every process on one host, through SQLite's file locking
+    redis://host:6379/0         every instance that can reach the server (needs the redis package)
+
+A scrape runs on the instance that accepted it, but it writes its events
+here, so any instance can stream them (and replay them after a dropped
+connection). The statistics behind each set of stat cards are stored
+under the cards' content version, so any instance can draw and serve them.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+STATE_STORE_URL = os.environ.get('AO3_STATE_STORE', 'memory')
+# Seconds jobs, their events and stored blobs are kept after their last write
+STATE_TTL = float(os.environ.get('AO3_STATE_TTL', 600))
+# Longest gap between MemoryStore sweeps for expired jobs and blobs
+PURGE_INTERVAL = 30
+
+
+class DeferredJSON:
+    """
+    Event data whose JSON is only built when the event is read
+
+    MemoryStore keeps event data by reference, so an item batch wrapped in
+    this costs it no more than the items themselves; the shared stores
+    encode it when they write the event.
+    """
+
+    def __init__(self, build, *args):
+        self._build = build
+        self._args = args
+
+    def value(self):
+        return self._build(*self._args)
+
+
+def _build_deferred(value):
+    if isinstance(value, DeferredJSON):
+        return value.value()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def encode_event_data(data):
+    """JSON text for event data, building any DeferredJSON values in it"""
+    return json.dumps(data, default=_build_deferred)
+
+
+class StateStore:
+    """
+    Interface every backend implements
+
+    Jobs are a dict of fields (status, username, ...) plus an append-only
+    list of (event, data) pairs numbered from 1. Event data is handed back
+    as JSON text, ready to send as an SSE data line; it may hold
+    DeferredJSON values and must not be changed once appended. Blobs are
+    bytes under a string key.
+    """
+    # Whether other processes see what is written here
+    shared = True
+
+    def __init__(self, ttl=STATE_TTL):
+        self.ttl = ttl
+
+    def create_job(self, job_id, **fields):
+        raise NotImplementedError
+
+    def update_job(self, job_id, **fields):
+        raise NotImplementedError
+
+    def get_job(self, job_id):
+        """The job's fields, or None if it doesn't exist or has expired"""
+        raise NotImplementedError
+
+    def append_event(self, job_id, event, data):
+        """Append an event and return its sequence number"""
+        raise NotImplementedError
+
+    def events_after(self, job_id, after=0):
+        """List of (sequence number, event, JSON data) for the events after the given number"""
+        raise NotImplementedError
+
+    def put_blob(self, key, data):
+        raise NotImplementedError
+
+    def get_blob(self, key):
+        """Stored bytes for key, or None"""
+        raise NotImplementedError
+
+
+class MemoryStore(StateStore):
+    """Dicts in this process; the single-instance default. Event data is kept as is and encoded when read"""
+    shared = False
+
+    def __init__(self, ttl=STATE_TTL):
+        super().__init__(ttl)
+        self._jobs = {}
+        self._blobs = {}
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+
+    def _purge(self, now):
+        # Called under the lock by every write and event read, sweeping at most every PURGE_INTERVAL
+        if now < self._next_purge:
+            return
+        self._next_purge = now + min(self.ttl, PURGE_INTERVAL)
+        for job_id in [job_id for job_id, job in self._jobs.items() if job['expires'] < now]:
+            del self._jobs[job_id]
+        for key in [key for key, (expires, _) in self._blobs.items() if expires < now]:
+            del self._blobs[key]
+
+    def create_job(self, job_id, **fields):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._jobs[job_id] = {'fields': dict(fields), 'events': [], 'expires': now + self.ttl}
+
+    def update_job(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['fields'].update(fields)
+                job['expires'] = time.time() + self.ttl
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['expires'] < time.time():
+                return None
+            return dict(job['fields'])
+
+    def append_event(self, job_id, event, data):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            job = self._jobs[job_id]
+            job['events'].append((event, data))
+            job['expires'] = now + self.ttl
+            return len(job['events'])
+
+    def events_after(self, job_id, after=0):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            job = self._jobs.get(job_id)
+            events = job['events'][after:] if job and job['expires'] >= now else []
+        return [(after + offset, event, encode_event_data(data)) for offset, (event, data) in enumerate(events, 1)]
+
+    def put_blob(self, key, data):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._blobs[key] = (now + self.ttl, data)
+
+    def get_blob(self, key):
+        with self._lock:
+            entry = self._blobs.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    fields TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL,
+    expires_at REAL NOT NULL
+);
+'''
+
+
+class SQLiteStore(StateStore):
+    """A SQLite file shared by every process on the host (WAL mode, one connection per thread)"""
+
+    def __init__(self, path, ttl=STATE_TTL):
+        super().__init__(ttl)
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.executescript(SQLITE_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def create_job(self, job_id, **fields):
+        now = time.time()
+        with self._connection() as connection:
+            # Expired jobs are cleared out whenever a new one starts
+            expired = [row[0] for row in connection.execute('SELECT id FROM jobs WHERE expires_at < ?', (now,))]
+            connection.executemany('DELETE FROM job_events WHERE job_id = ?', [(expired_id,) for expired_id in expired])
+            connection.execute('DELETE FROM jobs WHERE expires_at < ?', (now,))
+            connection.execute('DELETE FROM blobs WHERE expires_at < ?', (now,))
+            connection.execute(
+                'INSERT OR REPLACE INTO jobs (id, fields, expires_at) VALUES (?, ?, ?)',
+                (job_id, json.dumps(fields), now + self.ttl)
+            )
+
+    def update_job(self, job_id, **fields):
+        with self._connection() as connection:
+            row = connection.execute('SELECT fields FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if row is not None:
+                connection.execute(
+                    'UPDATE jobs SET fields = ?, expires_at = ? WHERE id = ?',
+                    (json.dumps({**json.loads(row[0]), **fields}), time.time() + self.ttl, job_id)
+                )
+
+    def get_job(self, job_id):
+        row = self._connection().execute(
+            'SELECT fields FROM jobs WHERE id = ? AND expires_at >= ?', (job_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def append_event(self, job_id, event, data):
+        with self._connection() as connection:
+            seq = connection.execute(
+                'SELECT COALESCE(MAX(seq), 0) + 1 FROM job_events WHERE job_id = ?', (job_id,)
+            ).fetchone()[0]
+            connection.execute(
+                'INSERT INTO job_events (job_id, seq, event, data) VALUES (?, ?, ?, ?)',
+                (job_id, seq, event, encode_event_data(data))
+            )
+            connection.execute('UPDATE jobs SET expires_at = ? WHERE id = ?', (time.time() + self.ttl, job_id))
+        return seq
+
+    def events_after(self, job_id, after=0):
+        return self._connection().execute(
+            'SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq', (job_id, after)
+        ).fetchall()
+
+    def put_blob(self, key, data):
+        with self._connection() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO blobs (key, data, expires_at) VALUES (?, ?, ?)',
+                (key, data, time.time() + self.ttl)
+            )
+
+    def get_blob(self, key):
+        row = self._connection().execute(
+            'SELECT data FROM blobs WHERE key = ? AND expires_at >= ?', (key, time.time())
+        ).fetchone()
+        return bytes(row[0]) if row else None
+
+
+class RedisStore(StateStore):
+    """Keys on a Redis (or Redis-compatible) server; every key expires STATE_TTL after its last write"""
+
+    def __init__(self, url, ttl=STATE_TTL, prefix='ao3:'):
+        super().__init__(ttl)
+        try:
+            import redis
+        except ImportError:
+            raise Exception('The Redis state store requires the redis package (pip install redis)')
+        self._redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _expire_in(self):
+        return max(int(self.ttl), 1)
+
+    def create_job(self, job_id, **fields):
+        self._redis.set(f'{self.prefix}job:{job_id}', json.dumps(fields), ex=self._expire_in())
+
+    def update_job(self, job_id, **fields):
+        key = f'{self.prefix}job:{job_id}'
+        current = self._redis.get(key)
+        if current is not None:
+            self._redis.set(key, json.dumps({**json.loads(current), **fields}), ex=self._expire_in())
+
+    def get_job(self, job_id):
+        fields = self._redis.get(f'{self.prefix}job:{job_id}')
+        return json.loads(fields) if fields is not None else None
+
+    def append_event(self, job_id, event, data):
+        key = f'{self.prefix}job:{job_id}:events'
+        pipeline = self._redis.pipeline()
+        pipeline.rpush(key, json.dumps([event, encode_event_data(data)]))
+        pipeline.expire(key, self._expire_in())
+        pipeline.expire(f'{self.prefix}job:{job_id}', self._expire_in())
+        return pipeline.execute()[0]
+
+    def events_after(self, job_id, after=0):
+        entries = self._redis.lrange(f'{self.prefix}job:{job_id}:events', after, -1)
+        return [(after + offset, *json.loads(entry)) for offset, entry in enumerate(entries, 1)]
+
+    def put_blob(self, key, data):
+        self._redis.set(f'{self.prefix}blob:{key}', data, ex=self._expire_in())
+
+    def get_blob(self, key):
+        return self._redis.get(f'{self.prefix}blob:{key}')
+
+
+class JobPublisher:
+    """
+    Write one job's events to the store from a background thread, in order
+
+    publish() only queues the event, so scrape callbacks (some of which run
+    under the request budget's lock) never wait on the store. close() writes
+    what is left and then the job's final fields, so anyone who sees the job
+    finished has every event available.
+    """
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f'job-{job_id[:8]}', daemon=True)
+        self._thread.start()
+
+    def publish(self, event, data):
+        self._queue.put((event, data))
+
+    def close(self, **fields):
+        self._queue.put(None)
+        self._thread.join()
+        self.store.update_job(self.job_id, **fields)
+
+    def _run(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            try:
+                self.store.append_event(self.job_id, *entry)
+            except Exception as error:
+                logger.error('Could not store %s event for job %s: %s', entry[0], self.job_id, error)
+
+
+_state_store = None
+_state_store_lock = threading.Lock()
+
+
+def open_state_store(url):
+    """Create the backend a store URL names"""
+    if url == 'memory':
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        # sqlite:///relative.db or sqlite:////absolute/path.db
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://')):
+        return RedisStore(url)
+    raise Exception(f'Unknown AO3_STATE_STORE {url!r}; expected memory, sqlite:///path or redis://host')
+
+
+def get_state_store():
+    """The process-wide store named by AO3_STATE_STORE, opened on first use"""
+    global _state_store
+    with _state_store_lock:
+        if _state_store is None:
+            _state_store = open_state_store(STATE_STORE_URL)
+            logger.info('Keeping job and image state in %s', type(_state_store).__name__)
+        return _state_store
@@ -0,0 +1,47 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import json
+import threading
+import time
+
+from metrics import PHASE_SECONDS
+
+
+class PhaseTimer:
+    """Accumulate wall-clock time spent in the named phases of one scrape"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        # Pages fetched concurrently record their phases from several threads
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        """Record seconds spent in phase"""
+        with self._lock:
+            self.durations[phase] += seconds
+            self.counts[phase] += 1
+        PHASE_SECONDS.observe(seconds, phase=phase)
+
+    @contextmanager
+    def span(self, phase):
+        """Time the enclosed block as one occurrence of phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def summary(self, **fields):
+        """Return the phase totals (seconds) and counts as a flat dict"""
+        summary = dict(fields)
+        summary['total_s'] = round(time.perf_counter() - self.started, 3)
+        for phase, seconds in self.durations.items():
+            summary[f'{phase}_s'] = round(seconds, 3)
+            summary[f'{phase}_n'] = self.counts[phase]
+        return summary
+
+    def log_summary(self, logger, **fields):
+        """Emit the summary as a single structured log line"""
+        logger.info('scrape_summary %s', json.dumps(self.summary(**fields), sort_keys=True))
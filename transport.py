@@ -0,0 +1,286 @@
+"""
+HTTP backends the scraper sends AO3 requests through
+
+A transport hands out one session per scrape attempt. Sessions behave like
+requests.Session (get, post, headers) and return requests.Response objects
+whatever the backend, so the scraper's status and error handling is the
+same for all of them. Sessions keep their own cookies, but the connection
+pool belongs to the transport and is shared by every scrape in the process.
+"""
+import logging
+import os
+import ssl
+import threading
+
+import requests
+
+from metrics import HTTP_CONNECTIONS
+
+logger = logging.getLogger(__name__)
+
+# 'requests' (default) or 'httpx' (HTTP/2; needs httpx[http2])
+HTTP_TRANSPORT = os.environ.get('AO3_HTTP_TRANSPORT', 'requests')
+# Keep-alive connections kept per host; one AO3 host, shared by every scrape
+HTTP_POOL_SIZE = int(os.environ.get('AO3_HTTP_POOL_SIZE', 10))
+
+
+def make_response(method, url, status, body, headers=None, final_url=None, encoding='utf-8', reason=None,
+                  elapsed=None):
+    """Build a requests.Response from an already decoded body"""
+    response = requests.Response()
+    response.status_code = status
+    response.reason = reason
+    response.url = final_url or url
+    response.headers.update(headers or {})
+    # The body is already decompressed
+    response.headers.pop('Content-Encoding', None)
+    response._content = body if isinstance(body, bytes) else body.encode(encoding)
+    response.encoding = encoding
+    response.request = requests.Request(method, url).prepare()
+    if elapsed is not None:
+        response.elapsed = elapsed
+    return response
+
+
+class Transport:
+    """
+    Interface every HTTP backend implements
+
+    new_session() returns a fresh session (own cookies) for one scrape attempt.
+    reset_connections() drops pooled connections (e.g. after TLS errors)
+    without invalidating sessions already handed out.
+    stats() reports how many connections (TCP + TLS handshakes) were opened.
+    """
+    name = 'base'
+
+    def __init__(self):
+        self.connections_opened = 0
+        self._stats_lock = threading.Lock()
+
+    def new_session(self):
+        raise NotImplementedError
+
+    def reset_connections(self):
+        pass
+
+    def _connection_opened(self):
+        with self._stats_lock:
+            self.connections_opened += 1
+        HTTP_CONNECTIONS.inc(transport=self.name)
+
+    def stats(self):
+        return {'transport': self.name, 'connectionsOpened': self.connections_opened}
+
+
+class _SharedPoolSession(requests.Session):
+    """requests.Session whose adapters belong to a transport, so closing it keeps the pool"""
+
+    def close(self):
+        pass
+
+
+class RequestsTransport(Transport):
+    """requests/urllib3 with one tuned, thread-safe connection pool shared by all sessions"""
+    name = 'requests'
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE):
+        super().__init__()
+        self.pool_size = pool_size
+        self._adapter = self._make_adapter()
+
+    def _make_adapter(self):
+        from requests.adapters import HTTPAdapter
+        from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+        from urllib3.util.retry import Retry
+
+        transport = self
+
+        class CountingHTTPPool(HTTPConnectionPool):
+            def _new_conn(self):
+                transport._connection_opened()
+                return super()._new_conn()
+
+        class CountingHTTPSPool(HTTPSConnectionPool):
+            def _new_conn(self):
+                transport._connection_opened()
+                return super()._new_conn()
+
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+            # Only connections that never reached AO3 are retried here. Error responses
+            # go back to the scraper, whose retries each wait their turn in the request budget
+            max_retries=Retry(total=3, connect=3, read=0, status=0, other=0, backoff_factor=1)
+        )
+        adapter.poolmanager.pool_classes_by_scheme = {'http': CountingHTTPPool, 'https': CountingHTTPSPool}
+        return adapter
+
+    def new_session(self):
+        session = _SharedPoolSession()
+        session.mount('https://', self._adapter)
+        session.mount('http://', self._adapter)
+        return session
+
+    def reset_connections(self):
+        # Empties the pools; sessions keep their cookies and reconnect on the next request
+        self._adapter.close()
+
+
+class HttpxSession(requests.Session):
+    """
+    requests.Session look-alike that sends through an httpx client
+
+    The client keeps this session's cookies; its connection pool is the
+    transport's. httpx errors are raised as the matching requests exceptions.
+    """
+
+    def __init__(self, client, trace=None):
+        super().__init__()
+        self._client = client
+        self._trace = trace
+
+    def request(self, method, url, params=None, data=None, headers=None, timeout=None, allow_redirects=True,
+                **kwargs):
+        import httpx
+
+        merged_headers = dict(self.headers)
+        merged_headers.update(headers or {})
+        try:
+            response = self._client.request(
+                method, url, params=params, data=data, headers=merged_headers, timeout=timeout,
+                follow_redirects=allow_redirects, extensions={'trace': self._trace} if self._trace else None
+            )
+        except httpx.TimeoutException as error:
+            raise requests.exceptions.Timeout(str(error)) from error
+        except httpx.ConnectError as error:
+            if isinstance(error.__context__, ssl.SSLError) or 'SSL' in str(error):
+                raise requests.exceptions.SSLError(str(error)) from error
+            raise requests.exceptions.ConnectionError(str(error)) from error
+        except httpx.TransportError as error:
+            raise requests.exceptions.ConnectionError(str(error)) from error
+
+        return make_response(
+            method, url, response.status_code, response.content, dict(response.headers),
+            final_url=str(response.url), encoding=response.encoding or 'utf-8',
+            reason=response.reason_phrase, elapsed=response.elapsed
+        )
+
+    def close(self):
+        # The client's transport is shared; there is nothing of this session's own to close
+        pass
+
+
+class HttpxTransport(Transport):
+    """httpx with HTTP/2 and keep-alive; concurrent scrapes share (and multiplex over) its connections"""
+    name = 'httpx'
+
+    def __init__(self, pool_size=HTTP_POOL_SIZE, http2=True):
+        super().__init__()
+        try:
+            import httpx
+        except ImportError:
+            raise Exception('The httpx transport requires the httpx package (pip install "httpx[http2]")')
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning('h2 is not installed; the httpx transport will use HTTP/1.1')
+                http2 = False
+        self.pool_size = pool_size
+        self.http2 = http2
+        self._transport = self._make_transport()
+
+    def _make_transport(self):
+        import httpx
+
+        return httpx.HTTPTransport(
+            http2=self.http2,
+            retries=3,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=self.pool_size)
+        )
+
+    def _trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            self._connection_opened()
+
+    def new_session(self):
+        import httpx
+
+        # A client per session keeps cookies apart; it never closes the shared transport
+        return HttpxSession(httpx.Client(transport=self._transport), self._trace)
+
+    def reset_connections(self):
+        # httpcore drops every pooled connection but the pool stays usable
+        self._transport.close()
+
+    def stats(self):
+        return {**super().stats(), 'http2': self.http2}
+
+
+class FixtureSession(requests.Session):
+    """Session that answers every request from a handler function instead of the network"""
+
+    def __init__(self, handler):
+        super().__init__()
+        self._handler = handler
+
+    def request(self, method, url, *args, **kwargs):
+        response = self._handler(method.upper(), url, **kwargs)
+        if isinstance(response, tuple):
+            response = make_response(method, url, *response)
+        return response
+
+
+class FixtureTransport(Transport):
+    """
+    Offline transport for fixtures and benchmarks
+
+    handler(method, url, **kwargs) returns a requests.Response or a
+    (status, body[, headers]) tuple.
+    """
+    name = 'fixture'
+
+    def __init__(self, handler):
+        super().__init__()
+        self.handler = handler
+
+    def new_session(self):
+        return FixtureSession(self.handler)
+
+
+TRANSPORTS = {
+    'requests': RequestsTransport,
+    'httpx': HttpxTransport
+}
+
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """The process-wide transport named by AO3_HTTP_TRANSPORT, created on first use"""
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            if HTTP_TRANSPORT not in TRANSPORTS:
+                raise Exception(f'Unknown AO3_HTTP_TRANSPORT {HTTP_TRANSPORT!r}; expected one of {", ".join(TRANSPORTS)}')
+            _transport = TRANSPORTS[HTTP_TRANSPORT]()
+            logger.info('Using the %s HTTP transport', _transport.name)
+        return _transport
+
+
+def configure_transport(name):
+    """Switch the process-wide transport to the named backend"""
+    global HTTP_TRANSPORT, _transport
+    with _transport_lock:
+        HTTP_TRANSPORT = name
+        _transport = None
+    return get_transport()
+
+
+def use_transport(transport):
+    """Make the given Transport instance the process-wide one (e.g. a replay transport for offline checks)"""
+    global _transport
+    with _transport_lock:
+        _transport = transport
+    return transport
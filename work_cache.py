@@ -0,0 +1,102 @@
+from collections import OrderedDict
+import os
+import re
+import threading
+import time
+
+from metrics import WORK_CACHE_ENTRIES, WORK_CACHE_EVICTIONS, WORK_CACHE_LOOKUPS
+
+# Popular works appear in many users' histories; this bounds how many are kept
+WORK_CACHE_SIZE = int(os.environ.get('AO3_WORK_CACHE_SIZE', 20000))
+# Word counts, chapters and tags change as works update, so entries expire
+WORK_CACHE_TTL = float(os.environ.get('AO3_WORK_CACHE_TTL', 3600))
+
+WORK_ID_PATTERN = re.compile(r'/works/(\d+)')
+
+
+def work_id_from_url(url):
+    """Numeric AO3 work ID from a work URL or path, or None"""
+    match = WORK_ID_PATTERN.search(url or '')
+    return int(match.group(1)) if match else None
+
+
+class WorkCache:
+    """
+    Thread-safe LRU of per-work metadata shared by every scrape in the process
+
+    Entries hold the blurb fields that are the same for every reader (not
+    lastVisited). They are dropped after ttl seconds, and the least recently
+    used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries=WORK_CACHE_SIZE, ttl=WORK_CACHE_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, work_id):
+        """Return the cached metadata dict for work_id, or None if absent or expired"""
+        with self._lock:
+            entry = self._entries.get(work_id)
+            if entry is None:
+                return None
+            stored_at, metadata = entry
+            if self._clock() - stored_at > self.ttl:
+                del self._entries[work_id]
+                WORK_CACHE_EVICTIONS.inc(reason='expired')
+                WORK_CACHE_ENTRIES.set(len(self._entries))
+                return None
+            self._entries.move_to_end(work_id)
+            return metadata
+
+    def put(self, work_id, metadata):
+        """Store metadata for work_id, evicting the least recently used entries when full"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[work_id] = (self._clock(), metadata)
+            self._entries.move_to_end(work_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                WORK_CACHE_EVICTIONS.inc(reason='lru')
+            WORK_CACHE_ENTRIES.set(len(self._entries))
+
+    def update(self, work_id, **fields):
+        """Merge fields into an existing entry without resetting its age; False if it is gone"""
+        with self._lock:
+            entry = self._entries.get(work_id)
+            if entry is None:
+                return False
+            stored_at, metadata = entry
+            self._entries[work_id] = (stored_at, {**metadata, **fields})
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            WORK_CACHE_ENTRIES.set(0)
+
+
+WORK_CACHE = WorkCache()
+
+
+def work_cache_stats():
+    """Entries in this process's cache plus lookup counts and hit rates since startup"""
+    lookups = {}
+    for _, (stage, result), _, value in WORK_CACHE_LOOKUPS.samples():
+        lookups.setdefault(stage, {'hits': 0, 'misses': 0})['hits' if result == 'hit' else 'misses'] = value
+    for counts in lookups.values():
+        total = counts['hits'] + counts['misses']
+        counts['hitRate'] = round(counts['hits'] / total, 4) if total else None
+
+    return {
+        'entries': len(WORK_CACHE),
+        'maxEntries': WORK_CACHE.max_entries,
+        'ttlSeconds': WORK_CACHE.ttl,
+        'lookups': lookups
+    }